@@ -1,7 +1,50 @@
+import json
+import re
+from typing import Optional
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
 
+from dhdconf.document.metadata import normalized_tag
 from dhdconf.models import ConftoolUser, ConftoolDocument, ConftoolEmail, ConftoolAccessRight, ConftoolUserInvite, \
-    ImportLog
+    ConftoolDocumentTag, ImportLog, ImportLogTrace, ImportHealth
+
+ORCID_PATTERN = re.compile(r"^\d{4}-\d{4}-\d{4}-\d{3}[\dX]$")
+# The trigram index only narrows down searches for at least one whole trigram,
+# shorter terms would scan all messages
+MESSAGE_SEARCH_LENGTH = 3
+
+
+def _estimated_count(queryset) -> Optional[int]:
+    # The planner's estimate of the rows a query returns, PostgreSQL only
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    # Exact counts of large tables take seconds on PostgreSQL. Above this limit the
+    # planner's estimate is shown instead, which is good enough to page through.
+    EXACT_COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        estimate = _estimated_count(self.object_list)
+        if estimate is None or estimate < self.EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
 
 
 @admin.register(ConftoolUser)
@@ -9,13 +52,80 @@ class ConftoolUserAdmin(admin.ModelAdmin):
     pass
 
 
+def _tagged(kind: str, value: str) -> Q:
+    # Documents with a tag, as a subquery so that the result has no duplicates
+    return Q(pk__in=ConftoolDocumentTag.objects.filter(kind=kind, value=value).values("document_id"))
+
+
+class TopicListFilter(admin.SimpleListFilter):
+    title = "topic"
+    parameter_name = "topic"
+
+    def lookups(self, request, model_admin):
+        topics = ConftoolDocumentTag.objects.filter(
+            kind=ConftoolDocumentTag.Kind.TOPIC
+        ).values_list("value", flat=True).distinct().order_by("value")
+        return [(topic, topic) for topic in topics]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(_tagged(ConftoolDocumentTag.Kind.TOPIC, self.value()))
+
+
+class ConftoolDocumentTagInline(admin.TabularInline):
+    model = ConftoolDocumentTag
+    fields = ("kind", "value")
+    readonly_fields = ("kind", "value")
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(ConftoolDocument)
 class ConftoolDocumentAdmin(admin.ModelAdmin):
     list_display = (
         "conftool_id",
         "id",
         "title",
+        "contribution_type",
+    )
+    list_filter = (
+        "contribution_type",
+        TopicListFilter,
+    )
+    inlines = (ConftoolDocumentTagInline,)
+    search_fields = ("title",)
+    search_help_text = (
+        "Conftool or document id, an author's ORCID, a keyword or the beginning of the title"
     )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith("_changelist"):
+            # the list does not need the (large) document contents
+            queryset = queryset.only("conftool_id", "title", "contribution_type")
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only indexed lookups, the metadata is read from `ConftoolDocumentTag` and the
+        # title prefix uses the expression index of migration 0012 on PostgreSQL
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(Q(conftool_id=int(term)) | Q(id=int(term))), False
+        # tags are searched in the form they are stored in
+        Kind = ConftoolDocumentTag.Kind
+        if ORCID_PATTERN.match(term.upper()):
+            return queryset.filter(_tagged(Kind.ORCID, normalized_tag(Kind.ORCID, term))), False
+        return queryset.filter(
+            Q(title__istartswith=term) | _tagged(Kind.KEYWORD, normalized_tag(Kind.KEYWORD, term))
+        ), False
 
 
 @admin.register(ConftoolEmail)
@@ -43,15 +153,14 @@ class ImportLogAdmin(admin.ModelAdmin):
         "user",
         "message",
         "conftool_paper_id",
+        "trace",
         "stacktrace",
         "added",
     )
-    search_fields = (
-        "request_id",
-        "path",
-        "error_type",
-        "message",
-        "stacktrace",
+    search_fields = ("message",)
+    search_help_text = (
+        "Request id, conftool paper id, the beginning of the path or part of the message "
+        f"(at least {MESSAGE_SEARCH_LENGTH} characters)"
     )
     list_display = (
         "success",
@@ -69,3 +178,77 @@ class ImportLogAdmin(admin.ModelAdmin):
         "error_type",
         "added",
     )
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only lookups that can use an index: exact ids, path prefixes and the message
+        # (trigram-indexed on PostgreSQL, see migration 0008)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        query = Q(pk__in=[])
+        if len(term) >= MESSAGE_SEARCH_LENGTH:
+            query |= Q(message__icontains=term)
+        if len(term) == ImportLog.REQUEST_ID_LENGTH:
+            query |= Q(request_id=term.upper())
+        if term.isdigit():
+            query |= Q(conftool_paper_id=int(term))
+        if term.startswith("/"):
+            query |= Q(path__startswith=term)
+        return queryset.filter(query), False
+
+    @admin.display(description="Stacktrace")
+    def stacktrace(self, log):
+        return log.trace.stacktrace if log.trace else None
+
+
+@admin.register(ImportLogTrace)
+class ImportLogTraceAdmin(admin.ModelAdmin):
+    readonly_fields = (
+        "fingerprint",
+        "error_class",
+        "occurrences",
+        "first_seen",
+        "last_seen",
+        "stacktrace",
+    )
+    search_fields = (
+        "fingerprint",
+        "error_class",
+    )
+    list_display = (
+        "error_class",
+        "occurrences",
+        "first_seen",
+        "last_seen",
+        "fingerprint",
+    )
+    ordering = ("-last_seen",)
+    show_full_result_count = False
+
+
+@admin.register(ImportHealth)
+class ImportHealthAdmin(admin.ModelAdmin):
+    # Filled by `dhdconf_rollup_health`, read only here
+    list_display = (
+        "hour",
+        "error_type",
+        "path",
+        "successes",
+        "failures",
+        "users",
+    )
+    list_filter = (
+        "error_type",
+        "path",
+    )
+    date_hierarchy = "hour"
+    ordering = ("-hour", "error_type", "path")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
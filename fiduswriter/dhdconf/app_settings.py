@@ -2,6 +2,42 @@ import os
 
 CONFTOOL_URL = os.environ.get('CONFTOOL_URL')
 CONFTOOL_APIPASS = os.environ.get('CONFTOOL_APIPASS')
+CONFTOOL_POOL_SIZE = 10
+CONFTOOL_CONNECT_TIMEOUT = 5
+CONFTOOL_READ_TIMEOUT = 120
+
+# How nonces are kept increasing between processes: "database", "file" or "local"
+CONFTOOL_NONCE_SOURCE = "database"
+CONFTOOL_NONCE_FILE = "/tmp/dhdconf-conftool-nonce"
+CONFTOOL_NONCE_RETRIES = 3
+
+# Callables (or dotted paths to them) receiving the metrics of each conftool request
+CONFTOOL_METRICS_HOOKS = []
+
+# Whether to import submissions in a background job that the frontend polls
+CONFTOOL_ASYNC_REFRESH = False
+CONFTOOL_REFRESH_JOB_WORKERS = 2
+CONFTOOL_REFRESH_JOB_TIMEOUT = 600
+
+# Concurrent refreshes of one user wait for the running one and share its result.
+# Successful results are also reused for a few seconds, failed ones are not. Needs a
+# cache shared by all workers.
+CONFTOOL_REFRESH_CACHE = "default"
+CONFTOOL_REFRESH_RESULT_SECONDS = 10
+CONFTOOL_REFRESH_WAIT_SECONDS = 120
+
+# Import log entries a request or job collects before writing them in one insert,
+# and the age after which they are written with the next entry or progress report
+# of a sync or job. Entries still collected are lost if the process is killed.
+CONFTOOL_IMPORT_LOG_BUFFER_SIZE = 20
+CONFTOOL_IMPORT_LOG_BUFFER_SECONDS = 5
+# Days after which `dhdconf_prune_logs` deletes import log entries
+CONFTOOL_IMPORT_LOG_RETENTION_DAYS = 90
+CONFTOOL_IMPORT_LOG_SUCCESS_RETENTION_DAYS = 14
+# Check the query budgets of the importer functions: None, "log" to write calls over
+# budget to the import log or "raise" to fail them after they have run, their changes
+# are kept (see `conftool.querybudget`)
+CONFTOOL_QUERY_BUDGETS = None
 
 BLOCK_USER_CHANGES = True
 BLOCK_NEW_DOCUMENT = True
@@ -11,6 +47,8 @@ BLOCK_DOCUMENT_SHARING = True
 
 DHD_ARTICLE_TEMPLATE_ID = "standard-article"
 DHD_ARTICLE_TEMPLATE_TITLE = "DHd Article"
+# How long a process trusts its cached template before checking it for changes
+DHD_ARTICLE_TEMPLATE_CACHE_SECONDS = 60
 DHD_ARTICLE_ATTRS = {
     "template": DHD_ARTICLE_TEMPLATE_TITLE,
     "import_id": DHD_ARTICLE_TEMPLATE_ID,
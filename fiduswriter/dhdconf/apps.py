@@ -12,3 +12,10 @@ class DhdconfConfig(AppConfig):
         for name in dir(defaults):
             if name.isupper() and not hasattr(settings, name):
                 setattr(settings, name, getattr(defaults, name))
+
+        # Changes to templates (e.g. in the admin) invalidate this process' cache
+        from django.db.models.signals import post_save, post_delete
+        from document.models import DocumentTemplate
+        from .document.template import invalidate_template_cache
+        post_save.connect(invalidate_template_cache, sender=DocumentTemplate)
+        post_delete.connect(invalidate_template_cache, sender=DocumentTemplate)
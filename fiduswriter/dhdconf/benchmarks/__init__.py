@@ -0,0 +1,4 @@
+def result(name: str, params: dict, **metrics) -> dict:
+    # One benchmark result, `key` identifies it across runs for comparisons
+    key = name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+    return dict(name=name, key=key, **params, **metrics)
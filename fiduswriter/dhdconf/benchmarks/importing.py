@@ -0,0 +1,198 @@
+import copy
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+import django.utils.timezone
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+
+from dhdconf.benchmarks import result
+from dhdconf.conftool.api import ExportPaperResponse
+from dhdconf.conftool.importing import import_paper, _synchronize_access_rights
+from dhdconf.conftool.synthetic import paper_xml
+from dhdconf.document import cached_dhd_document_template
+from dhdconf.document.content import DhdDocumentContentUpdate
+from dhdconf.models import ConftoolDocument, ConftoolEmail, ConftoolUser
+
+# Measures the database side of imports. Everything runs in a transaction that is
+# rolled back at the end, so this can be pointed at a copy of the production database
+# without leaving rows behind (sequences still advance). Conftool ids of the benchmark
+# user and papers are allocated above the existing ones, so that nothing collides
+# with or updates real rows.
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def _rolled_back():
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+
+def _free_id(model) -> int:
+    # the first conftool id above all existing ones
+    return (model.objects.aggregate(last=Max("conftool_id"))["last"] or 0) + 1
+
+
+def _owner() -> ConftoolUser:
+    conftool_id = _free_id(ConftoolUser)
+    owner = ConftoolUser.objects.create(
+        username=f"benchmark-owner-{conftool_id}",
+        conftool_id=conftool_id,
+        synchronized=django.utils.timezone.now(),
+    )
+    ConftoolEmail.objects.create(
+        user=owner, email=_email(owner), verified=True, primary=True
+    )
+    return owner
+
+
+def _email(owner: ConftoolUser) -> str:
+    # the address synthetic papers give their submitting author
+    return f"author{owner.conftool_id}@example.com"
+
+
+def _papers(count: int, authors: int, owner: ConftoolUser) -> list:
+    first_id = _free_id(ConftoolDocument)
+    return [
+        ExportPaperResponse.from_xml(ET.fromstring(
+            paper_xml(paper_id, owner.conftool_id, authors=authors, extra_columns=0)
+        ))
+        for paper_id in range(first_id, first_id + count)
+    ]
+
+
+def _timed(call) -> tuple:
+    # (seconds, queries) of one call
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        call()
+        seconds = time.perf_counter() - start
+    return seconds, len(queries)
+
+
+def _per_call(name: str, params: dict, calls: list) -> dict:
+    timings = [_timed(call) for call in calls]
+    seconds = sum(s for s, _ in timings)
+    return result(
+        name,
+        params,
+        seconds=seconds,
+        seconds_per_call=seconds / len(timings),
+        queries_per_call=max(q for _, q in timings),
+    )
+
+
+def bench_import_paper(papers=50, authors=3) -> list:
+    # New papers, unchanged papers (the common case of a refresh) and forced updates
+    params = dict(papers=papers, authors=authors)
+    with _rolled_back():
+        data = _papers(papers, authors, _owner())
+        results = [
+            _per_call("import_paper", dict(params, path="created"), [
+                lambda paper=paper: import_paper(paper) for paper in data
+            ]),
+            _per_call("import_paper", dict(params, path="unchanged"), [
+                lambda paper=paper: import_paper(paper) for paper in data
+            ]),
+            _per_call("import_paper", dict(params, path="updated"), [
+                lambda paper=paper: import_paper(paper, force=True) for paper in data
+            ]),
+        ]
+    return results
+
+
+def _padded_content(paragraphs: int) -> dict:
+    # The template content with a long text part, like a paper that has been written
+    _, content = cached_dhd_document_template()
+    content = copy.deepcopy(content)
+    if paragraphs:
+        content.setdefault("content", []).append({
+            "type": "richtext_part",
+            "attrs": {"id": "benchmark_padding"},
+            "content": [
+                {"type": "paragraph", "content": [
+                    {"type": "text", "text": f"Paragraph {i} " + "lorem ipsum " * 40}
+                ]}
+                for i in range(paragraphs)
+            ],
+        })
+    return content
+
+
+def bench_set_on(repeat=20, paragraphs=(0, 2000)) -> list:
+    results = []
+    with _rolled_back():
+        owner = _owner()
+        template, _ = cached_dhd_document_template()
+        for count in paragraphs:
+            document = ConftoolDocument.objects.create(
+                conftool_id=_free_id(ConftoolDocument),
+                synchronized=django.utils.timezone.now(),
+                template=template,
+                owner=owner,
+                content=_padded_content(count),
+                title="",
+            )
+            updates = []
+            for i in range(repeat):
+                update = DhdDocumentContentUpdate()
+                update.set_title(f"Benchmark title {i}")
+                update.set_abstract("abstract " * 200)
+                update.set_keywords(["k1", "k2"])
+                updates.append(update)
+            params = dict(paragraphs=count)
+            results.append(_per_call("set_on", dict(params, path="changed"), [
+                lambda update=update: update.set_on(pk=document.pk) for update in updates
+            ]))
+            results.append(_per_call("set_on", dict(params, path="unchanged"), [
+                lambda: updates[-1].set_on(pk=document.pk) for _ in updates
+            ]))
+    return results
+
+
+def bench_access_rights(authors=(1, 10, 50), repeat=5) -> list:
+    # The first run creates invites and access rights, later ones find them in place
+    results = []
+    with _rolled_back():
+        owner = _owner()
+        template, template_content = cached_dhd_document_template()
+        for count in authors:
+            documents = [
+                ConftoolDocument.objects.create(
+                    conftool_id=_free_id(ConftoolDocument),
+                    synchronized=django.utils.timezone.now(),
+                    template=template,
+                    owner=owner,
+                    content=template_content,
+                    title="",
+                )
+                for _ in range(repeat)
+            ]
+            emails = [_email(owner)] + [
+                f"benchmark{count}-{i}@example.com" for i in range(1, count)
+            ]
+            params = dict(authors=count)
+            for path in ("created", "unchanged"):
+                results.append(_per_call("synchronize_access_rights", dict(params, path=path), [
+                    lambda document=document: _synchronize_access_rights(document, emails)
+                    for document in documents
+                ]))
+    return results
+
+
+def run(papers=50, authors=(1, 5, 20), repeat=20) -> list:
+    results = []
+    for count in authors:
+        results.extend(bench_import_paper(papers, count))
+    results.extend(bench_set_on(repeat))
+    results.extend(bench_access_rights(repeat=max(1, repeat // 4)))
+    return results
@@ -0,0 +1,117 @@
+import argparse
+import io
+import json
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+from dhdconf.benchmarks import result
+from dhdconf.conftool.api import ConftoolClient, ExportPaperResponse, PaperAuthor
+from dhdconf.conftool.standin import ConftoolStandin, StandinConfig
+from dhdconf.conftool.synthetic import papers_export
+
+# Measures conftool export parsing without database access. Run from the fiduswriter
+# directory with: python -m dhdconf.benchmarks.parsing --papers 10000
+# (or, together with the database benchmarks: ./manage.py dhdconf_benchmark)
+
+
+def bench_parse_papers(papers=10_000, authors=3, extra_columns=20, repeat=3) -> dict:
+    data = b"".join(papers_export(papers, authors=authors, extra_columns=extra_columns))
+    elements = [
+        e for e in ET.fromstring(data) if e.tag == "paper"
+    ]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for element in elements:
+            ExportPaperResponse.from_xml(element)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return result(
+        "parse_papers",
+        dict(papers=papers, authors=authors, extra_columns=extra_columns),
+        bytes=len(data),
+        seconds=best,
+        papers_per_second=papers / best if best else None,
+    )
+
+
+def bench_parse_authors(papers=10_000, authors=3, extra_columns=20, repeat=3) -> dict:
+    # The share of `from_xml` spent on the numbered author columns
+    data = b"".join(papers_export(papers, authors=authors, extra_columns=extra_columns))
+    elements = [e for e in ET.fromstring(data) if e.tag == "paper"]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for element in elements:
+            PaperAuthor.list_from_xml(element)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return result(
+        "parse_authors",
+        dict(papers=papers, authors=authors, extra_columns=extra_columns),
+        seconds=best,
+        microseconds_per_paper=best / papers * 1e6,
+    )
+
+
+def bench_iterparse_papers(papers=10_000, authors=3, extra_columns=20) -> dict:
+    data = b"".join(papers_export(papers, authors=authors, extra_columns=extra_columns))
+    start = time.perf_counter()
+    count = 0
+    for _, element in ET.iterparse(io.BytesIO(data)):
+        if element.tag == "paper":
+            ExportPaperResponse.from_xml(element)
+            element.clear()
+            count += 1
+    seconds = time.perf_counter() - start
+    return result(
+        "iterparse_papers",
+        dict(papers=count, authors=authors, extra_columns=extra_columns),
+        bytes=len(data),
+        seconds=seconds,
+        papers_per_second=count / seconds if seconds else None,
+    )
+
+
+def bench_stream_papers(papers=10_000, authors=3, extra_columns=20, gzip=True) -> dict:
+    # The whole client path (HTTP on localhost, decompression, `_stream_xml` and
+    # parsing) against the conftool stand-in
+    config = StandinConfig(
+        papers=papers, authors=authors, extra_columns=extra_columns, gzip=gzip
+    )
+    with ConftoolStandin(config) as standin:
+        client = ConftoolClient(standin.url, config.secret, session=requests.Session())
+        start = time.perf_counter()
+        count = sum(1 for _ in client.stream_papers())
+        seconds = time.perf_counter() - start
+    return result(
+        "stream_papers",
+        dict(papers=papers, authors=authors, extra_columns=extra_columns, gzip=gzip),
+        seconds=seconds,
+        papers_per_second=count / seconds if seconds else None,
+    )
+
+
+def run(papers=10_000, authors=(1, 5, 20), extra_columns=20) -> list:
+    results = []
+    for count in authors:
+        results.append(bench_parse_papers(papers, count, extra_columns))
+        results.append(bench_parse_authors(papers, count, extra_columns))
+        results.append(bench_iterparse_papers(papers, count, extra_columns))
+        results.append(bench_stream_papers(papers, count, extra_columns))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conftool export parsing")
+    parser.add_argument("--papers", type=int, default=10_000)
+    parser.add_argument("--authors", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--extra-columns", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.papers, args.authors, args.extra_columns), indent=2))
+
+
+if __name__ == "__main__":
+    main()
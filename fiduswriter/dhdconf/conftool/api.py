@@ -1,12 +1,22 @@
 import abc
+import dataclasses
 import hashlib
+import json
 import logging
+import threading
 import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Iterable, List
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
 import requests
 import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+
+from dhdconf.conftool.metrics import ClientMetrics, RequestMetrics, client_metrics
+from dhdconf.conftool.process import PerProcess
+from dhdconf.conftool.snapshots import SnapshotStore
 
 
 logger = logging.getLogger(__name__)
@@ -55,27 +65,49 @@ class UnexpectedUserIdException(ConftoolUnexpectedResponse):
         super().__init__(f"Unexpected user id on filtering {export_select} for: {ids}")
 
 
-def _t(element: ET.Element, child_tag: str, default=None) -> str:
-    if (child := element.find(child_tag)) is not None:
-        return child.text.strip() if child.text else ""
-    elif default is not None:
-        return default
-    else:
-        raise MissingElementException(element, child_tag)
+# Failures of talking to conftool or of reading its responses, as opposed to local
+# ones while importing what it sent
+CONFTOOL_ERRORS = (ConftoolException, requests.RequestException, ET.ParseError)
+
+
+class _Children:
+    # Maps child tags to their text in one pass over the element, so that looking up
+    # many fields (e.g. per author columns on papers) does not rescan the children.
+    # Like `Element.find()` the first child with a given tag wins.
+    __slots__ = ("element", "texts")
+
+    def __init__(self, element: ET.Element):
+        self.element = element
+        self.texts = {child.tag: child.text for child in reversed(element)}
+
 
+def _children(element: Union[ET.Element, _Children]) -> _Children:
+    return element if isinstance(element, _Children) else _Children(element)
 
-def _int(element: ET.Element, child_tag: str) -> int:
+
+def _t(element: Union[ET.Element, _Children], child_tag: str, default=None) -> str:
+    children = _children(element)
+    try:
+        text = children.texts[child_tag]
+    except KeyError:
+        if default is not None:
+            return default
+        raise MissingElementException(children.element, child_tag)
+    return text.strip() if text else ""
+
+
+def _int(element: Union[ET.Element, _Children], child_tag: str) -> int:
     try:
         return int(_t(element, child_tag))
     except ValueError:
-        raise ExpectedIntegerException(element, child_tag)
+        raise ExpectedIntegerException(_children(element).element, child_tag)
 
 
-def _bool(element: ET.Element, child_tag: str) -> bool:
+def _bool(element: Union[ET.Element, _Children], child_tag: str) -> bool:
     return _t(element, child_tag, "").lower() in ["true", "1"]
 
 
-def _list(element: ET.Element, child_tag: str, delim=",") -> List[str]:
+def _list(element: Union[ET.Element, _Children], child_tag: str, delim=",") -> List[str]:
     return [i.strip() for i in _t(element, child_tag, "").split(delim) if i]
 
 
@@ -94,6 +126,7 @@ class LoginResponse(ConftoolResponse):
 
     @classmethod
     def from_xml(cls, element: ET.Element) -> "LoginResponse":
+        element = _children(element)
         return cls(
             result=_bool(element, "result"),
             id=_int(element, "id"),
@@ -111,6 +144,7 @@ class UserInfoResponse(ConftoolResponse):
 
     @classmethod
     def from_xml(cls, element: ET.Element) -> "UserInfoResponse":
+        element = _children(element)
         return cls(
             person_id=int(_t(element, "personID")),
             username=_t(element, "username"),
@@ -131,6 +165,7 @@ class ExportUserResponse(ConftoolResponse):
 
     @classmethod
     def from_xml(cls, element: ET.Element) -> "ExportUserResponse":
+        element = _children(element)
         result = cls(
             person_id=_int(element, "personID"),
             username=_t(element, "username"),
@@ -151,6 +186,7 @@ class PaperAuthor:
 
     @classmethod
     def list_from_xml(cls, element: ET.Element) -> List["PaperAuthor"]:
+        element = _children(element)
         field = "authors_formatted_{}_{}"
         result = []
         idx = 1
@@ -186,6 +222,7 @@ class ExportPaperResponse(ConftoolResponse):
 
     @classmethod
     def from_xml(cls, element: ET.Element) -> "ExportPaperResponse":
+        element = _children(element)
         return cls(
             paper_id=_int(element, "paperID"),
             submitting_author_id=_int(element, "submitting_author_ID"),
@@ -197,25 +234,102 @@ class ExportPaperResponse(ConftoolResponse):
             authors=PaperAuthor.list_from_xml(element)
         )
 
+    def fingerprint(self) -> str:
+        # A stable hash over all exported values to detect unchanged papers on import
+        data = json.dumps(dataclasses.asdict(self), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _NoCookies(DefaultCookiePolicy):
+    # The API authenticates every request by its nonce and passhash. A shared
+    # session must not keep cookies, one user's conftool login would otherwise be
+    # sent along with the requests made for other users.
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def _session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookies())
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_sessions = PerProcess(_session)
+
+
+def pooled_session(pool_size: int = 10) -> requests.Session:
+    # One keep-alive session per process and pool size, so that connections (and TLS
+    # handshakes) to conftool are reused across requests handled by the same worker.
+    return _sessions.get(pool_size)
+
+
+def clock_nonce() -> int:
+    # Conftool only requires a monotonically increasing integer for a nonce:
+    # https://www.conftool.net/ctforum/index.php/topic,280.0.html
+    # But we need to use the same nonce creation method as dhconvalidator to not
+    # interfere, for context see: https://github.com/ADHO/dhconvalidator/issues/72
+    # This can be simplified to `time.time_ns()` if we no longer need to cooperate
+    return (time.time_ns() // 1_000_000) * 60
+
+
+class MonotonicNonce:
+    # Hands out clock based nonces, but never the same or a smaller one twice within
+    # this process. Allocators shared by several processes live in `nonce.py`.
+
+    def __init__(self):
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self._lock:
+            self._last = max(clock_nonce(), self._last + 1)
+            return self._last
+
+
+_local_nonce = MonotonicNonce()
+
 
 class ConftoolClient:
 
     _HEADERS = {
         "User-Agent": "fiduswriter-dhdconf-plugin ConftoolClient 0.1",
-        "Accept-Language": "de"
+        "Accept-Language": "de",
+        "Accept-Encoding": "gzip, deflate",
     }
 
-    def __init__(self, service_url: str, secret: str):
+    _STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(
+        self,
+        service_url: str,
+        secret: str,
+        session: Optional[requests.Session] = None,
+        timeout: Union[float, Tuple[float, float], None] = None,
+        nonce_source: Optional[Callable[[], int]] = None,
+        nonce_retries: int = 3,
+        nonce_backoff: float = 0.05,
+        snapshots: Optional[SnapshotStore] = None,
+        metrics: Optional[ClientMetrics] = None,
+    ):
         self.service_url = service_url
         self.secret = secret
+        self.session = session if session is not None else pooled_session()
+        self.timeout = timeout
+        self.nonce_source = nonce_source if nonce_source is not None else _local_nonce
+        self.nonce_retries = nonce_retries
+        self.nonce_backoff = nonce_backoff
+        self.snapshots = snapshots
+        self.metrics = metrics if metrics is not None else client_metrics
 
     def _nonce(self) -> int:
-        # Conftool only requires a monotonically increasing integer for a nonce:
-        # https://www.conftool.net/ctforum/index.php/topic,280.0.html
-        # But we need to use the same nonce creation method as dhconvalidator to not
-        # interfere, for context see: https://github.com/ADHO/dhconvalidator/issues/72
-        # This can be simplified to `time.time_ns()` if we no longer need to cooperate
-        return (time.time_ns() // 1_000_000) * 60
+        return self.nonce_source()
 
     def _nonce_with_hash(self) -> dict:
         nonce = str(self._nonce())
@@ -225,11 +339,18 @@ class ConftoolClient:
         )
 
     def _do_request(self, params, stream=False):
+        # Conftool rejects nonces that are not bigger than the last one it received.
+        # Calls (also of one client from several threads) run concurrently: the nonce
+        # is taken right before sending, and one that arrives after a bigger one is
+        # rejected and retried with a new nonce (see `_retry_on_nonce_rejection`).
         params = {**params, **self._nonce_with_hash()}
-        result = requests.get(
-            self.service_url, headers=self._HEADERS, params=params, stream=stream
+        return self.session.get(
+            self.service_url,
+            headers=self._HEADERS,
+            params=params,
+            stream=stream,
+            timeout=self.timeout,
         )
-        return result
 
     @staticmethod
     def _raise_on_api_error(elem: ET.Element):
@@ -248,18 +369,73 @@ class ConftoolClient:
                 else:
                     raise ConftoolUnexpectedResponse(message)
 
+    def _retry_on_nonce_rejection(self, attempt: int, e: ConftoolNonceTooSmallException):
+        # Another process or host (e.g. dhconvalidator) got ahead of us, the next
+        # nonce will be bigger, so retrying after a short pause usually succeeds
+        if attempt >= self.nonce_retries:
+            raise e
+        delay = self.nonce_backoff * (2 ** attempt)
+        logger.info(f"Nonce rejected by conftool, retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+    @staticmethod
+    def _command(params) -> str:
+        return f"{params.get('page')}/{params.get('command') or params.get('export_select')}"
+
+    @contextmanager
+    def _measure(self, params) -> Iterator[RequestMetrics]:
+        metrics = RequestMetrics(command=self._command(params))
+        metrics.start()
+        try:
+            yield metrics
+        except Exception as e:
+            metrics.error = type(e).__name__
+            raise
+        finally:
+            metrics.stop()
+            self.metrics.record(metrics)
+
     def _request_xml(self, params) -> ET.Element:
-        response = self._do_request(params)
-        parsed = ET.fromstring(response.text)
-        self._raise_on_api_error(parsed)
-        return parsed
+        attempt = 0
+        while True:
+            try:
+                return self._request_xml_once(params)
+            except ConftoolNonceTooSmallException as e:
+                self._retry_on_nonce_rejection(attempt, e)
+                attempt += 1
+
+    def _request_xml_once(self, params) -> ET.Element:
+        with self._measure(params) as metrics:
+            response = self._do_request(params)
+            metrics.bytes = len(response.content)
+            start = time.perf_counter()
+            parsed = ET.fromstring(response.text)
+            metrics.parse_seconds = time.perf_counter() - start
+            self._raise_on_api_error(parsed)
+            return parsed
 
     def _stream_xml(self, params, target_tag, parent_tag) -> Iterable[ET.Element]:
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                for elem in self._stream_xml_once(params, target_tag, parent_tag):
+                    yielded = True
+                    yield elem
+                return
+            except ConftoolNonceTooSmallException as e:
+                # a rejection is the whole response, but never retry partial results
+                if yielded:
+                    raise
+                self._retry_on_nonce_rejection(attempt, e)
+                attempt += 1
+
+    def _stream_xml_once(self, params, target_tag, parent_tag) -> Iterable[ET.Element]:
         # this streams responses and cleans up memory directly after yielding them in
         # order to handle larger response bodies with minimum overhead
-        with self._do_request(params, stream=True) as response:
+        with self._measure(params) as metrics, self._open_stream(params) as chunks:
             parent = None
-            for action, elem in ET.iterparse(response.raw, events=("start", "end")):
+            for action, elem in self._iter_events(chunks, metrics):
                 if elem.tag == parent_tag:
                     if action == "start":
                         parent = elem
@@ -269,11 +445,41 @@ class ConftoolClient:
                 if action == "end":
                     self._raise_on_api_error(elem)
                     if elem.tag == target_tag:
+                        metrics.elements += 1
+                        # time spent by the consumer is not attributed to conftool
+                        metrics.stop()
                         yield elem
+                        metrics.start()
                         elem.clear()
                         if parent:
                             parent.remove(elem)
 
+    @contextmanager
+    def _fetch_stream(self, params) -> Iterator[Iterable[bytes]]:
+        # Content is read in chunks that requests decompresses as they arrive (unlike
+        # `response.raw`), so compressed exports are parsed without buffering them
+        with self._do_request(params, stream=True) as response:
+            yield response.iter_content(chunk_size=self._STREAM_CHUNK_SIZE)
+
+    def _open_stream(self, params):
+        if self.snapshots:
+            return self.snapshots.open(params, lambda: self._fetch_stream(params))
+        return self._fetch_stream(params)
+
+    @staticmethod
+    def _iter_events(
+        chunks: Iterable[bytes], metrics: RequestMetrics
+    ) -> Iterable[Tuple[str, ET.Element]]:
+        parser = ET.XMLPullParser(events=("start", "end"))
+        for chunk in chunks:
+            metrics.bytes += len(chunk)
+            start = time.perf_counter()
+            parser.feed(chunk)
+            metrics.parse_seconds += time.perf_counter() - start
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
     def login(self, username_or_email, password) -> LoginResponse:
         response = self._request_xml(dict(
             page="remoteLogin",
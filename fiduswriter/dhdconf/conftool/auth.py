@@ -1,21 +1,20 @@
 from django.contrib.auth.backends import BaseBackend
-from django.conf import settings
+from django.db import IntegrityError, transaction
 
-from dhdconf.conftool.api import ConftoolClient, ConftoolLoginFailedException
+from dhdconf.conftool.api import ConftoolLoginFailedException, LoginResponse
 from dhdconf.conftool.importing import import_user_info
+from dhdconf.conftool.querybudget import query_budget
 from dhdconf.models import ConftoolUser, ImportLog
-from dhdconf.conftool.util import import_log_error
+from dhdconf.conftool.util import import_log_error, conftool_client, lock_conftool_id
 
 
 class ConftoolBackend(BaseBackend):
 
     def __init__(self):
-        self.client = ConftoolClient(
-            service_url=settings.CONFTOOL_URL,
-            secret=settings.CONFTOOL_APIPASS,
-        )
+        self.client = conftool_client()
         super().__init__()
 
+    @query_budget("authenticate", 25)
     def authenticate(self, request, username=None, password=None, **kwargs):
         try:
             response = self.client.login(username, password)
@@ -24,22 +23,42 @@ class ConftoolBackend(BaseBackend):
         if response.result:
             user = ConftoolUser.objects.filter(conftool_id=response.id).first()
             if not user:
-                user = ConftoolUser(conftool_id=response.id)
-                user.set_unusable_password()
-                try:
-                    info = self.client.user_info(response.username)
-                    try:
-                        import_user_info(user, info)
-                    except Exception as e:
-                        import_log_error(ImportLog.ErrorType.IMPORT_USERINFO, e, request)
-                        raise e
-                except Exception as e:
-                    import_log_error(ImportLog.ErrorType.FETCH_USERINFO, e, request)
-                    raise e
+                user = self._create_user(request, response)
             return user.user_ptr
         else:
             return None
 
+    def _create_user(self, request, response: LoginResponse) -> ConftoolUser:
+        try:
+            info = self.client.user_info(response.username)
+        except Exception as e:
+            import_log_error(ImportLog.ErrorType.FETCH_USERINFO, e, request)
+            raise e
+        locked = False
+        try:
+            with transaction.atomic():
+                # a concurrent login of the same user (e.g. a double submit) waits
+                # here and then uses the user created by the first one
+                locked = lock_conftool_id(ConftoolUser, response.id)
+                if user := ConftoolUser.objects.filter(conftool_id=response.id).first():
+                    return user
+                user = ConftoolUser(conftool_id=response.id)
+                user.set_unusable_password()
+                import_user_info(user, info)
+                return user
+        except IntegrityError as e:
+            # Without advisory locks the other login may have won the insert, then
+            # its user is the one we tried to create. Other conflicts are errors.
+            if not locked and (user := ConftoolUser.objects.filter(
+                conftool_id=response.id, username=info.username
+            ).first()):
+                return user
+            import_log_error(ImportLog.ErrorType.IMPORT_USERINFO, e, request)
+            raise e
+        except Exception as e:
+            import_log_error(ImportLog.ErrorType.IMPORT_USERINFO, e, request)
+            raise e
+
     def get_user(self, user_id):
         user = ConftoolUser.objects.filter(id=user_id).first()
         return user.user_ptr if user else None
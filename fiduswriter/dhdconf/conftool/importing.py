@@ -1,18 +1,28 @@
-from copy import deepcopy
-from typing import List
+import enum
+from typing import Dict, List, Tuple
 
 import django.utils.timezone
+from allauth.account import app_settings as account_settings
 from allauth.account.models import EmailAddress
 from allauth.account.utils import user_field, user_email, user_username
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
 
+from document.models import AccessRight
+from user.models import UserInvite
 from dhdconf.conftool.api import UserInfoResponse, ExportUserResponse, ExportPaperResponse
-from dhdconf.document import ensure_dhd_document_template
+from dhdconf.conftool.querybudget import query_budget
+from dhdconf.conftool.util import lock_conftool_id
+from dhdconf.document import cached_dhd_document_template
 from dhdconf.document.content import DhdDocumentContentUpdate
+from dhdconf.document.metadata import SubmissionMetadata, store_metadata
 from dhdconf.models import ConftoolUser, ConftoolEmail, ConftoolDocument, ConftoolUserInvite, ConftoolAccessRight
 
+UserModel = get_user_model()
 
+
+@query_budget("import_user_info", 15)
 @transaction.atomic
 def import_user_info(user: ConftoolUser, info: UserInfoResponse):
     user_field(user, "first_name", info.firstname)
@@ -24,10 +34,10 @@ def import_user_info(user: ConftoolUser, info: UserInfoResponse):
 
 
 def import_emails(data: ExportUserResponse):
-    if not (user := ConftoolUser.objects.filter(conftool_id=data.person_id).first()):
-        return
-    user = user.user_ptr
-    addresses = []
+    import_all_emails([data])
+
+
+def _conftool_addresses(data: ExportUserResponse) -> List[Tuple[str, bool]]:
     # Special case: If the user entered the same email twice in different casing in
     # conftool we will only create one lowercased email
     if data.email and data.email2 and data.email.lower() == data.email2.lower():
@@ -36,47 +46,149 @@ def import_emails(data: ExportUserResponse):
         emails = [
             (data.email, data.email_validated), (data.email2, data.email2_validated)
         ]
+    return [(email.lower(), validated) for email, validated in emails if email]
 
-    for email, validated in emails:
-        if not email:
-            continue
-        email = email.lower()
-        address = (
-            ConftoolEmail.objects.filter(email=email, user=user).first()
-            or ConftoolEmail(email=email, user=user)
-        )
-        address.verified = validated
-        address.primary = False
-        addresses.append(address)
-    with transaction.atomic():
-        for address in addresses:
-            address.save()
-        ids = [a.pk for a in addresses]
-        ConftoolEmail.objects.filter(user=user).exclude(pk__in=ids).delete()
-        if len(addresses) > 0:
-            addresses[0].set_as_primary()
-        _accept_invites(user, [a.email for a in addresses if a.verified])
-
-
-def _accept_invites(user, verified_emails: List[str]):
-    for cui in ConftoolUserInvite.objects.filter(email__in=verified_emails):
-        cui.to = user
-        cui.save()
+
+@query_budget("import_emails", 30)
+@transaction.atomic
+def import_all_emails(users: List[ExportUserResponse]):
+    # Imports the email addresses of many users with a fixed number of queries. As
+    # with allauth's `set_as_primary`, the first address of each user becomes their
+    # primary one, other conftool addresses of the user are removed.
+    user_ids = dict(ConftoolUser.objects.filter(
+        conftool_id__in=[data.person_id for data in users]
+    ).values_list("conftool_id", "user_ptr_id"))
+    # for users exported more than once, the last export wins
+    wanted = {
+        user_ids[data.person_id]: _conftool_addresses(data)
+        for data in users if data.person_id in user_ids
+    }
+    if not wanted:
+        return
+    existing = {
+        (address.user_id, address.email): address
+        for address in ConftoolEmail.objects.filter(user_id__in=wanted)
+    }
+    keep = {(user_id, email) for user_id, emails in wanted.items() for email, _ in emails}
+    stale = [address.pk for key, address in existing.items() if key not in keep]
+    if stale:
+        ConftoolEmail.objects.filter(pk__in=stale).delete()
+
+    primaries = {user_id: emails[0][0] for user_id, emails in wanted.items() if emails}
+    # unset other primary addresses first, including those not from conftool
+    EmailAddress.objects.filter(user_id__in=primaries, primary=True).exclude(pk__in=[
+        existing[(user_id, email)].pk
+        for user_id, email in primaries.items() if (user_id, email) in existing
+    ]).update(primary=False)
+    updated = []
+    created = []
+    for user_id, emails in wanted.items():
+        for email, validated in emails:
+            primary = primaries[user_id] == email
+            if address := existing.get((user_id, email)):
+                address.verified = validated
+                address.primary = primary
+                updated.append(address)
+            else:
+                created.append(EmailAddress(
+                    user_id=user_id, email=email, verified=validated, primary=primary
+                ))
+    if updated:
+        ConftoolEmail.objects.bulk_update(updated, ["verified", "primary"])
+    _bulk_create_inherited(ConftoolEmail, created)
+
+    accounts = list(UserModel.objects.filter(pk__in=primaries))
+    for account in accounts:
+        user_email(account, primaries[account.pk])
+    if accounts:
+        UserModel.objects.bulk_update(accounts, [account_settings.USER_MODEL_EMAIL_FIELD])
+
+    # an invite goes to the first user with its address verified
+    verified = {}
+    for user_id, emails in wanted.items():
+        for email, validated in emails:
+            if validated:
+                verified.setdefault(email, user_id)
+    _accept_invites(verified)
+
+
+def _accept_invites(verified: Dict[str, int]):
+    # `verified` maps email addresses to the ids of the users they belong to
+    invites = list(ConftoolUserInvite.objects.filter(email__in=verified))
+    for invite in invites:
+        invite.to_id = verified[invite.email]
+    if invites:
+        ConftoolUserInvite.objects.bulk_update(invites, ["to"])
+    # Unlike the rest of the import, this takes a few queries per accepted invite:
+    # apply() moves the invite's access rights and contacts one by one with
+    # fiduswriter's own rules. Invites are rare and only accepted once, so they are
+    # not batched.
+    for invite in invites:
         # apply() uses generic relations which need the un-extended model
-        cui.userinvite_ptr.apply()
+        invite.userinvite_ptr.apply()
+
 
+class PaperImportStatus(enum.Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+    # not imported, the submitting author has no account yet (see `import_papers`)
+    SKIPPED = "skipped"
 
-def import_paper(data: ExportPaperResponse):
-    document = ConftoolDocument.objects.filter(conftool_id=data.paper_id).first()
-    if not document:
-        template = ensure_dhd_document_template()
+
+@query_budget("import_paper", 55)
+def import_paper(data: ExportPaperResponse, force=False):
+    fingerprint = data.fingerprint()
+    try:
+        with transaction.atomic():
+            return _import_paper_locked(data, fingerprint, force)
+    except IntegrityError:
+        # Without advisory locks a concurrent import may have created the document
+        # between our lookup and insert, in that case this becomes an update
+        if not ConftoolDocument.objects.filter(conftool_id=data.paper_id).exists():
+            raise
+        with transaction.atomic():
+            return _import_paper_locked(data, fingerprint, force)
+
+
+def _import_paper_locked(data: ExportPaperResponse, fingerprint: str, force: bool):
+    # Concurrent imports of the same paper wait here for each other, the later one
+    # then finds the earlier one's result and usually has nothing left to do
+    lock_conftool_id(ConftoolDocument, data.paper_id)
+    document = ConftoolDocument.objects.select_for_update().defer("content").filter(
+        conftool_id=data.paper_id
+    ).first()
+    if document and document.fingerprint == fingerprint and not force:
+        # The content is left alone, but owner and access rights also depend on
+        # local state (whether the authors have logged in since), not on the export
+        status = PaperImportStatus.UNCHANGED
+    elif document:
+        status = PaperImportStatus.UPDATED
+    else:
+        template, template_content = cached_dhd_document_template()
         document = ConftoolDocument(conftool_id=data.paper_id, template=template)
-        document.content = deepcopy(template.content)
-    document.title = data.title
-    document.path = ""
+        document.content = template_content
+        status = PaperImportStatus.CREATED
     document.owner = ConftoolUser.objects.filter(
         conftool_id=data.submitting_author_id
     ).first()
+    document.synchronized = django.utils.timezone.now()
+    if status == PaperImportStatus.UNCHANGED:
+        document.save(update_fields=["owner", "synchronized"])
+    else:
+        _import_paper_content(document, data, fingerprint, status)
+    _synchronize_access_rights(document, [author.email for author in data.authors])
+    document.import_status = status
+    return document
+
+
+def _import_paper_content(
+    document: ConftoolDocument, data: ExportPaperResponse, fingerprint: str, status: PaperImportStatus
+):
+    document.title = data.title
+    document.contribution_type = data.contribution_type[:ConftoolDocument.CONTRIBUTION_TYPE_LENGTH]
+    document.path = ""
+    document.fingerprint = fingerprint
 
     content = DhdDocumentContentUpdate()
     content.set_title(data.title)
@@ -92,43 +204,105 @@ def import_paper(data: ExportPaperResponse):
             institution=author.organization,
             orcid=author.orcid
         )
-    with transaction.atomic():
-        document.synchronized = django.utils.timezone.now()
+    if status == PaperImportStatus.CREATED:
         document.save()
-        content.set_on(document)
-        _synchronize_access_rights(document, [author.email for author in data.authors])
-    return document
+    else:
+        # the content is updated part by part below, don't write all of it here
+        document.save(update_fields=[
+            "title", "contribution_type", "path", "owner", "synchronized", "fingerprint"
+        ])
+    content.set_on(document)
+    store_metadata([(document, SubmissionMetadata(
+        contribution_type=data.contribution_type,
+        keywords=data.keywords,
+        topics=data.topics,
+        orcids=[author.orcid for author in data.authors],
+    ))])
 
 
 def _synchronize_access_rights(document: ConftoolDocument, emails: list[str]):
-    rights = []
-    invites = []
-    emails = [email.lower() for email in emails if email]
-    for email in emails:
-        if local := EmailAddress.objects.filter(email=email, verified=True).first():
-            holder = local.user
-            holder_type = ContentType.objects.get(app_label="user", model="user")
-            if holder not in list(document.owner.contacts.all()):
-                document.owner.contacts.add(holder)
-        else:
-            holder, _ = ConftoolUserInvite.objects.get_or_create(
-                email=email,
-                username=email,
-                by=document.owner,
-            )
-            holder_type = ContentType.objects.get(app_label="user", model="userinvite")
-            invites.append(holder.pk)
-
-        access_right, _ = ConftoolAccessRight.objects.get_or_create(
-            document=document,
-            holder_id=holder.id,
-            holder_type=holder_type,
-            rights="write"
+    # Reconciles access rights for all authors at once, so that the number of queries
+    # does not depend on the number of authors of a paper
+    emails = list(dict.fromkeys(email.lower() for email in emails if email))
+    user_type = ContentType.objects.get_by_natural_key("user", "user")
+    invite_type = ContentType.objects.get_by_natural_key("user", "userinvite")
+
+    users = {}
+    for email, user_id in EmailAddress.objects.filter(
+        email__in=emails, verified=True
+    ).order_by("pk").values_list("email", "user_id"):
+        users.setdefault(email, user_id)
+    if users:
+        document.owner.contacts.add(*users.values())
+
+    unverified = [email for email in emails if email not in users]
+    invites = {}
+    for pk, email, username in ConftoolUserInvite.objects.filter(
+        email__in=unverified, by=document.owner
+    ).order_by("pk").values_list("pk", "email", "username"):
+        if username == email:
+            invites.setdefault(email, pk)
+    for invite in _bulk_create_inherited(ConftoolUserInvite, [
+        UserInvite(email=email, username=email, by=document.owner)
+        for email in unverified if email not in invites
+    ]):
+        invites[invite.email] = invite.pk
+
+    holders = list(dict.fromkeys(
+        (user_type.pk, users[email]) if email in users else (invite_type.pk, invites[email])
+        for email in emails
+    ))
+    existing = {}
+    for pk, holder_type_id, holder_id in ConftoolAccessRight.objects.filter(
+        document=document, rights="write"
+    ).order_by("pk").values_list("pk", "holder_type_id", "holder_id"):
+        existing.setdefault((holder_type_id, holder_id), pk)
+    rights = [existing[holder] for holder in holders if holder in existing]
+    rights.extend(right.pk for right in _bulk_create_inherited(ConftoolAccessRight, [
+        AccessRight(
+            document_id=document.pk,
+            holder_type_id=holder_type_id,
+            holder_id=holder_id,
+            rights="write",
         )
-        rights.append(access_right.pk)
+        for holder_type_id, holder_id in holders if (holder_type_id, holder_id) not in existing
+    ]))
+
     # only leave those invites and access rights we just set up
-    others = ConftoolUserInvite.objects.filter(email__in=emails).exclude(pk__in=invites)
-    for invite in others:
-        invite.userinvite_ptr.document_rights.clear()
-        invite.delete()
+    stale = list(ConftoolUserInvite.objects.filter(email__in=emails).exclude(
+        pk__in=invites.values()
+    ).values_list("pk", flat=True))
+    if stale:
+        # clear the invites' document rights in one go before removing the invites
+        AccessRight.objects.filter(holder_type=invite_type, holder_id__in=stale).delete()
+        ConftoolUserInvite.objects.filter(pk__in=stale).delete()
     ConftoolAccessRight.objects.filter(document=document).exclude(pk__in=rights).delete()
+
+
+def _bulk_create_inherited(model, parents: list) -> list:
+    # bulk_create() refuses multi-table inherited models. Ours only add the link to
+    # their parent, so the parents are created in bulk and linked with one insert.
+    # This skips save() and the pre_save/post_save signals of both models. Neither
+    # EmailAddress, UserInvite nor AccessRight override save(), and no receivers
+    # are connected for them by fiduswriter or allauth (allauth's email signals are
+    # sent from its views), so nothing is lost. Receivers added later for these
+    # models would not see rows created here.
+    if not parents:
+        return []
+    link = model._meta.get_ancestor_link(type(parents[0]))
+    if not connection.features.can_return_rows_from_bulk_insert:
+        for parent in parents:
+            parent.save()
+            model(**{link.attname: parent.pk}).save_base(raw=True)
+        return parents
+    parents = type(parents[0]).objects.bulk_create(parents)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {} ({}) VALUES {}".format(
+                connection.ops.quote_name(model._meta.db_table),
+                connection.ops.quote_name(link.column),
+                ", ".join(["(%s)"] * len(parents)),
+            ),
+            [parent.pk for parent in parents],
+        )
+    return parents
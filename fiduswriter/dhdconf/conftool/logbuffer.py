@@ -0,0 +1,106 @@
+import atexit
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from dhdconf.conftool.traces import attach_traces
+from dhdconf.models import ImportLog
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_open_buffers = weakref.WeakSet()
+
+
+class ImportLogBuffer:
+    # Collects `ImportLog` entries and writes them with a single bulk insert. The
+    # buffer is flushed when it is full, when the request or job that opened it ends
+    # (also on errors) and at interpreter exit, so that a failing refresh does not
+    # issue one insert per log entry while it runs. Entries older than `seconds` are
+    # written when the next one is added and on the progress reports of syncs and
+    # refresh jobs (see `flush_old_entries`). A process that is killed (SIGKILL, the
+    # OOM killer, a hard timeout of the server) skips all of these and loses the
+    # entries still in the buffer: at most `size` entries, collected since the last
+    # progress report or over the last `seconds`, whichever was earlier.
+
+    def __init__(self, size: int = None, seconds: float = None):
+        self.size = settings.CONFTOOL_IMPORT_LOG_BUFFER_SIZE if size is None else size
+        self.seconds = settings.CONFTOOL_IMPORT_LOG_BUFFER_SECONDS if seconds is None else seconds
+        self.entries: List[ImportLog] = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        _open_buffers.add(self)
+
+    def add(self, log: ImportLog):
+        now = time.monotonic()
+        with self._lock:
+            if not self.entries:
+                self._oldest = now
+            self.entries.append(log)
+            full = len(self.entries) >= self.size or now - self._oldest >= self.seconds
+        if full:
+            self.flush()
+
+    def flush_if_old(self):
+        with self._lock:
+            old = bool(self.entries) and time.monotonic() - self._oldest >= self.seconds
+        if old:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self.entries = self.entries, []
+        if not entries:
+            return
+        try:
+            attach_traces(entries)
+            ImportLog.objects.bulk_create(entries)
+        except DatabaseError:
+            # don't lose the entries (and the error they describe) with the database
+            logger.exception(f"Could not write {len(entries)} import log entries")
+            for log in entries:
+                logger.error(
+                    f"Import log [{log.request_id}] {log.get_error_type_display()}: "
+                    f"{log.message}\n{log.pending_trace.stacktrace if log.pending_trace else ''}"
+                )
+
+
+def current_buffer() -> Optional[ImportLogBuffer]:
+    return getattr(_local, "buffer", None)
+
+
+def flush_old_entries():
+    # Called on progress of long imports, so that an entry is written even if no
+    # other one follows it
+    if buffer := current_buffer():
+        buffer.flush_if_old()
+
+
+@contextmanager
+def buffered_import_log(buffer: ImportLogBuffer = None):
+    # Collects the entries written by `import_log` in this thread until the block
+    # ends. Passing the buffer of another thread (e.g. to import workers) shares it,
+    # it is then flushed by the thread that opened it.
+    outer = current_buffer()
+    own = buffer is None
+    _local.buffer = ImportLogBuffer() if own else buffer
+    try:
+        yield _local.buffer
+    finally:
+        try:
+            if own:
+                _local.buffer.flush()
+        finally:
+            _local.buffer = outer
+
+
+@atexit.register
+def _flush_open_buffers():
+    for buffer in list(_open_buffers):
+        buffer.flush()
@@ -0,0 +1,111 @@
+import bisect
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Latency upper bounds in seconds, the last bucket counts everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+@dataclass
+class RequestMetrics:
+    # Measures a single request to conftool. For streamed exports the clock only runs
+    # while the client works, not while the consumer processes yielded elements.
+    command: str
+    seconds: float = 0
+    parse_seconds: float = 0
+    bytes: int = 0
+    elements: int = 0
+    error: Optional[str] = None
+    _started: Optional[float] = field(default=None, repr=False)
+
+    def start(self):
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def stop(self):
+        if self._started is not None:
+            self.seconds += time.perf_counter() - self._started
+            self._started = None
+
+    @property
+    def network_seconds(self) -> float:
+        return max(0.0, self.seconds - self.parse_seconds)
+
+
+@dataclass
+class CommandMetrics:
+    count: int = 0
+    seconds: float = 0
+    parse_seconds: float = 0
+    bytes: int = 0
+    elements: int = 0
+    latency_buckets: List[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, metrics: RequestMetrics):
+        self.count += 1
+        self.seconds += metrics.seconds
+        self.parse_seconds += metrics.parse_seconds
+        self.bytes += metrics.bytes
+        self.elements += metrics.elements
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, metrics.seconds)] += 1
+        if metrics.error:
+            self.errors[metrics.error] = self.errors.get(metrics.error, 0) + 1
+
+    def as_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            seconds=self.seconds,
+            parseSeconds=self.parse_seconds,
+            networkSeconds=max(0.0, self.seconds - self.parse_seconds),
+            bytes=self.bytes,
+            elements=self.elements,
+            latency={
+                str(bound): count for bound, count
+                in zip([*LATENCY_BUCKETS, "inf"], self.latency_buckets)
+            },
+            errors=dict(self.errors),
+        )
+
+
+class ClientMetrics:
+    # Aggregates request metrics per conftool command within this process and hands
+    # each measurement to registered hooks (e.g. to forward them to a metrics system)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands: Dict[str, CommandMetrics] = {}
+        self._hooks: List[Callable[[RequestMetrics], None]] = []
+
+    def add_hook(self, hook: Callable[[RequestMetrics], None]):
+        with self._lock:
+            if hook not in self._hooks:
+                self._hooks.append(hook)
+
+    def record(self, metrics: RequestMetrics):
+        with self._lock:
+            self._commands.setdefault(metrics.command, CommandMetrics()).add(metrics)
+            hooks = list(self._hooks)
+        for hook in hooks:
+            try:
+                hook(metrics)
+            except Exception:
+                logger.exception("Conftool metrics hook failed")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: m.as_dict() for name, m in sorted(self._commands.items())}
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+
+
+client_metrics = ClientMetrics()
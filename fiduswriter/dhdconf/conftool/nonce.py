@@ -0,0 +1,72 @@
+import os
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+
+from dhdconf.conftool.api import clock_nonce
+from dhdconf.models import ConftoolNonce
+
+# Nonces have to increase across all processes and hosts talking to conftool with the
+# same API password. Both allocators keep dhconvalidator's clock based scheme and only
+# step past the clock when another process already used its value.
+
+
+def _allocate(on) -> int:
+    # A single statement, the row is only locked while it runs
+    table = on.ops.quote_name(ConftoolNonce._meta.db_table)
+    with on.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (id, value) VALUES (1, %s) ON CONFLICT (id) "
+            f"DO UPDATE SET value = GREATEST(EXCLUDED.value, {table}.value + 1) "
+            "RETURNING value",
+            [clock_nonce()],
+        )
+        return cursor.fetchone()[0]
+
+
+def database_nonce() -> int:
+    if connection.vendor == "postgresql":
+        if not connection.in_atomic_block:
+            return _allocate(connection)
+        # Inside the caller's transaction (e.g. with ATOMIC_REQUESTS or during a
+        # sync) the row lock would be held until that transaction ends, and every
+        # conftool request of every worker would queue behind it. A short-lived
+        # connection of our own commits right away instead.
+        own = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            return _allocate(own)
+        finally:
+            own.close()
+    # SQLite locks the whole database for the caller's transaction anyway, a second
+    # connection would only wait for it
+    with transaction.atomic():
+        row, _ = ConftoolNonce.objects.select_for_update().get_or_create(pk=1)
+        row.value = max(clock_nonce(), row.value + 1)
+        row.save(update_fields=["value"])
+    return row.value
+
+
+class FileNonce:
+    # For deployments on a single host without a shared database lock, the last value
+    # is kept in a file that is locked while it is updated.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        import fcntl
+
+        with self._lock, open(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                last = int(f.read().strip() or 0)
+                value = max(clock_nonce(), last + 1)
+                f.seek(0)
+                f.truncate()
+                f.write(str(value))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return value
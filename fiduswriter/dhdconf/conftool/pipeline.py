@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional, Set
+
+from django.db import connection, connections
+
+from dhdconf.conftool.api import ExportPaperResponse
+from dhdconf.conftool.importing import import_paper, PaperImportStatus
+from dhdconf.conftool.logbuffer import buffered_import_log, current_buffer, flush_old_entries
+from dhdconf.conftool.util import import_log_error
+from dhdconf.models import ConftoolUser, ImportLog
+
+logger = logging.getLogger(__name__)
+
+ErrorType = ImportLog.ErrorType
+
+_DONE = object()
+
+
+@dataclass
+class PaperImportResult:
+    processed: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+    def add(self, status: Optional[PaperImportStatus]):
+        self.processed += 1
+        if status == PaperImportStatus.CREATED:
+            self.created += 1
+        elif status == PaperImportStatus.UPDATED:
+            self.updated += 1
+        elif status == PaperImportStatus.UNCHANGED:
+            self.unchanged += 1
+        elif status == PaperImportStatus.SKIPPED:
+            self.skipped += 1
+        else:
+            self.failed += 1
+
+
+def _import_logged(
+    paper: ExportPaperResponse, force: bool, submitters: Set[int]
+) -> Optional[PaperImportStatus]:
+    # Each paper is imported in its own transaction, holding the lock on its row (see
+    # `import_paper`), so that workers never write the same document at once
+    if paper.submitting_author_id not in submitters:
+        return PaperImportStatus.SKIPPED
+    try:
+        return import_paper(paper, force=force).import_status
+    except Exception as e:
+        import_log_error(ErrorType.IMPORT_PAPER, e, paper=paper)
+        return None
+
+
+def import_papers(
+    papers: Iterable[ExportPaperResponse],
+    workers: int = 1,
+    force: bool = False,
+    progress: Optional[Callable[[PaperImportResult], None]] = None,
+    progress_every: int = 100,
+) -> PaperImportResult:
+    # Imports papers while they are still being streamed from conftool. With more than
+    # one worker, papers are handed to threads through a bounded queue, so parsing and
+    # database writes overlap without reading the whole export into memory.
+    # A document needs its submitting author as owner: papers of authors who never
+    # logged in are skipped, a sync after their first login imports them.
+    submitters = set(ConftoolUser.objects.values_list("conftool_id", flat=True))
+    result = PaperImportResult()
+    lock = threading.Lock()
+
+    def add(status):
+        with lock:
+            result.add(status)
+            if progress and result.processed % progress_every == 0:
+                progress(result)
+        flush_old_entries()
+
+    if workers > 1 and connection.vendor == "sqlite":
+        logger.warning("SQLite does not support concurrent writes, importing with one worker")
+        workers = 1
+    if workers <= 1:
+        for paper in papers:
+            add(_import_logged(paper, force, submitters))
+        return result
+
+    pending = queue.Queue(maxsize=workers * 2)
+    log_buffer = current_buffer()
+    # The first error that ended a worker, raised again in the calling thread.
+    # Errors of single papers are logged by `_import_logged`, this is for failures
+    # around them, e.g. in writing the log or in the progress callback.
+    errors = []
+    failed = threading.Event()
+
+    def work():
+        try:
+            with buffered_import_log(log_buffer) if log_buffer else nullcontext():
+                while not failed.is_set() and (paper := pending.get()) is not _DONE:
+                    add(_import_logged(paper, force, submitters))
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            # connections are per thread and not managed by a request cycle here
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=work, name=f"dhdconf-import-{i}", daemon=True)
+        for i in range(workers)
+    ]
+
+    def put(item, until) -> bool:
+        # A worker that ended takes nothing from the queue anymore, so never wait
+        # for free space without checking whether anyone is left to make it
+        while not until():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    for thread in threads:
+        thread.start()
+    try:
+        for paper in papers:
+            if not put(paper, until=failed.is_set):
+                break
+    finally:
+        for _ in threads:
+            put(_DONE, until=lambda: not any(thread.is_alive() for thread in threads))
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return result
@@ -0,0 +1,28 @@
+import os
+import threading
+from typing import Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class PerProcess(Generic[T]):
+    # Values created on first use (per set of arguments) and shared by the threads of
+    # a process, but not inherited by forked children (e.g. gunicorn workers forked
+    # from a preloaded master): threads and pooled sockets do not survive a fork, so
+    # children create their own.
+
+    def __init__(self, create: Callable[..., T]):
+        self._create = create
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._values: Dict[Tuple, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, *args) -> T:
+        with self._lock:
+            if args not in self._values:
+                self._values[args] = self._create(*args)
+            return self._values[args]
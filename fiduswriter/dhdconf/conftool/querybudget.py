@@ -0,0 +1,114 @@
+import functools
+import logging
+import re
+from collections import Counter
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from dhdconf.conftool.util import import_log
+from dhdconf.models import ImportLog
+
+logger = logging.getLogger(__name__)
+
+# Query budgets of the importer functions: the most queries one call may issue,
+# independent of the number of authors, users or addresses it handles. They are
+# checked if CONFTOOL_QUERY_BUDGETS is "log" (calls over budget are written to the
+# import log) or "raise" (as in `QueryBudgetTest`, see `QueryBudgetExceeded`). The
+# check runs once the call has returned, so with "raise" the changes of a call over
+# budget that runs its own transaction (e.g. `import_paper`) are already committed.
+BUDGETS: Dict[str, int] = {}
+
+_TRANSACTION_CONTROL = ("SAVEPOINT", "RELEASE", "ROLLBACK", "BEGIN", "COMMIT")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b|%s|\?")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+# the CASE WHEN branches of bulk_update(), one per updated row
+_CASES = re.compile(r"(?:\bWHEN \([^()]*\) THEN \S+?\s+)+(?=ELSE\b|END\b)")
+_SPACE = re.compile(r"\s+")
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+[`"]?(\w+)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql: str) -> Tuple[str, str]:
+    # (table, normalized SQL), queries that only differ in their values or in the
+    # number of values in IN lists, inserted rows or bulk updated rows share a shape
+    shape = _LITERALS.sub("?", sql)
+    shape = _ROWS.sub("(...)", _LISTS.sub("(...)", shape))
+    shape = _CASES.sub("WHEN (...) THEN ? ", shape)
+    shape = _SPACE.sub(" ", shape).strip()
+    table = _TABLE.search(shape)
+    return table.group(1) if table else "", shape
+
+
+class QueryRecorder:
+    # Counts the queries run on a connection within the block by shape. Transaction
+    # control (e.g. the savepoints of nested atomic blocks) is not counted.
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.shapes = Counter()
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(_TRANSACTION_CONTROL):
+            self.shapes[query_shape(sql)] += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self) -> "QueryRecorder":
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self) -> int:
+        return sum(self.shapes.values())
+
+    def by_table(self) -> Counter:
+        tables = Counter()
+        for (table, _), count in self.shapes.items():
+            tables[table] += count
+        return tables
+
+    def summary(self, limit: int = 5) -> str:
+        return "; ".join(
+            f"{count}x {shape}" for (_, shape), count in self.shapes.most_common(limit)
+        )
+
+
+def query_budget(name: str, queries: int):
+    # Declares the budget of an importer function and checks it on every call
+    BUDGETS[name] = queries
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            mode = settings.CONFTOOL_QUERY_BUDGETS
+            if mode not in ("log", "raise"):
+                return func(*args, **kwargs)
+            with QueryRecorder() as recorder:
+                result = func(*args, **kwargs)
+            if len(recorder) > BUDGETS[name]:
+                _exceeded(name, recorder, mode)
+            return result
+        return wrapper
+    return decorator
+
+
+def _exceeded(name: str, recorder: QueryRecorder, mode: str):
+    tables = ", ".join(f"{table or '?'}: {count}" for table, count in recorder.by_table().most_common())
+    message = f"{name} issued {len(recorder)} queries, its budget is {BUDGETS[name]} ({tables})"
+    if mode == "raise":
+        raise QueryBudgetExceeded(f"{message}\n{recorder.summary(limit=20)}")
+    logger.warning(f"{message}: {recorder.summary()}")
+    import_log(
+        success=True,
+        error_type=ImportLog.ErrorType.QUERY_BUDGET,
+        message=message[:ImportLog.MESSAGE_LENGTH],
+    )
@@ -0,0 +1,64 @@
+import gzip
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterable, Iterator
+
+# Streamed conftool exports can be written to gzipped snapshots and replayed later
+# through the same parsing path, e.g. to re-run an import or for benchmarking without
+# putting load on conftool. Both directions stream, so memory use stays bounded.
+
+
+class SnapshotStore:
+    RECORD = "record"
+    REPLAY = "replay"
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory: str, mode: str = REPLAY):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"Unknown snapshot mode: {mode}")
+        self.directory = directory
+        self.mode = mode
+
+    def path(self, params: dict) -> str:
+        name = params.get("export_select", "export")
+        if user_ids := params.get("form_userID"):
+            name += "-" + hashlib.sha1(str(user_ids).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, f"{name}.xml.gz")
+
+    @contextmanager
+    def open(
+        self, params: dict, fetch: Callable[[], ContextManager[Iterable[bytes]]]
+    ) -> Iterator[Iterable[bytes]]:
+        if self.mode == self.REPLAY:
+            with gzip.open(self.path(params), "rb") as f:
+                yield iter(lambda: f.read(self.CHUNK_SIZE), b"")
+        else:
+            with fetch() as chunks:
+                with self._record(self.path(params), chunks) as recorded:
+                    yield recorded
+
+    @contextmanager
+    def _record(self, path: str, chunks: Iterable[bytes]) -> Iterator[Iterable[bytes]]:
+        # Only complete responses become snapshots, so the data goes to a temporary
+        # file that is moved into place once the response has been read to its end
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial = f"{path}.partial"
+        complete = False
+
+        def recorded():
+            nonlocal complete
+            for chunk in chunks:
+                out.write(chunk)
+                yield chunk
+            complete = True
+
+        try:
+            with gzip.open(partial, "wb") as out:
+                yield recorded()
+        finally:
+            if complete:
+                os.replace(partial, path)
+            elif os.path.exists(partial):
+                os.remove(partial)
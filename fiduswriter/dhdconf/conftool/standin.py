@@ -0,0 +1,244 @@
+import hashlib
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+from dhdconf.conftool.synthetic import papers_export, users_export
+
+# A local stand-in for the parts of the conftool REST API we use (remoteLogin and
+# adminExport with xml_short exports of users and papers), serving synthetic data.
+# It validates nonces and hashes like conftool and can inject latency, slowly
+# trickling responses, nonce rejections and truncated exports, so that the real
+# client can be load tested and benchmarked offline.
+
+
+@dataclass
+class StandinConfig:
+    secret: str = "secret"
+    # accepted for every user, who log in as "user<id>" or "author<id>@example.com"
+    password: str = "password"
+    users: int = 100
+    papers: int = 100
+    authors: int = 3
+    extra_columns: int = 20
+    seed: int = 0
+    # seconds before each response starts
+    latency: float = 0.0
+    # send exports in pieces of this many bytes with a pause after each
+    trickle_bytes: int = 0
+    trickle_delay: float = 0.0
+    # probability of rejecting a valid nonce, and of cutting off an export midway
+    nonce_rejection_rate: float = 0.0
+    truncate_rate: float = 0.0
+    # compress exports if the client accepts it
+    gzip: bool = True
+
+
+def _xml(tag: str, **children) -> bytes:
+    inner = "".join(f"<{k}>{escape(str(v))}</{k}>" for k, v in children.items())
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<{tag}>{inner}</{tag}>'.encode("utf-8")
+
+
+def _error(tag: str, message: str) -> bytes:
+    return _xml(tag, result="false", message=message)
+
+
+def _ids(value: Optional[str]):
+    if value is None:
+        return None
+    return {int(i) for i in value.split(",") if i.strip()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        standin = self.server.standin
+        config = standin.config
+        params = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+        if config.latency:
+            time.sleep(config.latency)
+        page = params.get("page")
+        tag = "login" if params.get("command") == "login" else "rest"
+        if error := standin.check_nonce(params.get("nonce"), params.get("passhash")):
+            return self._send(_error(tag, error))
+        if page == "remoteLogin" and params.get("command") == "login":
+            self._send(standin.login(params.get("user", ""), params.get("password", "")))
+        elif page == "remoteLogin" and params.get("command") == "request":
+            self._send(standin.user_info(params.get("user", "")))
+        elif page == "adminExport" and params.get("export_select") in ("users", "papers"):
+            self._stream(standin.export(params["export_select"], _ids(params.get("form_userID"))))
+        else:
+            self._send(_error("rest", "unknown command"))
+
+    def _send(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, chunks: Iterable[bytes]):
+        config = self.server.standin.config
+        compress = config.gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+        truncate = self.server.standin.truncates()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        sent = 0
+        for chunk in chunks:
+            if compressor:
+                chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._write_chunk(chunk)
+            sent += 1
+            if truncate and sent >= 3:
+                # drop the connection without finishing the body
+                self.close_connection = True
+                return
+        if compressor:
+            self._write_chunk(compressor.flush())
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes):
+        config = self.server.standin.config
+        step = config.trickle_bytes or len(data)
+        for start in range(0, len(data), step or 1):
+            piece = data[start:start + step]
+            self.wfile.write(f"{len(piece):x}\r\n".encode("ascii") + piece + b"\r\n")
+            if config.trickle_bytes and config.trickle_delay:
+                self.wfile.flush()
+                time.sleep(config.trickle_delay)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    standin: "ConftoolStandin"
+
+
+class ConftoolStandin:
+
+    def __init__(self, config: StandinConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StandinConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._last_nonce = 0
+        self.requests = 0
+        self.rejected_nonces = 0
+        self.truncated = 0
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/rest.php"
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def truncates(self) -> bool:
+        if truncate := self._roll(self.config.truncate_rate):
+            with self._lock:
+                self.truncated += 1
+        return truncate
+
+    def check_nonce(self, nonce: Optional[str], passhash: Optional[str]) -> Optional[str]:
+        # Returns the error message conftool would answer with, if any
+        if not nonce or not nonce.isdigit():
+            return "access denied: nonce missing"
+        expected = hashlib.sha256((nonce + self.config.secret).encode("utf-8")).hexdigest()
+        if passhash != expected:
+            return "access denied: wrong passhash"
+        with self._lock:
+            self.requests += 1
+            rejected = int(nonce) <= self._last_nonce or (
+                self.config.nonce_rejection_rate > 0
+                and self._random.random() < self.config.nonce_rejection_rate
+            )
+            if rejected:
+                self.rejected_nonces += 1
+                return "access denied: nonce must be bigger than last nonce"
+            self._last_nonce = int(nonce)
+        return None
+
+    def _person_id(self, user: str) -> Optional[int]:
+        for prefix, suffix in (("user", ""), ("author", "@example.com")):
+            if user.startswith(prefix) and user.endswith(suffix):
+                number = user[len(prefix):len(user) - len(suffix)]
+                if number.isdigit() and 1 <= int(number) <= self.config.users:
+                    return int(number)
+        return None
+
+    def login(self, user: str, password: str) -> bytes:
+        person_id = self._person_id(user)
+        if person_id is None or password != self.config.password:
+            return _error("login", "login failed")
+        return _xml("login", result="true", id=person_id, username=f"user{person_id}")
+
+    def user_info(self, user: str) -> bytes:
+        if (person_id := self._person_id(user)) is None:
+            return _error("rest", "user name unknown")
+        info = (
+            f"<user><personID>{person_id}</personID><username>user{person_id}</username>"
+            f"<name>Lastname{person_id}</name><firstname>Firstname</firstname>"
+            f"<email>author{person_id}@example.com</email></user>"
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f"<request><result>true</result>{info}</request>"
+        ).encode("utf-8")
+
+    def export(self, select: str, user_ids=None) -> Iterable[bytes]:
+        config = self.config
+        if select == "users":
+            return users_export(config.users, seed=config.seed, person_ids=user_ids)
+        return papers_export(
+            config.papers,
+            authors=config.authors,
+            extra_columns=config.extra_columns,
+            seed=config.seed,
+            max_person_id=config.users,
+            submitting_author_ids=user_ids,
+        )
+
+    def start(self) -> "ConftoolStandin":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="conftool-standin", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def close(self):
+        # releases the listening socket once serving has stopped
+        self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self.close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "ConftoolStandin":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
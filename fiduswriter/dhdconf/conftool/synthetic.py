@@ -0,0 +1,93 @@
+import random
+from typing import Collection, Iterator, Optional
+from xml.sax.saxutils import escape
+
+# Generates conftool-shaped "xml_short" exports for benchmarks and local testing.
+# Only the columns we read are realistic, additional columns are filled with noise
+# to resemble the width of actual exports.
+
+_WORDS = (
+    "digital humanities text corpus edition network analysis annotation archive "
+    "visualisation modelling linked open data research software infrastructure"
+).split()
+
+
+def _words(rnd: random.Random, count: int) -> str:
+    return " ".join(rnd.choice(_WORDS) for _ in range(count))
+
+
+def _elem(tag: str, text) -> str:
+    return f"<{tag}>{escape(str(text))}</{tag}>"
+
+
+def paper_xml(
+    paper_id: int,
+    submitting_author_id: int,
+    authors: int = 3,
+    extra_columns: int = 20,
+    rnd: random.Random = None,
+) -> str:
+    rnd = rnd or random.Random(paper_id)
+    parts = [
+        _elem("paperID", paper_id),
+        _elem("submitting_author_ID", submitting_author_id),
+        _elem("title", _words(rnd, 8).capitalize()),
+        _elem("contribution_type", rnd.choice(["Vortrag", "Poster", "Panel"])),
+        _elem("abstract", _words(rnd, 120)),
+        _elem("keywords", ", ".join(rnd.sample(_WORDS, 4))),
+        _elem("topics", ", ".join(rnd.sample(_WORDS, 3))),
+    ]
+    parts.extend(_elem(f"column_{i}", _words(rnd, 3)) for i in range(extra_columns))
+    for idx in range(1, authors + 1):
+        author_id = submitting_author_id if idx == 1 else rnd.randint(1, 10 ** 6)
+        parts.extend([
+            _elem(f"authors_formatted_{idx}_name", f"Lastname{author_id}, Firstname"),
+            _elem(f"authors_formatted_{idx}_organisation", _words(rnd, 2).title()),
+            _elem(f"authors_formatted_{idx}_email", f"author{author_id}@example.com"),
+            _elem(f"authors_formatted_{idx}_orcid", f"0000-0000-0000-{author_id % 10000:04d}"),
+        ])
+    return "<paper>" + "".join(parts) + "</paper>"
+
+
+def user_xml(person_id: int, rnd: random.Random = None) -> str:
+    rnd = rnd or random.Random(person_id)
+    return "<user>" + "".join([
+        _elem("personID", person_id),
+        _elem("username", f"user{person_id}"),
+        _elem("email", f"author{person_id}@example.com"),
+        _elem("email_validated", "1" if rnd.random() < 0.9 else "0"),
+        _elem("email2", f"alt{person_id}@example.com" if rnd.random() < 0.3 else ""),
+        _elem("email2_validated", "1" if rnd.random() < 0.5 else "0"),
+    ]) + "</user>"
+
+
+def papers_export(
+    count: int,
+    authors: int = 3,
+    extra_columns: int = 20,
+    seed: int = 0,
+    max_person_id: int = 10 ** 6,
+    submitting_author_ids: Optional[Collection[int]] = None,
+) -> Iterator[bytes]:
+    # `submitting_author_ids` filters like conftool's form_userID, without changing
+    # the papers that are generated
+    rnd = random.Random(seed)
+    yield b'<?xml version="1.0" encoding="UTF-8"?>\n<papers>'
+    for paper_id in range(1, count + 1):
+        submitting_author_id = rnd.randint(1, max_person_id)
+        paper = paper_xml(paper_id, submitting_author_id, authors, extra_columns, rnd)
+        if submitting_author_ids is None or submitting_author_id in submitting_author_ids:
+            yield paper.encode("utf-8")
+    yield b"</papers>"
+
+
+def users_export(
+    count: int, seed: int = 0, person_ids: Optional[Collection[int]] = None
+) -> Iterator[bytes]:
+    rnd = random.Random(seed)
+    yield b'<?xml version="1.0" encoding="UTF-8"?>\n<users>'
+    for person_id in range(1, count + 1):
+        user = user_xml(person_id, rnd)
+        if person_ids is None or person_id in person_ids:
+            yield user.encode("utf-8")
+    yield b"</users>"
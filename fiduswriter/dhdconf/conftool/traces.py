@@ -0,0 +1,87 @@
+import hashlib
+import os
+import traceback
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Iterable
+
+import django.utils.timezone
+from django.db.models import F
+
+from dhdconf.models import ImportLog, ImportLogTrace
+
+
+@dataclass(frozen=True)
+class PendingTrace:
+    fingerprint: str
+    error_class: str
+    stacktrace: str
+
+
+def _qualified_name(cls) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def exception_trace(error: BaseException) -> PendingTrace:
+    # Errors raised the same way share a fingerprint: it covers the exception types
+    # and the frames (file, function and source line) of the whole chain, but not the
+    # messages or line numbers, which contain ids and change between deployments.
+    # Traces moved from the log by migration 0006 have fingerprints of their text
+    # and are not continued by these.
+    parts = []
+    seen = set()
+    current = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        parts.append(_qualified_name(type(current)))
+        parts.extend(
+            f"{os.path.basename(frame.filename)}:{frame.name}:{(frame.line or '').strip()}"
+            for frame in traceback.extract_tb(current.__traceback__)
+        )
+        if current.__cause__ is not None or current.__suppress_context__:
+            current = current.__cause__
+        else:
+            current = current.__context__
+    return PendingTrace(
+        fingerprint=hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest(),
+        error_class=_qualified_name(type(error))[:200],
+        stacktrace="".join(traceback.TracebackException.from_exception(error).format()),
+    )
+
+
+def attach_traces(logs: Iterable[ImportLog]):
+    # Stores the pending traces of unsaved log entries (one row per fingerprint),
+    # counts their occurrences and links the entries to them
+    pending = [log for log in logs if getattr(log, "pending_trace", None)]
+    if not pending:
+        return
+    traces = {}
+    counts = Counter()
+    for log in pending:
+        traces.setdefault(log.pending_trace.fingerprint, log.pending_trace)
+        counts[log.pending_trace.fingerprint] += 1
+    ImportLogTrace.objects.bulk_create(
+        [
+            ImportLogTrace(
+                fingerprint=trace.fingerprint,
+                error_class=trace.error_class,
+                stacktrace=trace.stacktrace,
+            )
+            for trace in traces.values()
+        ],
+        ignore_conflicts=True,
+    )
+    # one update per distinct count, usually a single one
+    by_count = defaultdict(list)
+    for fingerprint, count in counts.items():
+        by_count[count].append(fingerprint)
+    now = django.utils.timezone.now()
+    for count, fingerprints in by_count.items():
+        ImportLogTrace.objects.filter(fingerprint__in=fingerprints).update(
+            occurrences=F("occurrences") + count, last_seen=now
+        )
+    ids = dict(
+        ImportLogTrace.objects.filter(fingerprint__in=traces).values_list("fingerprint", "pk")
+    )
+    for log in pending:
+        log.trace_id = ids.get(log.pending_trace.fingerprint)
@@ -1,14 +1,121 @@
-import traceback
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.utils.module_loading import import_string
 
+from dhdconf.conftool.api import ConftoolClient, pooled_session
+from dhdconf.conftool.logbuffer import current_buffer
+from dhdconf.conftool.metrics import ClientMetrics, client_metrics
+from dhdconf.conftool.nonce import database_nonce, FileNonce
+from dhdconf.conftool.process import PerProcess
+from dhdconf.conftool.snapshots import SnapshotStore
+from dhdconf.conftool.traces import PendingTrace, attach_traces, exception_trace
 from dhdconf.models import ImportLog
 
 ErrorType = ImportLog.ErrorType
 UserModel = get_user_model()
 
 
-def import_log(request=None, paper=None, **kwargs) -> ImportLog:
+_file_nonces = {}
+_metrics_hooks_installed = False
+# clients are created by concurrent refresh threads, the hooks are added only once
+_metrics_hooks_lock = threading.Lock()
+
+
+def _metrics() -> ClientMetrics:
+    global _metrics_hooks_installed
+    if not _metrics_hooks_installed:
+        with _metrics_hooks_lock:
+            if not _metrics_hooks_installed:
+                for hook in settings.CONFTOOL_METRICS_HOOKS:
+                    client_metrics.add_hook(import_string(hook) if isinstance(hook, str) else hook)
+                _metrics_hooks_installed = True
+    return client_metrics
+
+
+def _nonce_source():
+    if settings.CONFTOOL_NONCE_SOURCE == "database":
+        return database_nonce
+    elif settings.CONFTOOL_NONCE_SOURCE == "file":
+        path = settings.CONFTOOL_NONCE_FILE
+        return _file_nonces.setdefault(path, FileNonce(path))
+    else:
+        return None  # the client's process-local default
+
+
+def conftool_client(snapshots: SnapshotStore = None) -> ConftoolClient:
+    # Clients are cheap, the connection pool behind them is shared per process
+    return ConftoolClient(
+        service_url=settings.CONFTOOL_URL,
+        secret=settings.CONFTOOL_APIPASS,
+        session=pooled_session(settings.CONFTOOL_POOL_SIZE),
+        timeout=(settings.CONFTOOL_CONNECT_TIMEOUT, settings.CONFTOOL_READ_TIMEOUT),
+        nonce_source=_nonce_source(),
+        nonce_retries=settings.CONFTOOL_NONCE_RETRIES,
+        snapshots=snapshots,
+        metrics=_metrics(),
+    )
+
+
+# Runs conftool requests in background threads, to overlap them with other work
+_executor = PerProcess(lambda: ThreadPoolExecutor(
+    max_workers=settings.CONFTOOL_POOL_SIZE,
+    thread_name_prefix="dhdconf-conftool",
+))
+
+
+def _call_in_thread(call, args):
+    try:
+        return call(*args)
+    finally:
+        # pool threads are not managed by django's request cycle (the nonce source
+        # may have used the database)
+        connections.close_all()
+
+
+def submit_conftool_call(call, *args) -> Future:
+    return _executor.get().submit(_call_in_thread, call, args)
+
+
+def advisory_lock_key(namespace: str, key: int) -> int:
+    # The bigint key of PostgreSQL's advisory lock functions: the crc32 of the
+    # namespace in the upper and the id in the lower 32 bits. Ids below 2 ** 32 (all
+    # conftool ids) never share a key within a namespace.
+    value = zlib.crc32(namespace.encode("utf-8")) << 32 | key & 0xFFFFFFFF
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def lock_conftool_id(model, conftool_id: int) -> bool:
+    # Serializes work on one conftool entity across processes until the end of the
+    # current transaction and returns whether it did. This uses advisory locks on
+    # PostgreSQL; other backends rely on the unique conftool_id constraint and
+    # callers retrying on conflict.
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(%s)",
+            [advisory_lock_key(model._meta.label, conftool_id)],
+        )
+    return True
+
+
+@dataclass
+class ImportLogContext:
+    # What `import_log` records about a request, for work that goes on after the
+    # response was sent and must not keep the request itself
+    import_log_id: str
+    user: Optional[UserModel] = None
+    path: Optional[str] = None
+
+
+def import_log(request=None, paper=None, pending_trace: PendingTrace = None, **kwargs) -> ImportLog:
     if request and not hasattr(request, 'import_log_id'):
         setattr(request, 'import_log_id', ImportLog.generate_request_id())
     log = ImportLog(
@@ -18,7 +125,13 @@ def import_log(request=None, paper=None, **kwargs) -> ImportLog:
         conftool_paper_id=paper.paper_id if paper else None,
         **kwargs
     )
-    log.save()
+    log.pending_trace = pending_trace
+    # inside `buffered_import_log` the entry is written when the buffer is flushed
+    if buffer := current_buffer():
+        buffer.add(log)
+    else:
+        attach_traces([log])
+        log.save()
     return log
 
 
@@ -27,7 +140,7 @@ def import_log_error(error_type: ErrorType, error, request=None, **kwargs) -> Im
         request=request,
         error_type=error_type,
         success=False,
-        message=getattr(error, "message", repr(error)),
-        stacktrace=''.join(traceback.TracebackException.from_exception(error).format()),
+        message=str(getattr(error, "message", repr(error)))[:ImportLog.MESSAGE_LENGTH],
+        pending_trace=exception_trace(error),
         **kwargs
     )
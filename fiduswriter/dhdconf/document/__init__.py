@@ -1,5 +1,7 @@
-from dhdconf.document.template import ensure_dhd_document_template
+from dhdconf.document.template import ensure_dhd_document_template, \
+    cached_dhd_document_template
 
 __all__ = [
-    ensure_dhd_document_template
+    ensure_dhd_document_template,
+    cached_dhd_document_template,
 ]
@@ -1,5 +1,8 @@
 
-from django.db import transaction
+import json
+
+import django.utils.timezone
+from django.db import connection, transaction
 
 from document.models import Document
 
@@ -41,24 +44,20 @@ class DhdDocumentContentUpdate:
         ).items() if value})
         self.orcid_ids.append(orcid if orcid else self.ORCID_ID_UNKNOWN)
 
-    @classmethod
-    def _update_part(cls, parts: list, part_type: str, part_id: str=None, content=None):
-        for part in parts:
-            try:
-                if (
-                    content
-                    and (part["type"] == part_type)
-                    and (part_id is None or part["attrs"]["id"] == part_id)
-                ):
-                    part["content"] = content
-                    break
-            except (KeyError, AttributeError):
-                pass
-
-
-    def set_on(self, document=None, pk=None):
-        if pk is None:
-            pk = document.pk
+    @staticmethod
+    def _index_parts(parts: list) -> dict:
+        # Maps (type, id) and (type, None) to the position of the first matching part
+        index = {}
+        for position, part in enumerate(parts):
+            if not isinstance(part, dict) or "type" not in part:
+                continue
+            attrs = part.get("attrs")
+            if isinstance(attrs, dict) and "id" in attrs:
+                index.setdefault((part["type"], attrs["id"]), position)
+            index.setdefault((part["type"], None), position)
+        return index
+
+    def _part_contents(self) -> list:
         ctype = [{"type": "tag", "attrs": {"tag": self.contribution_type}}]
         keywords = [{"type": "tag", "attrs": {"tag": i}} for i in sorted(self.keywords)]
         topics = [{"type": "tag", "attrs": {"tag": i}} for i in sorted(self.topics)]
@@ -78,19 +77,109 @@ class DhdDocumentContentUpdate:
                     {"type": "text", "text": self.abstract}
                 ]}
             ]
-
+        # (part type, part id, new content), empty contents leave the part untouched
+        return [
+            ("title", None, title),
+            ("heading_part", "visibleTitle", visible_title),
+            ("tags_part", "contributionTypes", ctype),
+            ("tags_part", "keywords", keywords),
+            ("tags_part", "topics", topics),
+            ("tags_part", "orcidIds", orcid_ids),
+            ("contributors_part", None, contributors),
+            ("richtext_part", "abstract", abstract),
+        ]
+
+    def _targets(self, index: dict) -> dict:
+        # position -> new content for every part that we would write
+        targets = {}
+        for part_type, part_id, content in self._part_contents():
+            if content and (position := index.get((part_type, part_id))) is not None:
+                targets.setdefault(position, content)
+        return targets
+
+    def set_on(self, document=None, pk=None) -> bool:
+        # Writes only the parts that changed and returns whether anything was written
+        if pk is None:
+            pk = document.pk
         with transaction.atomic():
-            if locked := Document.objects.select_for_update().filter(pk=pk).first():
-                parts = locked.content.get("content", list())
-                self._update_part(parts, "title", content=title)
-                self._update_part(parts, "heading_part", "visibleTitle", visible_title)
-                self._update_part(parts, "tags_part", "contributionTypes", ctype)
-                self._update_part(parts, "tags_part", "keywords", keywords)
-                self._update_part(parts, "tags_part", "topics", topics)
-                self._update_part(parts, "tags_part", "orcidIds", orcid_ids)
-                self._update_part(parts, "contributors_part", content=contributors)
-                self._update_part(parts, "richtext_part", "abstract", abstract)
-                locked.content["content"] = parts
-                locked.save()
-        if document:
-            document.refresh_from_db(fields=('content',))
+            if connection.vendor == "postgresql":
+                changed = self._set_on_postgresql(pk)
+            else:
+                changed = self._set_on_generic(pk)
+        if changed and document and "content" not in document.get_deferred_fields():
+            document.refresh_from_db(fields=("content",))
+        return changed
+
+    def _set_on_generic(self, pk) -> bool:
+        locked = Document.objects.select_for_update().only("content").filter(pk=pk).first()
+        if not locked:
+            return False
+        parts = locked.content.get("content", list())
+        changes = {
+            position: content
+            for position, content in self._targets(self._index_parts(parts)).items()
+            if parts[position].get("content") != content
+        }
+        for position, content in changes.items():
+            parts[position]["content"] = content
+        if changes:
+            locked.content["content"] = parts
+            locked.save(update_fields=["content", "updated"])
+        return bool(changes)
+
+    def _set_on_postgresql(self, pk) -> bool:
+        # Reads only the part types and ids and the current content of the parts that
+        # we update, then sets changed parts with jsonb_set() without transferring the
+        # (possibly large) rest of the document
+        quote = connection.ops.quote_name
+        table = quote(Document._meta.db_table)
+        column = quote(Document._meta.get_field("content").column)
+        updated = quote(Document._meta.get_field("updated").column)
+        pk_column = quote(Document._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT part->>'type', part->'attrs'->>'id' FROM {table}, "
+                f"jsonb_array_elements(CASE WHEN jsonb_typeof({column}->'content') = 'array' "
+                f"THEN {column}->'content' ELSE '[]'::jsonb END) AS part "
+                f"WHERE {table}.{pk_column} = %s FOR UPDATE OF {table}",
+                [pk],
+            )
+            parts = [
+                {"type": part_type, "attrs": {"id": part_id}} if part_id is not None
+                else {"type": part_type}
+                for part_type, part_id in cursor.fetchall()
+            ]
+            targets = self._targets(self._index_parts(parts))
+            if not targets:
+                return False
+            positions = list(targets)
+            cursor.execute(
+                "SELECT {} FROM {} WHERE {} = %s".format(
+                    ", ".join([f"{column} #> %s::text[]"] * len(positions)), table, pk_column
+                ),
+                [*(["content", str(p), "content"] for p in positions), pk],
+            )
+            current = cursor.fetchone()
+            changes = [
+                (position, targets[position])
+                for position, value in zip(positions, current)
+                if _as_json(value) != targets[position]
+            ]
+            if not changes:
+                return False
+            expression = column
+            params = []
+            for position, content in changes:
+                expression = f"jsonb_set({expression}, %s::text[], %s::jsonb)"
+                params.extend([["content", str(position), "content"], json.dumps(content)])
+            cursor.execute(
+                f"UPDATE {table} SET {column} = {expression}, {updated} = %s "
+                f"WHERE {pk_column} = %s",
+                [*params, django.utils.timezone.now(), pk],
+            )
+        return True
+
+
+def _as_json(value):
+    # depending on the driver's configuration jsonb arrives decoded or as text
+    return json.loads(value) if isinstance(value, str) else value
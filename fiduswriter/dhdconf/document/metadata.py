@@ -0,0 +1,103 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from dhdconf.document.content import DhdDocumentContentUpdate
+from dhdconf.models import ConftoolDocument, ConftoolDocumentTag
+
+Kind = ConftoolDocumentTag.Kind
+
+# The ids of the tags parts that `DhdDocumentContentUpdate` writes the metadata to
+_TAG_PARTS = {
+    "keywords": Kind.KEYWORD,
+    "topics": Kind.TOPIC,
+    "orcidIds": Kind.ORCID,
+}
+
+
+def normalized_tag(kind: str, value: str) -> str:
+    # Tags are stored and searched in this form: keywords in lower case, ORCIDs in
+    # upper case (their check digit may be an "X") and topics as they are, since the
+    # topic filter lists them
+    value = " ".join(value.split())
+    if kind == Kind.KEYWORD:
+        value = value.lower()
+    elif kind == Kind.ORCID:
+        value = value.upper()
+    return value[:ConftoolDocumentTag.VALUE_LENGTH]
+
+
+@dataclass
+class SubmissionMetadata:
+    contribution_type: str = ""
+    keywords: List[str] = field(default_factory=list)
+    topics: List[str] = field(default_factory=list)
+    orcids: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_content(cls, content: dict) -> "SubmissionMetadata":
+        # Reads the metadata back from the tags parts of a document's content
+        tags = {"contributionTypes": [], **{part_id: [] for part_id in _TAG_PARTS}}
+        for part in content.get("content", []) if isinstance(content, dict) else []:
+            if not isinstance(part, dict) or part.get("type") != "tags_part":
+                continue
+            part_id = (part.get("attrs") or {}).get("id")
+            if part_id in tags and not tags[part_id]:
+                tags[part_id] = [
+                    tag["attrs"]["tag"] for tag in part.get("content", [])
+                    if isinstance(tag, dict) and (tag.get("attrs") or {}).get("tag")
+                ]
+        return cls(
+            contribution_type=next(iter(tags["contributionTypes"]), ""),
+            keywords=tags["keywords"],
+            topics=tags["topics"],
+            orcids=tags["orcidIds"],
+        )
+
+    def tags(self) -> set:
+        # (kind, value) of all tags, without the placeholder of unknown ORCIDs
+        values = [
+            (Kind.KEYWORD, self.keywords),
+            (Kind.TOPIC, self.topics),
+            (Kind.ORCID, [
+                orcid for orcid in self.orcids
+                if orcid != DhdDocumentContentUpdate.ORCID_ID_UNKNOWN
+            ]),
+        ]
+        return {
+            (kind, normalized_tag(kind, value))
+            for kind, kind_values in values for value in kind_values if value and value.strip()
+        }
+
+
+def store_metadata(documents: List[Tuple[ConftoolDocument, SubmissionMetadata]]):
+    # Stores the metadata of many documents with a fixed number of queries, only
+    # changing the tags and contribution types that differ
+    if not documents:
+        return
+    wanted = {
+        (document.pk, kind, value)
+        for document, metadata in documents for kind, value in metadata.tags()
+    }
+    existing = {
+        (document_id, kind, value): pk
+        for pk, document_id, kind, value in ConftoolDocumentTag.objects.filter(
+            document_id__in=[document.pk for document, _ in documents]
+        ).values_list("pk", "document_id", "kind", "value")
+    }
+    stale = [pk for key, pk in existing.items() if key not in wanted]
+    if stale:
+        ConftoolDocumentTag.objects.filter(pk__in=stale).delete()
+    # a concurrent import of the same paper may have added some of them already
+    ConftoolDocumentTag.objects.bulk_create([
+        ConftoolDocumentTag(document_id=document_id, kind=kind, value=value)
+        for document_id, kind, value in wanted if (document_id, kind, value) not in existing
+    ], ignore_conflicts=True)
+
+    changed = []
+    for document, metadata in documents:
+        contribution_type = metadata.contribution_type[:ConftoolDocument.CONTRIBUTION_TYPE_LENGTH]
+        if document.contribution_type != contribution_type:
+            document.contribution_type = contribution_type
+            changed.append(document)
+    if changed:
+        ConftoolDocument.objects.bulk_update(changed, ["contribution_type"])
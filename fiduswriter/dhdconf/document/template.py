@@ -1,5 +1,9 @@
 import json
 import os
+import threading
+import time
+from functools import lru_cache
+from typing import Tuple
 
 from django.conf import settings
 from django.db import transaction
@@ -29,6 +33,88 @@ def ensure_dhd_document_template(reset_to_defaults=False) -> DocumentTemplate:
     return template
 
 
+# The template and a serialized copy of its content are kept per process, so that
+# creating many documents neither queries the template nor deep-copies its content.
+# Entries are checked against the template's `updated` stamp every few seconds.
+_cache = None
+_cache_lock = threading.Lock()
+# Bumped on every invalidation, an entry read before the last one is not stored
+_generation = 0
+# A template created in a transaction that has not committed yet could still be
+# rolled back and is not cached until then
+_uncommitted_pk = None
+
+
+class _CacheEntry:
+    def __init__(self, template: DocumentTemplate, skeleton: str):
+        self.template = template
+        self.skeleton = skeleton
+        self.checked = time.monotonic()
+
+
+def invalidate_template_cache(instance=None, created=False, **kwargs):
+    global _cache, _generation, _uncommitted_pk
+    with _cache_lock:
+        _cache = None
+        _generation += 1
+        if created:
+            _uncommitted_pk = instance.pk
+    if created:
+        transaction.on_commit(_committed)
+
+
+def _committed():
+    global _uncommitted_pk
+    with _cache_lock:
+        _uncommitted_pk = None
+
+
+def _cached_entry():
+    global _cache
+    with _cache_lock:
+        entry = _cache
+    if entry is None:
+        return None
+    if time.monotonic() - entry.checked > settings.DHD_ARTICLE_TEMPLATE_CACHE_SECONDS:
+        updated = DocumentTemplate.objects.filter(pk=entry.template.pk).values_list(
+            "updated", flat=True
+        ).first()
+        with _cache_lock:
+            if updated is None or updated != entry.template.updated:
+                _cache = None
+                return None
+            entry.checked = time.monotonic()
+    return entry
+
+
+def _store(entry: _CacheEntry, generation: int):
+    global _cache
+    with _cache_lock:
+        if generation == _generation and entry.template.pk != _uncommitted_pk:
+            _cache = entry
+
+
+def cached_dhd_document_template() -> Tuple[DocumentTemplate, dict]:
+    # Returns the template and a fresh copy of its content for a new document
+    if entry := _cached_entry():
+        return entry.template, json.loads(entry.skeleton)
+    with _cache_lock:
+        generation = _generation
+    template = ensure_dhd_document_template()
+    entry = _CacheEntry(template, json.dumps(template.content))
+    # Stored right away, unless the template was created in a transaction that has not
+    # committed yet: then each import reads it again until the commit. Saving the
+    # template invalidates the cache, so an entry read before a concurrent change is
+    # not stored either.
+    _store(entry, generation)
+    return template, json.loads(entry.skeleton)
+
+
 def _read_template_file() -> dict:
+    return json.loads(_template_file_content())
+
+
+@lru_cache(maxsize=1)
+def _template_file_content() -> str:
     with open(f"{os.path.dirname(__file__)}/data/template.json") as f:
-        return json.load(f)
+        return f.read()
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncHour
+
+from dhdconf.models import ImportHealth, ImportLog
+
+
+def _hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+# Log entries may be written after later ones were rolled up already, e.g. when they
+# were added in a transaction that committed late. Each run recomputes this many
+# hours before the latest rolled up one as well.
+TRAILING_HOURS = 1
+
+
+def _retained_since() -> datetime:
+    # The first hour that `dhdconf_prune_logs` has not thinned out yet. Recomputing
+    # earlier hours would replace their counts with those of the remaining entries.
+    days = min(
+        settings.CONFTOOL_IMPORT_LOG_RETENTION_DAYS,
+        settings.CONFTOOL_IMPORT_LOG_SUCCESS_RETENTION_DAYS,
+    )
+    return _hour(django.utils.timezone.now() - timedelta(days=days)) + timedelta(hours=1)
+
+
+def rollup_import_health(since: datetime = None, full: bool = False) -> int:
+    # Recomputes the hourly rollup from `since` on, by default from shortly before the
+    # latest hour rolled up before (which may have been incomplete then), or with
+    # `full` from the oldest log entry. Hours older than the log retention are never
+    # recomputed. Only the log entries of these hours are read, using the index on
+    # `added`. Returns the number of rows.
+    if since is None and not full:
+        if latest := ImportHealth.objects.aggregate(Max("hour"))["hour__max"]:
+            since = latest - timedelta(hours=TRAILING_HOURS)
+    if since is None:
+        since = ImportLog.objects.aggregate(Min("added"))["added__min"]
+    if since is None:
+        return 0
+    start = max(_hour(since), _retained_since())
+    rows = ImportLog.objects.filter(added__gte=start).annotate(
+        hour=TruncHour("added"),
+        rollup_path=Coalesce("path", Value("")),
+    ).values("hour", "error_type", "rollup_path").annotate(
+        successes=Count("pk", filter=Q(success=True)),
+        failures=Count("pk", filter=Q(success=False)),
+        users=Count("user", distinct=True),
+    ).order_by()
+    rollups = [
+        ImportHealth(
+            hour=row["hour"],
+            error_type=row["error_type"],
+            path=row["rollup_path"],
+            successes=row["successes"],
+            failures=row["failures"],
+            users=row["users"],
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        ImportHealth.objects.filter(hour__gte=start).delete()
+        ImportHealth.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def import_health(hours: int = 1) -> dict:
+    # Successes and failures per error type in the last hours (the current one
+    # included), read from the rollup only
+    since = _hour(django.utils.timezone.now()) - timedelta(hours=max(1, hours) - 1)
+    rows = ImportHealth.objects.filter(hour__gte=since).values("error_type").annotate(
+        successes=Sum("successes"),
+        failures=Sum("failures"),
+        # users are distinct per hour only, this is the largest number in one hour
+        peak_users=Max("users"),
+    ).order_by("error_type")
+    return dict(
+        since=since,
+        rolled_up=ImportHealth.objects.aggregate(Max("hour"))["hour__max"],
+        error_types={
+            row["error_type"] or "OK": dict(
+                successes=row["successes"],
+                failures=row["failures"],
+                peak_users=row["peak_users"],
+            )
+            for row in rows
+        },
+    )
@@ -0,0 +1,94 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Tuple
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction, connections
+
+from dhdconf.conftool.logbuffer import buffered_import_log, flush_old_entries
+from dhdconf.conftool.process import PerProcess
+from dhdconf.models import RefreshJob, ImportLog
+
+logger = logging.getLogger(__name__)
+
+Status = RefreshJob.Status
+
+# A task runs inside a worker thread, reports progress on the job it receives and
+# returns whether it succeeded and the name of the `UserMessage` to show.
+Task = Callable[[RefreshJob], Tuple[bool, str]]
+
+_executor = PerProcess(lambda: ThreadPoolExecutor(
+    max_workers=settings.CONFTOOL_REFRESH_JOB_WORKERS,
+    thread_name_prefix="dhdconf-refresh",
+))
+
+
+def _now():
+    return django.utils.timezone.now()
+
+
+def _expire_stale_jobs(user_id):
+    # Jobs whose worker went away (e.g. a restart) would otherwise block the user
+    cutoff = _now() - timedelta(seconds=settings.CONFTOOL_REFRESH_JOB_TIMEOUT)
+    for job in RefreshJob.objects.filter(
+        user_id=user_id, status__in=RefreshJob.IN_FLIGHT, updated__lt=cutoff
+    ):
+        job.status = Status.FAILED
+        job.message = (
+            "ERROR_EXPORTING_PAPERS" if job.papers_total is None else "ERROR_SOME_PAPERS"
+        )
+        job.save(update_fields=["status", "message", "updated"])
+
+
+def enqueue(request, task: Task) -> Tuple[RefreshJob, bool]:
+    # Runs `task` for the requesting user unless a job for that user is already in
+    # flight, returns the job that reports the result and whether it was created
+    user_id = request.user.pk
+    _expire_stale_jobs(user_id)
+    try:
+        with transaction.atomic():
+            job = RefreshJob.objects.create(
+                request_id=ImportLog.generate_request_id(), user_id=user_id
+            )
+    except IntegrityError:
+        if job := RefreshJob.objects.filter(
+            user_id=user_id, status__in=RefreshJob.IN_FLIGHT
+        ).first():
+            return job, False
+        raise
+    # Log entries written by the task share the job's request id
+    request.import_log_id = job.request_id
+    transaction.on_commit(lambda: _executor.get().submit(_run, job.pk, task))
+    return job, True
+
+
+def report_progress(job: RefreshJob, total=None, done=None, failures=None):
+    if total is not None:
+        job.papers_total = total
+    if done is not None:
+        job.papers_done = done
+    if failures is not None:
+        job.failures = failures
+    job.save(update_fields=["papers_total", "papers_done", "failures", "updated"])
+    flush_old_entries()
+
+
+def _run(job_id: int, task: Task):
+    try:
+        job = RefreshJob.objects.get(pk=job_id)
+        job.status = Status.RUNNING
+        job.save(update_fields=["status", "updated"])
+        try:
+            with buffered_import_log():
+                ok, message = task(job)
+        except Exception:
+            logger.exception(f"Refresh job {job.request_id} failed")
+            ok, message = False, "ERROR_EXPORTING_PAPERS"
+        job.status = Status.DONE if ok else Status.FAILED
+        job.message = message
+        job.save(update_fields=["status", "message", "updated"])
+    finally:
+        # worker threads are not managed by django's request cycle
+        connections.close_all()
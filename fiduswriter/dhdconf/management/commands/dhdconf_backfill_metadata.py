@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dhdconf.document.metadata import SubmissionMetadata, store_metadata
+from dhdconf.models import ConftoolDocument
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the contribution type, keyword, topic and ORCID columns of imported "
+        "submissions from their document contents, e.g. for documents imported "
+        "before these columns existed. Papers imported later keep them up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Number of documents loaded and updated at once.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        documents = ConftoolDocument.objects.order_by("pk")
+        last_pk = None
+        updated = 0
+        while True:
+            batch = documents.filter(pk__gt=last_pk) if last_pk is not None else documents
+            ids = list(batch.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                store_metadata([
+                    (document, SubmissionMetadata.from_content(document.content))
+                    for document in ConftoolDocument.objects.filter(pk__in=ids).only(
+                        "content", "contribution_type"
+                    )
+                ])
+            updated += len(ids)
+            last_pk = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Stored the metadata of {updated} documents"))
@@ -0,0 +1,80 @@
+import json
+import platform
+
+import django
+import django.utils.timezone
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from dhdconf.benchmarks import importing, parsing
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the conftool import: parsing exports, streaming them from a local "
+        "conftool stand-in, importing papers, updating document content and "
+        "synchronizing access rights. Database changes are rolled back. Results are "
+        "written as JSON and can be compared to an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument(
+            "--compare",
+            help="A JSON file of an earlier run to compare the results with.",
+        )
+        parser.add_argument(
+            "--parse-papers",
+            type=int,
+            default=10_000,
+            help="Papers in the exports that are parsed.",
+        )
+        parser.add_argument(
+            "--import-papers",
+            type=int,
+            default=50,
+            help="Papers imported per number of authors.",
+        )
+        parser.add_argument("--authors", type=int, nargs="+", default=[1, 5, 20])
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--skip-database",
+            action="store_true",
+            help="Only run the benchmarks that don't use the database.",
+        )
+
+    def handle(self, *args, **options):
+        results = parsing.run(options["parse_papers"], options["authors"])
+        if not options["skip_database"]:
+            results.extend(importing.run(
+                options["import_papers"], options["authors"], options["repeat"]
+            ))
+        report = dict(
+            time=django.utils.timezone.now().isoformat(),
+            python=platform.python_version(),
+            django=django.get_version(),
+            database=connection.vendor,
+            results=results,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = {r["key"]: r for r in json.load(f)["results"]}
+            for current in results:
+                if before := previous.get(current["key"]):
+                    # too fast to be measured before, there is nothing to compare to
+                    ratio = (
+                        f"{current['seconds'] / before['seconds']:.2f}x"
+                        if before["seconds"] else "n/a"
+                    )
+                    queries = ""
+                    if "queries_per_call" in current:
+                        queries = (
+                            f", queries {before['queries_per_call']} -> "
+                            f"{current['queries_per_call']}"
+                        )
+                    self.stderr.write(f"{current['key']}: {ratio} time{queries}")
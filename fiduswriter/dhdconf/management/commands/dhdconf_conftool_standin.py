@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+
+from dhdconf.conftool.standin import ConftoolStandin, StandinConfig
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for the conftool REST API that serves synthetic users "
+        "and papers, e.g. to load test the import without conftool. Latency, slow "
+        "responses, nonce rejections and truncated exports can be injected."
+    )
+
+    def add_arguments(self, parser):
+        defaults = StandinConfig()
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--secret", default=defaults.secret, help="The API password.")
+        parser.add_argument(
+            "--password", default=defaults.password, help="The password of every user."
+        )
+        parser.add_argument("--users", type=int, default=defaults.users)
+        parser.add_argument("--papers", type=int, default=defaults.papers)
+        parser.add_argument(
+            "--authors", type=int, default=defaults.authors, help="Authors per paper."
+        )
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=defaults.latency,
+            help="Seconds before each response starts.",
+        )
+        parser.add_argument(
+            "--trickle-bytes",
+            type=int,
+            default=defaults.trickle_bytes,
+            help="Send exports in pieces of this many bytes.",
+        )
+        parser.add_argument(
+            "--trickle-delay",
+            type=float,
+            default=defaults.trickle_delay,
+            help="Seconds to pause after each piece.",
+        )
+        parser.add_argument(
+            "--nonce-rejection-rate",
+            type=float,
+            default=defaults.nonce_rejection_rate,
+            help="Probability of rejecting a valid nonce.",
+        )
+        parser.add_argument(
+            "--truncate-rate",
+            type=float,
+            default=defaults.truncate_rate,
+            help="Probability of cutting off an export midway.",
+        )
+        parser.add_argument(
+            "--no-gzip", action="store_true", help="Never compress exports."
+        )
+
+    def handle(self, *args, **options):
+        config = StandinConfig(
+            secret=options["secret"],
+            password=options["password"],
+            users=options["users"],
+            papers=options["papers"],
+            authors=options["authors"],
+            seed=options["seed"],
+            latency=options["latency"],
+            trickle_bytes=options["trickle_bytes"],
+            trickle_delay=options["trickle_delay"],
+            nonce_rejection_rate=options["nonce_rejection_rate"],
+            truncate_rate=options["truncate_rate"],
+            gzip=not options["no_gzip"],
+        )
+        standin = ConftoolStandin(config, host=options["host"], port=options["port"])
+        self.stdout.write(
+            f"Serving {config.users} users and {config.papers} papers, configure:\n"
+            f"  CONFTOOL_URL = \"{standin.url}\"\n"
+            f"  CONFTOOL_APIPASS = \"{config.secret}\""
+        )
+        try:
+            standin.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            standin.close()
+            self.stdout.write(
+                f"{standin.requests} requests, {standin.rejected_nonces} nonces rejected, "
+                f"{standin.truncated} exports truncated"
+            )
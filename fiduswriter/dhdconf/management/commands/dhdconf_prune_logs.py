@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from dhdconf.health import rollup_import_health
+from dhdconf.models import ImportLog, ImportLogTrace, RefreshJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old import log entries, the tracebacks that no entry refers to "
+        "anymore and finished background refreshes. Successful refreshes are kept "
+        "for a shorter time than errors. The occurrence counters of the remaining "
+        "tracebacks and the import health rollup still include deleted errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CONFTOOL_IMPORT_LOG_RETENTION_DAYS,
+            help="Delete all entries older than this many days.",
+        )
+        parser.add_argument(
+            "--success-days",
+            type=int,
+            default=settings.CONFTOOL_IMPORT_LOG_SUCCESS_RETENTION_DAYS,
+            help="Delete entries of successful refreshes older than this many days.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of entries deleted per statement.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many entries would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        now = django.utils.timezone.now()
+        cutoff = now - timedelta(days=options["days"])
+        success_cutoff = now - timedelta(days=options["success_days"])
+        logs = ImportLog.objects.filter(
+            Q(added__lt=cutoff) | Q(success=True, added__lt=success_cutoff)
+        )
+        # tracebacks still referenced by newer entries are kept
+        traces = ImportLogTrace.objects.filter(last_seen__lt=cutoff)
+        # the status of a refresh is only polled while it runs
+        refresh_jobs = RefreshJob.objects.exclude(status__in=RefreshJob.IN_FLIGHT).filter(
+            updated__lt=success_cutoff
+        )
+        if options["dry_run"]:
+            self.stdout.write(
+                f"Would delete {logs.count()} log entries, up to {traces.count()} tracebacks "
+                f"and {refresh_jobs.count()} refresh jobs"
+            )
+            return
+        # entries are counted in the health rollup before they are deleted
+        rollup_import_health()
+        deleted = 0
+        batch_size = max(1, options["batch_size"])
+        while ids := list(logs.order_by("pk").values_list("pk", flat=True)[:batch_size]):
+            ImportLog.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+        deleted_traces, _ = traces.filter(importlog__isnull=True).delete()
+        deleted_jobs, _ = refresh_jobs.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} log entries, {deleted_traces} tracebacks "
+            f"and {deleted_jobs} refresh jobs"
+        ))
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+import django.utils.timezone
+from django.core.management.base import BaseCommand
+
+from dhdconf.health import rollup_import_health
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate the import log into hourly success and failure counts per error "
+        "type and path. Only the hours since shortly before the last run are "
+        "recomputed, so this can run every few minutes, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            help="Recompute the last this many hours instead of the hours since the last run.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help=(
+                "Rebuild the rollup for all hours still in the import log. Hours "
+                "older than the log retention keep their counts."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["hours"] and not options["full"]:
+            since = django.utils.timezone.now() - timedelta(hours=options["hours"])
+        rows = rollup_import_health(since, full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up import health into {rows} rows"))
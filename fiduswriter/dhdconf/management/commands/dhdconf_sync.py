@@ -0,0 +1,146 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dhdconf.conftool.api import CONFTOOL_ERRORS
+from dhdconf.conftool.importing import import_emails, import_all_emails
+from dhdconf.conftool.logbuffer import buffered_import_log, flush_old_entries
+from dhdconf.conftool.pipeline import import_papers, PaperImportResult
+from dhdconf.conftool.snapshots import SnapshotStore
+from dhdconf.conftool.util import conftool_client, import_log_error
+from dhdconf.models import ImportLog
+
+ErrorType = ImportLog.ErrorType
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the email addresses of all known users and all submissions from "
+        "conftool. Uses a single streaming export for users and for papers, imports "
+        "users in batches and can import papers with several workers. Papers of "
+        "submitting authors who have not logged in yet are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help=(
+                "Number of users per database transaction and number of submissions "
+                "between progress reports (each submission has its own transaction)."
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of threads importing submissions in parallel.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-import submissions even if they did not change in conftool.",
+        )
+        snapshots = parser.add_mutually_exclusive_group()
+        snapshots.add_argument(
+            "--record",
+            metavar="DIRECTORY",
+            help="Also write the conftool exports as snapshots to this directory.",
+        )
+        snapshots.add_argument(
+            "--replay",
+            metavar="DIRECTORY",
+            help="Read the exports from snapshots in this directory instead of conftool.",
+        )
+        parser.add_argument(
+            "--skip-users",
+            action="store_true",
+            help="Do not import user email addresses.",
+        )
+        parser.add_argument(
+            "--skip-papers",
+            action="store_true",
+            help="Do not import submissions.",
+        )
+
+    def handle(self, *args, **options):
+        if options["record"]:
+            snapshots = SnapshotStore(options["record"], SnapshotStore.RECORD)
+        elif options["replay"]:
+            snapshots = SnapshotStore(options["replay"], SnapshotStore.REPLAY)
+        else:
+            snapshots = None
+        client = conftool_client(snapshots=snapshots)
+        batch_size = max(1, options["batch_size"])
+        with buffered_import_log():
+            # Users go first: access rights on papers depend on verified emails
+            if not options["skip_users"]:
+                self.sync_users(client, batch_size)
+            if not options["skip_papers"]:
+                self.sync_papers(client, batch_size, options["workers"], options["force"])
+
+    def sync_users(self, client, batch_size):
+        processed = 0
+        failures = 0
+        self.stdout.write("Importing users")
+        try:
+            for batch in _batches(client.stream_users(), batch_size):
+                try:
+                    import_all_emails(batch)
+                except Exception:
+                    # find the failing users, the others are still imported
+                    for user in batch:
+                        try:
+                            import_emails(user)
+                        except Exception as e:
+                            failures += 1
+                            import_log_error(ErrorType.IMPORT_EMAILS, e)
+                processed += len(batch)
+                self.stdout.write(f"  {processed} users processed, {failures} failed")
+                flush_old_entries()
+        except CONFTOOL_ERRORS as e:
+            import_log_error(ErrorType.EXPORT_USER, e)
+            raise CommandError(f"Exporting users from conftool failed: {e!r}")
+        except Exception as e:
+            import_log_error(ErrorType.IMPORT_EMAILS, e)
+            raise
+        self.stdout.write(self.style.SUCCESS(
+            f"Done importing users: {processed} processed, {failures} failed"
+        ))
+
+    def sync_papers(self, client, batch_size, workers, force):
+        def report(result: PaperImportResult):
+            self.stdout.write(
+                f"  {result.processed} papers processed, {result.unchanged} unchanged, "
+                f"{result.skipped} skipped, {result.failed} failed"
+            )
+
+        self.stdout.write(f"Importing papers with {workers} worker(s)")
+        try:
+            result = import_papers(
+                client.stream_papers(),
+                workers=workers,
+                force=force,
+                progress=report,
+                progress_every=batch_size,
+            )
+        except CONFTOOL_ERRORS as e:
+            import_log_error(ErrorType.EXPORT_PAPERS, e)
+            raise CommandError(f"Exporting papers from conftool failed: {e!r}")
+        except Exception as e:
+            # e.g. the database, single papers are logged by `import_papers`
+            import_log_error(ErrorType.IMPORT_PAPER, e)
+            raise
+        self.stdout.write(self.style.SUCCESS(
+            f"Done importing papers: {result.processed} processed, {result.created} "
+            f"created, {result.updated} updated, {result.unchanged} unchanged, "
+            f"{result.skipped} skipped, {result.failed} failed"
+        ))
+        return result
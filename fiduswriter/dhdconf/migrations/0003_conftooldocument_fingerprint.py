@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0002_alter_importlog_path_alter_importlog_request_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conftooldocument",
+            name="fingerprint",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("dhdconf", "0003_conftooldocument_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RefreshJob",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("request_id", models.CharField(max_length=8, unique=True)),
+                ("status", models.CharField(choices=[("PE", "Pending"), ("RU", "Running"), ("DO", "Done"), ("FA", "Failed")], db_index=True, default="PE", max_length=2)),
+                ("papers_total", models.PositiveIntegerField(blank=True, null=True)),
+                ("papers_done", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("message", models.CharField(blank=True, max_length=40)),
+                ("added", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="refreshjob",
+            constraint=models.UniqueConstraint(condition=models.Q(("status__in", ["PE", "RU"])), fields=("user",), name="dhdconf_refreshjob_single_in_flight"),
+        ),
+    ]
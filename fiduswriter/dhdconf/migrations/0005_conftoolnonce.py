@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def create_nonce_row(apps, schema_editor):
+    ConftoolNonce = apps.get_model("dhdconf", "ConftoolNonce")
+    ConftoolNonce.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0004_refreshjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConftoolNonce",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("value", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_nonce_row, migrations.RunPython.noop),
+    ]
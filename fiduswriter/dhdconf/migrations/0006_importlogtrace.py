@@ -0,0 +1,74 @@
+import hashlib
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+MESSAGE_LENGTH = 500
+
+
+def _fingerprint(stacktrace):
+    # Older tracebacks are only available as text: their fingerprint ignores line
+    # numbers and the final line with the exception message. It is not the one that
+    # `conftool.traces.exception_trace` takes from live exceptions (those are not
+    # available here), so an error that happened before and after the upgrade gets
+    # two traces, the moved one stops counting from then on.
+    lines = stacktrace.strip().splitlines()[:-1]
+    normalized = "\n".join(re.sub(r", line \d+", "", line).strip() for line in lines)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def move_stacktraces(apps, schema_editor):
+    ImportLog = apps.get_model("dhdconf", "ImportLog")
+    ImportLogTrace = apps.get_model("dhdconf", "ImportLogTrace")
+    traces = {}
+    for log in ImportLog.objects.exclude(stacktrace__isnull=True).exclude(stacktrace="").order_by("pk").iterator():
+        fingerprint = _fingerprint(log.stacktrace)
+        trace = traces.get(fingerprint)
+        if trace is None:
+            last_line = log.stacktrace.strip().splitlines()[-1]
+            trace = traces[fingerprint] = ImportLogTrace.objects.create(
+                fingerprint=fingerprint,
+                error_class=last_line.split(":", 1)[0][:200],
+                stacktrace=log.stacktrace,
+            )
+            # auto_now_add has set both to now
+            trace.first_seen = trace.last_seen = log.added
+        trace.occurrences += 1
+        trace.last_seen = max(trace.last_seen, log.added)
+        log.trace_id = trace.pk
+        log.save(update_fields=["trace"])
+    for trace in traces.values():
+        trace.save(update_fields=["occurrences", "first_seen", "last_seen"])
+    for log in ImportLog.objects.filter(message__isnull=False).iterator():
+        if len(log.message) > MESSAGE_LENGTH:
+            log.message = log.message[:MESSAGE_LENGTH]
+            log.save(update_fields=["message"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0005_conftoolnonce"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportLogTrace",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("fingerprint", models.CharField(max_length=64, unique=True)),
+                ("error_class", models.CharField(db_index=True, max_length=200)),
+                ("stacktrace", models.TextField()),
+                ("occurrences", models.PositiveBigIntegerField(default=0)),
+                ("first_seen", models.DateTimeField(auto_now_add=True)),
+                ("last_seen", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="importlog",
+            name="trace",
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to="dhdconf.importlogtrace"),
+        ),
+        migrations.RunPython(move_stacktraces, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0006: PostgreSQL does not alter a table with pending deferred
+    # constraint checks from rows updated in the same transaction
+
+    dependencies = [
+        ("dhdconf", "0006_importlogtrace"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="importlog",
+            name="stacktrace",
+        ),
+        migrations.AlterField(
+            model_name="importlog",
+            name="message",
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
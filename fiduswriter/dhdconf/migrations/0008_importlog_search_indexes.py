@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+# Trigram index for the message search in the admin (`icontains` compares upper case)
+TRIGRAM_INDEX = "dhdconf_importlog_message_trgm"
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON dhdconf_importlog "
+        f"USING gin (UPPER(message) gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0007_remove_importlog_stacktrace"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="importlog",
+            name="conftool_paper_id",
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="importlog",
+            name="added",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
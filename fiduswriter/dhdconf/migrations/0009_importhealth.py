@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0008_importlog_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportHealth",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hour", models.DateTimeField()),
+                ("error_type", models.CharField(blank=True, choices=[("FL", "Fetch Login"), ("FU", "Fetch Userdata"), ("EU", "Export User"), ("EP", "Export Papers"), ("IU", "Import Userdata"), ("IE", "Import User Emails"), ("IP", "Import Paper")], max_length=2)),
+                ("path", models.CharField(blank=True, max_length=80)),
+                ("successes", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("users", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "import health",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="importhealth",
+            constraint=models.UniqueConstraint(fields=("hour", "error_type", "path"), name="dhdconf_importhealth_unique_hour"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0009_importhealth"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="importlog",
+            name="error_type",
+            field=models.CharField(blank=True, choices=[("FL", "Fetch Login"), ("FU", "Fetch Userdata"), ("EU", "Export User"), ("EP", "Export Papers"), ("IU", "Import Userdata"), ("IE", "Import User Emails"), ("IP", "Import Paper"), ("QB", "Query Budget")], max_length=2),
+        ),
+        migrations.AlterField(
+            model_name="importhealth",
+            name="error_type",
+            field=models.CharField(blank=True, choices=[("FL", "Fetch Login"), ("FU", "Fetch Userdata"), ("EU", "Export User"), ("EP", "Export Papers"), ("IU", "Import Userdata"), ("IE", "Import User Emails"), ("IP", "Import Paper"), ("QB", "Query Budget")], max_length=2),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0010_importlog_query_budget"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conftooldocument",
+            name="contribution_type",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=200),
+        ),
+        migrations.CreateModel(
+            name="ConftoolDocumentTag",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("kind", models.CharField(choices=[("K", "Keyword"), ("T", "Topic"), ("O", "ORCID")], max_length=1)),
+                ("value", models.CharField(max_length=255)),
+                ("document", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="tags", to="dhdconf.conftooldocument")),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="conftooldocumenttag",
+            constraint=models.UniqueConstraint(fields=("document", "kind", "value"), name="dhdconf_documenttag_unique"),
+        ),
+        migrations.AddIndex(
+            model_name="conftooldocumenttag",
+            index=models.Index(fields=["kind", "value"], name="dhdconf_documenttag_value"),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Prefix index for the title search in the document admin. `istartswith` compares
+# `UPPER(title::text) LIKE 'X%'`, which only uses an index on that expression with
+# the pattern operator class (the database's collation is usually not "C").
+TITLE_INDEX = "dhdconf_document_title_upper"
+
+
+def create_title_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {TITLE_INDEX} ON document_document "
+        f"(UPPER(title::text) text_pattern_ops)"
+    )
+
+
+def drop_title_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {TITLE_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhdconf", "0011_submission_metadata"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_title_index, drop_title_index),
+    ]
@@ -15,8 +15,49 @@ class ConftoolUser(UserModel):
 
 
 class ConftoolDocument(Document):
+    FINGERPRINT_LENGTH = 64
+    CONTRIBUTION_TYPE_LENGTH = 200
+
     conftool_id = models.PositiveBigIntegerField(unique=True)
     synchronized = models.DateTimeField()
+    fingerprint = models.CharField(max_length=FINGERPRINT_LENGTH, blank=True, default="")
+    # submission metadata that is otherwise only found in the content, for listings
+    # and filters, see `dhdconf.document.metadata`
+    contribution_type = models.CharField(
+        max_length=CONTRIBUTION_TYPE_LENGTH, blank=True, default="", db_index=True
+    )
+
+
+class ConftoolDocumentTag(models.Model):
+    # The keywords, topics and author ORCIDs of a submission
+    VALUE_LENGTH = 255
+
+    class Kind(models.TextChoices):
+        KEYWORD = "K", "Keyword"
+        TOPIC = "T", "Topic"
+        ORCID = "O", "ORCID"
+
+    document = models.ForeignKey(ConftoolDocument, on_delete=models.CASCADE, related_name="tags")
+    kind = models.CharField(max_length=1, choices=Kind.choices)
+    value = models.CharField(max_length=VALUE_LENGTH)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["document", "kind", "value"], name="dhdconf_documenttag_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["kind", "value"], name="dhdconf_documenttag_value"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.value}"
+
+
+class ConftoolNonce(models.Model):
+    # A single row holding the last nonce any process sent to conftool
+    value = models.PositiveBigIntegerField(default=0)
 
 
 class ConftoolEmail(EmailAddress):
@@ -31,8 +72,26 @@ class ConftoolAccessRight(AccessRight):
     pass
 
 
+class ImportLogTrace(models.Model):
+    # A traceback shared by all log entries whose errors were raised the same way, see
+    # `dhdconf.conftool.traces`
+    FINGERPRINT_LENGTH = 64
+
+    fingerprint = models.CharField(max_length=FINGERPRINT_LENGTH, unique=True)
+    error_class = models.CharField(max_length=200, db_index=True)
+    # the traceback of the first occurrence
+    stacktrace = models.TextField()
+    occurrences = models.PositiveBigIntegerField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.error_class} ({self.fingerprint[:12]})"
+
+
 class ImportLog(models.Model):
     REQUEST_ID_LENGTH = 8
+    MESSAGE_LENGTH = 500
 
     class ErrorType(models.TextChoices):
         FETCH_LOGIN = "FL", "Fetch Login"
@@ -42,16 +101,17 @@ class ImportLog(models.Model):
         IMPORT_USERINFO = "IU", "Import Userdata"
         IMPORT_EMAILS = "IE", "Import User Emails"
         IMPORT_PAPER = "IP", "Import Paper"
+        QUERY_BUDGET = "QB", "Query Budget"
 
     request_id = models.CharField(max_length=REQUEST_ID_LENGTH, db_index=True, blank=True, null=True)
     path = models.CharField(max_length=80, db_index=True, blank=True, null=True)
     success = models.BooleanField(default=False, db_index=True)
     error_type = models.CharField(max_length=2, choices=ErrorType.choices, blank=True)
     user = models.ForeignKey(UserModel, blank=True, null=True, on_delete=models.CASCADE)
-    message = models.TextField(blank=True, null=True, db_index=True)
-    conftool_paper_id = models.PositiveBigIntegerField(blank=True, null=True)
-    stacktrace = models.TextField(blank=True, null=True)
-    added = models.DateTimeField(auto_now_add=True)
+    message = models.CharField(max_length=MESSAGE_LENGTH, blank=True, null=True)
+    conftool_paper_id = models.PositiveBigIntegerField(blank=True, null=True, db_index=True)
+    trace = models.ForeignKey(ImportLogTrace, blank=True, null=True, on_delete=models.SET_NULL)
+    added = models.DateTimeField(auto_now_add=True, db_index=True)
 
     @classmethod
     def generate_request_id(cls):
@@ -59,3 +119,61 @@ class ImportLog(models.Model):
             length=cls.REQUEST_ID_LENGTH,
             allowed_chars="ABCDEFGHJKLMNPQRSTUVWXYZ0123456789"
         )
+
+
+class ImportHealth(models.Model):
+    # Hourly counts of import log entries, see `dhdconf.health`
+    hour = models.DateTimeField()
+    error_type = models.CharField(max_length=2, choices=ImportLog.ErrorType.choices, blank=True)
+    path = models.CharField(max_length=80, blank=True)
+    successes = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    # distinct users with entries in this hour
+    users = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hour", "error_type", "path"],
+                name="dhdconf_importhealth_unique_hour",
+            ),
+        ]
+        verbose_name_plural = "import health"
+
+
+class RefreshJob(models.Model):
+    # A paper refresh running in the background, see `dhdconf.jobs`
+
+    class Status(models.TextChoices):
+        PENDING = "PE", "Pending"
+        RUNNING = "RU", "Running"
+        DONE = "DO", "Done"
+        FAILED = "FA", "Failed"
+
+    IN_FLIGHT = (Status.PENDING, Status.RUNNING)
+
+    request_id = models.CharField(max_length=ImportLog.REQUEST_ID_LENGTH, unique=True)
+    user = models.ForeignKey(UserModel, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=2, choices=Status.choices, default=Status.PENDING, db_index=True
+    )
+    papers_total = models.PositiveIntegerField(blank=True, null=True)
+    papers_done = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    # the name of a `dhdconf.views.UserMessage`, translated when reported
+    message = models.CharField(max_length=40, blank=True)
+    added = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # coalesces refreshes: only one job per user may be pending or running
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(status__in=["PE", "RU"]),
+                name="dhdconf_refreshjob_single_in_flight",
+            ),
+        ]
+
+    def in_flight(self) -> bool:
+        return self.status in self.IN_FLIGHT
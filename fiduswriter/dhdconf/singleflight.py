@@ -0,0 +1,93 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, TypeVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from dhdconf.conftool.util import advisory_lock_key
+
+T = TypeVar("T")
+
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _flight(name: str, conftool_id: int, timeout: float):
+    # Yields whether the caller got the flight for this refresh within the timeout.
+    # On PostgreSQL this is an advisory lock shared by all workers, on other backends
+    # only threads of this process are coordinated.
+    if connection.vendor == "postgresql":
+        # The lock is held by a transaction of a connection of its own: the refresh
+        # must not run in one long transaction, and a session-level lock could be
+        # released on another server connection behind a pooler like pgbouncer.
+        own = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            own.set_autocommit(False)
+            key = advisory_lock_key(f"refresh:{name}", conftool_id)
+            deadline = time.monotonic() + timeout
+            delay = 0.05
+            with own.cursor() as cursor:
+                while True:
+                    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [key])
+                    acquired = cursor.fetchone()[0]
+                    if acquired or time.monotonic() >= deadline:
+                        break
+                    time.sleep(delay)
+                    delay = min(delay * 2, 1)
+            yield acquired
+        finally:
+            # ending the transaction releases the lock
+            own.close()
+    else:
+        with _local_locks_lock:
+            lock = _local_locks.setdefault((name, conftool_id), threading.Lock())
+        acquired = lock.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+
+def _cache_key(name: str, conftool_id: int) -> str:
+    return f"dhdconf:refresh:{name}:{conftool_id}"
+
+
+def single_flight(
+    name: str,
+    conftool_id: int,
+    refresh: Callable[[], T],
+    succeeded: Callable[[T], bool] = lambda result: True,
+) -> T:
+    # Runs `refresh` for a conftool entity unless it is already running elsewhere. In
+    # that case this waits for it and returns its result instead. Successful results
+    # are also reused for CONFTOOL_REFRESH_RESULT_SECONDS, so repeated clicks don't
+    # refresh again. A failed result only goes to the callers that waited for it,
+    # later ones refresh again. Results have to be picklable and must not be None.
+    cache = caches[settings.CONFTOOL_REFRESH_CACHE]
+    key = _cache_key(name, conftool_id)
+    failed_key = f"{key}:failed"
+    entered = time.time()
+    if (result := cache.get(key)) is not None:
+        return result
+    with _flight(name, conftool_id, settings.CONFTOOL_REFRESH_WAIT_SECONDS) as acquired:
+        # after waiting, the refresh we waited for has left its result here
+        if acquired:
+            if (result := cache.get(key)) is not None:
+                return result
+            failure = cache.get(failed_key)
+            if failure is not None and failure[0] >= entered:
+                return failure[1]
+        result = refresh()
+        if succeeded(result):
+            cache.set(key, result, max(1, settings.CONFTOOL_REFRESH_RESULT_SECONDS))
+        else:
+            # stamped, to tell the callers that waited from those that came later
+            cache.set(
+                failed_key, (time.time(), result), max(1, settings.CONFTOOL_REFRESH_WAIT_SECONDS)
+            )
+        return result
@@ -1,6 +1,9 @@
-import {activateWait, deactivateWait, addAlert, postJson} from "../common"
+import {activateWait, deactivateWait, addAlert, getJson, postJson} from "../common"
 import {config} from "./config"
 
+// about eleven minutes of polling a background refresh, see `pollSubmissions`
+const POLL_ATTEMPTS = 180
+
 function removeMenuItem(items, predicate) {
     const idx = items.findIndex(predicate)
     if (idx >= 0) {
@@ -106,7 +109,26 @@ export class DhdconfDocumentsOverview {
 
     refreshSubmissions() {
         activateWait(false, gettext("Importing submissions"))
-        return postJson("/api/dhdconf/refresh_conftool_papers/")
+        return postJson("/api/dhdconf/refresh_conftool_papers/").then(response =>
+            // an accepted (202) refresh runs in the background and has to be polled
+            response.status === 202 ? this.pollSubmissions(response.json.requestId) : response
+        )
+    }
+
+    pollSubmissions(requestId, attempt = 0) {
+        // give up a bit after the server would have expired the job
+        // (CONFTOOL_REFRESH_JOB_TIMEOUT), polling every second at first and every
+        // five seconds after a minute
+        if (attempt >= POLL_ATTEMPTS) {
+            return Promise.reject({json: () => Promise.resolve({
+                message: gettext("The import is taking too long, please try again later"),
+                requestId
+            })})
+        }
+        const delay = attempt < 60 ? 1000 : 5000
+        return new Promise(resolve => setTimeout(resolve, delay))
+            .then(() => getJson(`/api/dhdconf/refresh_conftool_papers/${requestId}/`))
+            .then(data => data.finished ? {json: data} : this.pollSubmissions(requestId, attempt + 1))
     }
 
     refreshDocuments() {
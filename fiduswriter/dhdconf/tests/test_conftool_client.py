@@ -0,0 +1,345 @@
+import gzip
+import io
+import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from unittest.mock import MagicMock, patch
+
+import requests
+from django.test import SimpleTestCase
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from requests import Response
+from urllib3 import HTTPResponse
+
+from dhdconf.conftool import util
+from dhdconf.conftool.api import ConftoolClient, pooled_session, ExportPaperResponse, \
+    MissingElementException, MonotonicNonce, ConftoolNonceTooSmallException, \
+    ConftoolAccessDeniedException, ConftoolLoginFailedException
+from dhdconf.conftool.metrics import ClientMetrics
+from dhdconf.conftool.nonce import FileNonce
+from dhdconf.conftool.snapshots import SnapshotStore
+from dhdconf.conftool.standin import ConftoolStandin, StandinConfig
+from dhdconf.conftool.synthetic import paper_xml, papers_export
+
+
+class PooledSessionTest(SimpleTestCase):
+
+    def test_sessions_are_shared_per_pool_size(self):
+        self.assertIs(pooled_session(3), pooled_session(3))
+        self.assertIsNot(pooled_session(3), pooled_session(4))
+
+    def test_clients_share_the_default_session(self):
+        a = ConftoolClient("https://example.com/rest.php", "secret")
+        b = ConftoolClient("https://example.com/rest.php", "secret")
+        self.assertIs(a.session, b.session)
+
+    def test_pooled_sessions_keep_no_cookies(self):
+        class SetsCookie(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Set-Cookie", f"session={self.headers.get('Cookie')}; Path=/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), SetsCookie)
+        threading.Thread(target=server.handle_request).start()
+        threading.Thread(target=server.handle_request).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/"
+            session = pooled_session(5)
+            session.get(url, timeout=5)
+            self.assertEqual(len(session.cookies), 0)
+            response = session.get(url, timeout=5)
+            self.assertEqual(response.cookies.get("session"), "None")
+        finally:
+            server.server_close()
+
+    def test_requests_use_session_and_timeout(self):
+        session = MagicMock()
+        client = ConftoolClient(
+            "https://example.com/rest.php", "secret", session=session, timeout=(1, 2)
+        )
+        client._do_request(dict(page="remoteLogin"))
+        session.get.assert_called_once()
+        _, kwargs = session.get.call_args
+        self.assertEqual(kwargs["timeout"], (1, 2))
+        self.assertEqual(kwargs["params"]["page"], "remoteLogin")
+        self.assertIn("passhash", kwargs["params"])
+
+
+class ParsingTest(SimpleTestCase):
+
+    def test_parsing_paper_with_authors(self):
+        element = ET.fromstring(paper_xml(1, 42, authors=12))
+        paper = ExportPaperResponse.from_xml(element)
+        self.assertEqual(paper.paper_id, 1)
+        self.assertEqual(paper.submitting_author_id, 42)
+        self.assertEqual(len(paper.authors), 12)
+        self.assertEqual(paper.authors[0].email, "author42@example.com")
+        self.assertEqual(paper.authors[0].firstname(), "Firstname")
+
+    def test_first_child_wins(self):
+        element = ET.fromstring(
+            "<paper><paperID>1</paperID><submitting_author_ID>2</submitting_author_ID>"
+            "<title> first </title><title>second</title></paper>"
+        )
+        self.assertEqual(ExportPaperResponse.from_xml(element).title, "first")
+
+    def test_missing_element(self):
+        element = ET.fromstring("<paper><paperID>1</paperID></paper>")
+        with self.assertRaises(MissingElementException):
+            ExportPaperResponse.from_xml(element)
+
+
+NONCE_REJECTED = (
+    "<rest><result>false</result>"
+    "<message>access denied: nonce must be bigger than last nonce</message></rest>"
+)
+LOGIN_OK = "<login><result>true</result><id>1</id><username>u</username></login>"
+
+
+class NonceTest(SimpleTestCase):
+
+    @patch("dhdconf.conftool.api.clock_nonce", return_value=6000)
+    def test_nonces_increase_with_a_stopped_clock(self, _):
+        nonce = MonotonicNonce()
+        self.assertEqual([nonce(), nonce(), nonce()], [6000, 6001, 6002])
+
+    @patch("dhdconf.conftool.nonce.clock_nonce", return_value=6000)
+    def test_file_nonces_are_shared_between_allocators(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "nonce")
+            self.assertEqual(FileNonce(path)(), 6000)
+            self.assertEqual(FileNonce(path)(), 6001)
+
+    def _client(self, *texts, retries=3):
+        session = MagicMock()
+        session.get.side_effect = [MagicMock(text=text) for text in texts]
+        return ConftoolClient(
+            "https://example.com/rest.php",
+            "secret",
+            session=session,
+            nonce_retries=retries,
+            nonce_backoff=0,
+        )
+
+    def test_rejected_nonces_are_retried(self):
+        client = self._client(NONCE_REJECTED, NONCE_REJECTED, LOGIN_OK)
+        self.assertTrue(client.login("u", "p").result)
+        self.assertEqual(client.session.get.call_count, 3)
+
+    def test_nonce_retries_are_bounded(self):
+        client = self._client(NONCE_REJECTED, NONCE_REJECTED, retries=1)
+        with self.assertRaises(ConftoolNonceTooSmallException):
+            client.login("u", "p")
+
+    def test_concurrent_calls_of_one_client_are_not_serialized(self):
+        in_flight = threading.Barrier(4, timeout=5)
+
+        def get(url, params, **kwargs):
+            # only returns once all calls wait for their response at the same time
+            in_flight.wait()
+            return MagicMock(text=LOGIN_OK)
+
+        client = ConftoolClient(
+            "https://example.com/rest.php", "secret", session=MagicMock(get=get)
+        )
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.login("u", "p").result))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 4)
+
+
+def _streamed_response(body: bytes, encoding=None) -> Response:
+    headers = {"content-encoding": encoding} if encoding else {}
+    response = Response()
+    response.status_code = 200
+    response.raw = HTTPResponse(
+        body=io.BytesIO(body), headers=headers, preload_content=False, status=200
+    )
+    return response
+
+
+class StreamingTest(SimpleTestCase):
+
+    def _client(self, response):
+        session = MagicMock()
+        session.get.return_value = response
+        return ConftoolClient("https://example.com/rest.php", "secret", session=session)
+
+    def test_streaming_plain_export(self):
+        body = b"".join(papers_export(50))
+        client = self._client(_streamed_response(body))
+        self.assertEqual(len(client.export_papers()), 50)
+
+    def test_streaming_gzipped_export(self):
+        body = gzip.compress(b"".join(papers_export(50)))
+        client = self._client(_streamed_response(body, encoding="gzip"))
+        papers = client.export_papers()
+        self.assertEqual([p.paper_id for p in papers], list(range(1, 51)))
+        _, kwargs = client.session.get.call_args
+        self.assertIn("gzip", kwargs["headers"]["Accept-Encoding"])
+
+
+class SnapshotTest(SimpleTestCase):
+
+    def _client(self, session, directory, mode):
+        return ConftoolClient(
+            "https://example.com/rest.php",
+            "secret",
+            session=session,
+            snapshots=SnapshotStore(directory, mode),
+        )
+
+    def test_recorded_exports_are_replayed(self):
+        session = MagicMock()
+        session.get.return_value = _streamed_response(b"".join(papers_export(20)))
+        with tempfile.TemporaryDirectory() as tmp:
+            recorded = self._client(session, tmp, SnapshotStore.RECORD).export_papers()
+            self.assertEqual(os.listdir(tmp), ["papers.xml.gz"])
+            offline = MagicMock()
+            replayed = self._client(offline, tmp, SnapshotStore.REPLAY).export_papers()
+            offline.get.assert_not_called()
+        self.assertEqual(replayed, recorded)
+
+    def test_incomplete_exports_are_not_recorded(self):
+        session = MagicMock()
+        session.get.return_value = _streamed_response(b"".join(papers_export(20)))
+        with tempfile.TemporaryDirectory() as tmp:
+            papers = self._client(session, tmp, SnapshotStore.RECORD).stream_papers()
+            next(papers)
+            papers.close()
+            self.assertEqual(os.listdir(tmp), [])
+
+
+class MetricsTest(SimpleTestCase):
+
+    def test_requests_and_errors_are_counted_per_command(self):
+        session = MagicMock()
+        session.get.side_effect = [MagicMock(text=NONCE_REJECTED), MagicMock(text=LOGIN_OK)]
+        metrics = ClientMetrics()
+        client = ConftoolClient(
+            "https://example.com/rest.php",
+            "secret",
+            session=session,
+            nonce_backoff=0,
+            metrics=metrics,
+        )
+        client.login("u", "p")
+        login = metrics.snapshot()["remoteLogin/login"]
+        self.assertEqual(login["count"], 2)
+        self.assertEqual(login["errors"], {"ConftoolNonceTooSmallException": 1})
+
+    def test_streamed_bytes_and_elements_are_counted(self):
+        body = b"".join(papers_export(30))
+        session = MagicMock()
+        session.get.return_value = _streamed_response(body)
+        hook = MagicMock()
+        metrics = ClientMetrics()
+        metrics.add_hook(hook)
+        client = ConftoolClient(
+            "https://example.com/rest.php", "secret", session=session, metrics=metrics
+        )
+        client.export_papers()
+        papers = metrics.snapshot()["adminExport/papers"]
+        self.assertEqual(papers["count"], 1)
+        self.assertEqual(papers["elements"], 30)
+        self.assertEqual(papers["bytes"], len(body))
+        self.assertEqual(sum(papers["latency"].values()), 1)
+        hook.assert_called_once()
+
+
+    def test_hooks_are_loaded_once_by_concurrent_clients(self):
+        loaded = []
+
+        def slow_import(path):
+            loaded.append(path)
+            time.sleep(0.01)
+            return MagicMock()
+
+        with patch.object(util, "_metrics_hooks_installed", False), \
+                patch.object(util, "client_metrics", ClientMetrics()), \
+                patch.object(util, "import_string", slow_import), \
+                self.settings(CONFTOOL_METRICS_HOOKS=["example.hook"]):
+            threads = [threading.Thread(target=util._metrics) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(loaded, ["example.hook"])
+
+
+class StandinTest(SimpleTestCase):
+
+    def _client(self, standin, **kwargs):
+        return ConftoolClient(
+            standin.url, standin.config.secret, session=requests.Session(), **kwargs
+        )
+
+    def test_client_against_standin(self):
+        with ConftoolStandin(StandinConfig(users=20, papers=50)) as standin:
+            client = self._client(standin)
+            login = client.login("author5@example.com", "password")
+            self.assertEqual((login.id, login.username), (5, "user5"))
+            self.assertEqual(client.user_info("user5").person_id, 5)
+            self.assertEqual(len(client.export_papers()), 50)
+            self.assertEqual(client.export_user(7).person_id, 7)
+            with self.assertRaises(ConftoolLoginFailedException):
+                client.login("user5", "wrong")
+        self.assertEqual(standin.rejected_nonces, 0)
+
+    def test_concurrent_clients(self):
+        errors = []
+        results = {}
+
+        def refresh(person_id):
+            # every thread has its own client, their nonces may arrive out of order
+            client = self._client(standin, nonce_retries=20, nonce_backoff=0)
+            try:
+                results[person_id] = [
+                    (client.user_info(f"user{person_id}").person_id,
+                     client.export_user(person_id).person_id)
+                    for _ in range(5)
+                ]
+            except Exception as e:
+                errors.append(e)
+
+        with ConftoolStandin(StandinConfig(users=20, latency=0.001)) as standin:
+            threads = [threading.Thread(target=refresh, args=(i,)) for i in range(1, 9)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(results, {i: [(i, i)] * 5 for i in range(1, 9)})
+        self.assertEqual(standin.requests - standin.rejected_nonces, 80)
+
+    def test_wrong_secrets_are_denied(self):
+        with ConftoolStandin() as standin:
+            client = ConftoolClient(standin.url, "wrong", session=requests.Session())
+            with self.assertRaises(ConftoolAccessDeniedException):
+                client.login("user1", "password")
+
+    def test_rejected_nonces_are_retried(self):
+        config = StandinConfig(nonce_rejection_rate=0.5, seed=3)
+        with ConftoolStandin(config) as standin:
+            client = self._client(standin, nonce_retries=10, nonce_backoff=0)
+            for _ in range(5):
+                client.user_info("user1")
+        self.assertGreater(standin.rejected_nonces, 0)
+
+    def test_truncated_exports_fail(self):
+        with ConftoolStandin(StandinConfig(papers=200, truncate_rate=1)) as standin:
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self._client(standin).export_papers()
@@ -1,18 +1,50 @@
+import functools
 import json
+import threading
 from dataclasses import replace
-from unittest.mock import patch
+from datetime import timedelta
+from io import StringIO
+from unittest import skipIf, skipUnless
+from unittest.mock import patch, MagicMock
 
 import django.utils.timezone
+import requests
 from allauth.account.models import EmailAddress
-from django.db import IntegrityError
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.admin import site
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connection, connections, transaction
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 
+from dhdconf import jobs, singleflight
+from dhdconf.benchmarks import importing as benchmark_importing
+from dhdconf.admin import ImportLogAdmin, EstimatedCountPaginator, TopicListFilter
 from dhdconf.conftool.api import ConftoolClient, LoginResponse, UserInfoResponse, ConftoolLoginFailedException, \
-    ExportUserResponse, ExportPaperResponse, PaperAuthor
+    ConftoolUnknownUserException, ExportUserResponse, ExportPaperResponse, PaperAuthor
 from dhdconf.conftool.auth import ConftoolBackend
-from dhdconf.conftool.importing import import_emails, import_paper
-from dhdconf.models import ConftoolUser, ConftoolEmail, ConftoolDocument
-from user.models import User
+from dhdconf.conftool.logbuffer import buffered_import_log, current_buffer, ImportLogBuffer
+from dhdconf.conftool.nonce import database_nonce
+from dhdconf.conftool.pipeline import import_papers
+from dhdconf.conftool.querybudget import BUDGETS, QueryBudgetExceeded, QueryRecorder, query_shape
+from dhdconf.conftool.util import import_log, import_log_error, ImportLogContext
+from dhdconf.conftool import importing
+from dhdconf.conftool.importing import import_emails, import_all_emails, import_paper, PaperImportStatus, \
+    _synchronize_access_rights, _bulk_create_inherited
+from dhdconf.document import cached_dhd_document_template
+from dhdconf.health import rollup_import_health, import_health
+from dhdconf.document.content import DhdDocumentContentUpdate
+from dhdconf.document import template as template_module
+from dhdconf.document.template import invalidate_template_cache
+from dhdconf.models import ConftoolUser, ConftoolEmail, ConftoolDocument, ConftoolAccessRight, ConftoolDocumentTag, \
+    ConftoolUserInvite, RefreshJob, ImportLog, ImportLogTrace, ImportHealth
+from dhdconf.singleflight import single_flight
+from dhdconf.views import _refresh_user, _refresh_papers_job
+from document.models import AccessRight
+from user.models import User, UserInvite
 
 
 def _user_factory() -> ConftoolUser:
@@ -48,6 +80,16 @@ def _mock_user_export(a, b):
     )
 
 
+class RequestTestCase(TestCase):
+    # a request of a signed in Conftool user to `path`
+    path = "/api/dhdconf/refresh_conftool_papers/"
+
+    def setUp(self):
+        self.user = _user_factory()
+        self.request = RequestFactory().post(self.path)
+        self.request.user = self.user.user_ptr
+
+
 @patch.object(ConftoolClient, 'login', _mock_login)
 @patch.object(ConftoolClient, 'user_info', _mock_user_info)
 @patch.object(ConftoolClient, 'export_user', _mock_user_export)
@@ -78,6 +120,37 @@ class AuthenticationTest(TestCase):
         with self.assertRaises(IntegrityError):
             self.backend.authenticate(None, 'username', 'password')
 
+    def _authenticate_missing(self, lookups):
+        # the first lookups miss, as if a concurrent login created the user meanwhile
+        real_filter = ConftoolUser.objects.filter
+        misses = [ConftoolUser.objects.none()] * lookups
+        with patch.object(
+            ConftoolUser.objects, "filter",
+            side_effect=lambda *a, **kw: misses.pop() if misses else real_filter(*a, **kw)
+        ):
+            return self.backend.authenticate(None, 'username', 'password')
+
+    def test_existing_conftool_user_is_reused_after_the_lock(self):
+        existing = _user_factory()
+        user = self._authenticate_missing(1)
+        self.assertEqual(user.pk, existing.pk)
+        self.assertEqual(ConftoolUser.objects.count(), 1)
+
+    @skipIf(connection.vendor == "postgresql", "the advisory lock prevents the conflict")
+    def test_existing_conftool_user_is_reused_on_insert_conflict(self):
+        existing = _user_factory()
+        # both lookups miss, so the insert runs into the existing user
+        user = self._authenticate_missing(2)
+        self.assertEqual(user.pk, existing.pk)
+        self.assertEqual(ConftoolUser.objects.count(), 1)
+
+    def test_unrelated_insert_conflicts_are_raised(self):
+        ConftoolUser.objects.create(
+            username='renamed', conftool_id=123, synchronized=django.utils.timezone.now()
+        )
+        User.objects.create(username='username')
+        with self.assertRaises(IntegrityError):
+            self._authenticate_missing(2)
 
     def test_that_email_is_created(self):
         # TODO
@@ -130,6 +203,24 @@ class ImportEmailAddressTest(TestCase):
         self.assertEqual(self.user.emailaddress_set.first().email, "c2@example.com")
         self.assertEqual(self.user.emailaddress_set.first().primary, True)
 
+    def test_importing_many_users_takes_as_many_queries_as_one(self):
+        exports = []
+        for i in range(4):
+            ConftoolUser.objects.create(
+                username=f"user{i}", conftool_id=200 + i, synchronized=django.utils.timezone.now()
+            )
+            exports.append(replace(self.data, person_id=200 + i, email=f"u{i}@example.com"))
+        with CaptureQueriesContext(connection) as one:
+            import_all_emails(exports[:1])
+        with CaptureQueriesContext(connection) as many:
+            import_all_emails([self.data] + exports[1:])
+        self.assertEqual(len(many), len(one))
+        self.assertEqual(self.user.emailaddress_set.get(primary=True).email, "c1@example.com")
+        self.assertEqual(ConftoolEmail.objects.filter(primary=True).count(), 5)
+        self.assertEqual(
+            User.objects.get(username="user3").email, "u3@example.com"
+        )
+
     def test_importing_emails_does_not_replace_non_conftool_emails(self):
         EmailAddress.objects.create(user=self.user, email="other@example.com")
         import_emails(self.data)
@@ -182,6 +273,188 @@ class ImportPaperTest(TestCase):
         self.assertIn(json.dumps("author1@example.com"), content)
         self.assertIn(json.dumps("0000-1234-2345-3456"), content)
 
+    def test_reimporting_unchanged_paper_is_skipped(self):
+        import_paper(self.data)
+        doc = import_paper(self.data)
+        self.assertEqual(doc.import_status, PaperImportStatus.UNCHANGED)
+        doc = import_paper(replace(self.data, title="new title"))
+        self.assertEqual(doc.import_status, PaperImportStatus.UPDATED)
+        self.assertEqual(ConftoolDocument.objects.get(conftool_id=234).title, "new title")
+        doc = import_paper(replace(self.data, title="new title"), force=True)
+        self.assertEqual(doc.import_status, PaperImportStatus.UPDATED)
+
+    def test_reimporting_unchanged_paper_updates_access_rights(self):
+        data = replace(self.data, authors=self.data.authors + [
+            PaperAuthor(name="Doe, Jo", organization="", email="author2@example.com", orcid="")
+        ])
+        doc = import_paper(data)
+        synchronized = doc.synchronized
+        self.assertTrue(ConftoolUserInvite.objects.filter(email="author2@example.com").exists())
+        # the second author logs in and verifies their address after the import
+        author = ConftoolUser.objects.create(
+            username="author2", conftool_id=456, synchronized=django.utils.timezone.now()
+        )
+        ConftoolEmail.objects.create(user=author, email="author2@example.com", verified=True)
+        doc = import_paper(data)
+        self.assertEqual(doc.import_status, PaperImportStatus.UNCHANGED)
+        self.assertTrue(ConftoolAccessRight.objects.filter(
+            document=doc, holder_id=author.pk, holder_type__model="user"
+        ).exists())
+        self.assertFalse(ConftoolUserInvite.objects.filter(email="author2@example.com").exists())
+        self.assertEqual(ConftoolDocument.objects.get(pk=doc.pk).owner.pk, self.user.pk)
+        self.assertGreater(ConftoolDocument.objects.get(pk=doc.pk).synchronized, synchronized)
+
+    def test_access_rights_for_verified_and_unverified_authors(self):
+        data = replace(self.data, authors=self.data.authors + [
+            PaperAuthor(name="Doe, Jo", organization="", email="Author2@example.com", orcid="")
+        ])
+        doc = import_paper(data)
+        rights = ConftoolAccessRight.objects.filter(document=doc)
+        self.assertEqual(rights.count(), 2)
+        self.assertTrue(rights.filter(holder_id=self.user.pk, rights="write").exists())
+        invite = ConftoolUserInvite.objects.get(email="author2@example.com")
+        self.assertTrue(rights.filter(holder_id=invite.pk, rights="write").exists())
+        import_paper(data, force=True)
+        self.assertEqual(ConftoolAccessRight.objects.filter(document=doc).count(), 2)
+        self.assertEqual(ConftoolUserInvite.objects.count(), 1)
+        import_paper(self.data, force=True)
+        self.assertEqual(ConftoolAccessRight.objects.filter(document=doc).count(), 1)
+
+    def test_access_right_queries_do_not_depend_on_author_count(self):
+        def queries(count):
+            authors = [
+                PaperAuthor(name=f"Doe, {i}", organization="", email=f"a{i}@example.com", orcid="")
+                for i in range(count)
+            ]
+            doc = import_paper(replace(self.data, authors=authors), force=True)
+            with CaptureQueriesContext(connection) as context:
+                _synchronize_access_rights(doc, [a.email for a in authors])
+            return len(context.captured_queries)
+
+        self.assertEqual(queries(1), queries(10))
+
+    def test_setting_unchanged_content_writes_nothing(self):
+        doc = import_paper(self.data)
+        update = DhdDocumentContentUpdate()
+        update.set_title("paper title")
+        update.set_contribution_type("Presentation")
+        self.assertFalse(update.set_on(doc))
+        update.set_title("changed title")
+        self.assertTrue(update.set_on(doc))
+        self.assertIn(json.dumps("changed title"), json.dumps(doc.content))
+        self.assertIn(json.dumps("the\npaper\nabstract\n"), json.dumps(doc.content))
+
+    @skipUnless(connection.vendor == "postgresql", "compares with the jsonb_set() update")
+    def test_postgresql_content_update_matches_generic_update(self):
+        generic = import_paper(self.data)
+        postgresql = import_paper(replace(self.data, paper_id=235))
+        updates = [DhdDocumentContentUpdate() for _ in range(3)]
+        updates[0].set_title("changed title")
+        updates[0].set_keywords(["k3", "k1"])
+        updates[0].add_contributor("Jo", "Doe", "jo@example.com", "", "")
+        updates[1].set_abstract("changed abstract")
+        updates[1].set_topics(["t1", "t2"])
+        updates[2].set_title("changed title")
+        for update in updates:
+            with transaction.atomic():
+                self.assertEqual(
+                    update._set_on_postgresql(postgresql.pk), update._set_on_generic(generic.pk)
+                )
+            generic.refresh_from_db(fields=("content",))
+            postgresql.refresh_from_db(fields=("content",))
+            self.assertEqual(postgresql.content, generic.content)
+
+    def _tags(self, doc):
+        return set(ConftoolDocumentTag.objects.filter(document=doc).values_list("kind", "value"))
+
+    def test_importing_stores_submission_metadata(self):
+        doc = import_paper(self.data)
+        self.assertEqual(
+            ConftoolDocument.objects.values_list("contribution_type", flat=True).get(pk=doc.pk),
+            "Presentation"
+        )
+        Kind = ConftoolDocumentTag.Kind
+        self.assertEqual(self._tags(doc), {
+            (Kind.KEYWORD, "k1"), (Kind.KEYWORD, "k2"),
+            (Kind.TOPIC, "t1"), (Kind.TOPIC, "t2"),
+            (Kind.ORCID, "0000-1234-2345-3456"),
+        })
+        doc = import_paper(replace(self.data, keywords=["k2", "k3"], contribution_type="Poster"))
+        self.assertEqual(ConftoolDocument.objects.get(pk=doc.pk).contribution_type, "Poster")
+        self.assertEqual(
+            {value for kind, value in self._tags(doc) if kind == Kind.KEYWORD}, {"k2", "k3"}
+        )
+
+    def test_backfilling_metadata_from_content(self):
+        doc = import_paper(self.data)
+        expected = self._tags(doc)
+        ConftoolDocumentTag.objects.all().delete()
+        ConftoolDocument.objects.update(contribution_type="")
+        call_command("dhdconf_backfill_metadata", stdout=StringIO())
+        self.assertEqual(self._tags(doc), expected)
+        self.assertEqual(ConftoolDocument.objects.get(pk=doc.pk).contribution_type, "Presentation")
+
+    def test_admin_filters_submissions_by_metadata(self):
+        import_paper(self.data)
+        import_paper(replace(self.data, paper_id=235, topics=["t3"], keywords=["k3"], authors=[]))
+        model_admin = site._registry[ConftoolDocument]
+        request = RequestFactory().get("/")
+
+        def search(term):
+            queryset, _ = model_admin.get_search_results(request, ConftoolDocument.objects.all(), term)
+            return sorted(queryset.values_list("conftool_id", flat=True))
+
+        self.assertEqual(search("k3"), [235])
+        self.assertEqual(search("0000-1234-2345-3456"), [234])
+        self.assertEqual(search("paper"), [234, 235])
+        topic = TopicListFilter(request, {"topic": ["t3"]}, ConftoolDocument, model_admin)
+        self.assertIn(("t1", "t1"), topic.lookup_choices)
+        self.assertEqual(
+            list(topic.queryset(request, ConftoolDocument.objects.all()).values_list("conftool_id", flat=True)),
+            [235]
+        )
+
+    def test_keywords_and_orcids_are_normalized(self):
+        doc = import_paper(replace(
+            self.data,
+            keywords=["Digital  Humanities", "digital humanities"],
+            authors=[replace(self.data.authors[0], orcid="0000-0002-1825-009x")],
+        ))
+        Kind = ConftoolDocumentTag.Kind
+        self.assertEqual(
+            {(kind, value) for kind, value in self._tags(doc) if kind != Kind.TOPIC},
+            {(Kind.KEYWORD, "digital humanities"), (Kind.ORCID, "0000-0002-1825-009X")},
+        )
+        model_admin = site._registry[ConftoolDocument]
+        for term in ("DIGITAL HUMANITIES", "0000-0002-1825-009x"):
+            queryset, _ = model_admin.get_search_results(None, ConftoolDocument.objects.all(), term)
+            self.assertEqual(list(queryset.values_list("conftool_id", flat=True)), [234])
+
+    def test_bulk_created_inherited_rows_round_trip_through_the_orm(self):
+        doc = import_paper(self.data)
+        emails = _bulk_create_inherited(ConftoolEmail, [
+            EmailAddress(user=self.user, email="bulk@example.com", verified=False, primary=False)
+        ])
+        invites = _bulk_create_inherited(ConftoolUserInvite, [
+            UserInvite(email="invited@example.com", username="invited@example.com", by=self.user)
+        ])
+        rights = _bulk_create_inherited(ConftoolAccessRight, [
+            AccessRight(document_id=doc.pk, holder_type=ContentType.objects.get_by_natural_key(
+                "user", "userinvite"
+            ), holder_id=invites[0].pk, rights="write")
+        ])
+        email = ConftoolEmail.objects.get(pk=emails[0].pk)
+        self.assertEqual((email.email, email.user_id), ("bulk@example.com", self.user.pk))
+        self.assertEqual(email.emailaddress_ptr.email, "bulk@example.com")
+        invite = ConftoolUserInvite.objects.get(pk=invites[0].pk)
+        self.assertEqual(invite.by_id, self.user.pk)
+        self.assertIsNotNone(invite.key)
+        right = ConftoolAccessRight.objects.get(pk=rights[0].pk)
+        self.assertEqual((right.document_id, right.holder_obj), (doc.pk, invite.userinvite_ptr))
+        # deleting the child also deletes the parent row
+        email.delete()
+        self.assertFalse(EmailAddress.objects.filter(pk=emails[0].pk).exists())
+
     def test_that_user_invite_is_applied(self):
         # TODO
         pass
@@ -189,3 +462,757 @@ class ImportPaperTest(TestCase):
     def test_that_user_invite_is_only_applied_with_verified_email(self):
         # TODO
         pass
+
+
+class SyncCommandTest(TestCase):
+
+    def setUp(self):
+        self.user = _user_factory()
+        self.users = [
+            ExportUserResponse(
+                person_id=123,
+                username="username",
+                email="author1@example.com",
+                email_validated=True,
+            ),
+            ExportUserResponse(
+                person_id=999,
+                username="unknown",
+                email="unknown@example.com",
+                email_validated=True,
+            ),
+        ]
+        self.papers = [
+            ExportPaperResponse(
+                paper_id=300 + i,
+                submitting_author_id=123,
+                title=f"paper {i}",
+                topics=[],
+                keywords=[],
+                abstract="",
+                contribution_type="Poster",
+                authors=[PaperAuthor(
+                    name="Jones, Alex",
+                    organization="ORG",
+                    email="author1@example.com",
+                    orcid=""
+                )]
+            ) for i in range(5)
+        ]
+
+    def test_sync_imports_users_and_papers_in_batches(self):
+        out = StringIO()
+        with patch.object(ConftoolClient, "stream_users", return_value=iter(self.users)), \
+                patch.object(ConftoolClient, "stream_papers", return_value=iter(self.papers)):
+            call_command("dhdconf_sync", batch_size=2, stdout=out)
+        self.assertTrue(
+            self.user.emailaddress_set.filter(email="author1@example.com").exists()
+        )
+        self.assertEqual(ConftoolDocument.objects.count(), 5)
+        self.assertIn("4 papers processed, 0 unchanged, 0 skipped, 0 failed", out.getvalue())
+        self.assertIn("5 processed, 5 created, 0 updated, 0 unchanged, 0 skipped, 0 failed", out.getvalue())
+
+    def test_users_of_a_failed_batch_are_imported_one_by_one(self):
+        addresses = importing._conftool_addresses
+
+        def failing_addresses(data):
+            if data.person_id == 999:
+                raise ValueError("bad row")
+            return addresses(data)
+
+        user = ConftoolUser.objects.create(
+            username="unknown", conftool_id=999, synchronized=django.utils.timezone.now()
+        )
+        out = StringIO()
+        with patch.object(ConftoolClient, "stream_users", return_value=iter(self.users)), \
+                patch.object(ConftoolClient, "stream_papers", return_value=iter([])), \
+                patch("dhdconf.conftool.importing._conftool_addresses", failing_addresses):
+            call_command("dhdconf_sync", batch_size=2, stdout=out)
+        self.assertTrue(
+            self.user.emailaddress_set.filter(email="author1@example.com").exists()
+        )
+        self.assertFalse(user.emailaddress_set.exists())
+        self.assertIn("2 processed, 1 failed", out.getvalue())
+        self.assertEqual(
+            list(ImportLog.objects.values_list("error_type", flat=True)),
+            [ImportLog.ErrorType.IMPORT_EMAILS]
+        )
+
+    def test_importing_papers_reports_failures(self):
+        def failing_import(paper, force=False):
+            if paper.paper_id == 400:
+                raise ValueError("bad paper")
+            return import_paper(paper, force=force)
+
+        papers = self.papers + [replace(self.papers[0], paper_id=400)]
+        with patch("dhdconf.conftool.pipeline.import_paper", failing_import):
+            result = import_papers(iter(papers))
+        self.assertEqual(result.processed, 6)
+        self.assertEqual(result.created, 5)
+        self.assertEqual(result.failed, 1)
+        self.assertTrue(ImportLog.objects.filter(conftool_paper_id=400, success=False).exists())
+
+    def test_papers_of_unknown_submitters_are_skipped(self):
+        papers = self.papers + [replace(self.papers[0], paper_id=400, submitting_author_id=999)]
+        out = StringIO()
+        with patch.object(ConftoolClient, "stream_papers", return_value=iter(papers)):
+            call_command("dhdconf_sync", skip_users=True, stdout=out)
+        self.assertIn("6 processed, 5 created, 0 updated, 0 unchanged, 1 skipped, 0 failed", out.getvalue())
+        self.assertFalse(ConftoolDocument.objects.filter(conftool_id=400).exists())
+        self.assertFalse(ImportLog.objects.filter(success=False).exists())
+
+    def test_local_failures_are_not_logged_as_export_errors(self):
+        out = StringIO()
+        with patch.object(ConftoolClient, "stream_papers", return_value=iter(self.papers)), \
+                patch("dhdconf.conftool.pipeline.ConftoolUser.objects.values_list",
+                      side_effect=DatabaseError("database is gone")):
+            with self.assertRaises(DatabaseError):
+                call_command("dhdconf_sync", skip_users=True, stdout=out)
+        self.assertEqual(
+            list(ImportLog.objects.values_list("error_type", flat=True)),
+            [ImportLog.ErrorType.IMPORT_PAPER]
+        )
+
+    def test_conftool_failures_are_logged_as_export_errors(self):
+        with patch.object(ConftoolClient, "stream_papers",
+                          side_effect=requests.exceptions.ConnectionError("conftool is down")):
+            with self.assertRaisesMessage(CommandError, "Exporting papers from conftool failed"):
+                call_command("dhdconf_sync", skip_users=True, stdout=StringIO())
+        self.assertEqual(
+            list(ImportLog.objects.values_list("error_type", flat=True)),
+            [ImportLog.ErrorType.EXPORT_PAPERS]
+        )
+
+    def _import_with_workers(self, papers, **kwargs):
+        # the workers only hand papers around, nothing needs a second connection
+        with patch("dhdconf.conftool.pipeline.connection", MagicMock(vendor="postgresql")), \
+                patch("dhdconf.conftool.pipeline.connections"), \
+                patch("dhdconf.conftool.pipeline._import_logged",
+                      return_value=PaperImportStatus.CREATED) as imported:
+            return import_papers(iter(papers), workers=3, **kwargs), imported
+
+    def test_importing_papers_with_workers(self):
+        result, imported = self._import_with_workers(range(50))
+        self.assertEqual(result.processed, 50)
+        self.assertEqual(result.created, 50)
+        self.assertEqual(sorted(call.args[0] for call in imported.call_args_list), list(range(50)))
+
+    def test_worker_errors_are_raised_in_the_caller(self):
+        def progress(result):
+            raise ValueError("progress failed")
+
+        with self.assertRaisesMessage(ValueError, "progress failed"):
+            # many more papers than fit into the queue, the caller must not wait
+            # for the failed workers to take them
+            self._import_with_workers(range(1000), progress=progress, progress_every=1)
+
+
+class RefreshJobTest(RequestTestCase):
+
+    def test_refreshes_are_coalesced_while_in_flight(self):
+        task = MagicMock(return_value=(True, "OK_NO_PAPERS"))
+        with self.captureOnCommitCallbacks() as callbacks:
+            job, created = jobs.enqueue(self.request, task)
+            again, created_again = jobs.enqueue(self.request, task)
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(job.pk, again.pk)
+        self.assertEqual(self.request.import_log_id, job.request_id)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_finished_jobs_are_not_coalesced(self):
+        task = MagicMock(return_value=(True, "OK_NO_PAPERS"))
+        job, _ = jobs.enqueue(self.request, task)
+        RefreshJob.objects.filter(pk=job.pk).update(status=RefreshJob.Status.DONE)
+        again, created = jobs.enqueue(self.request, task)
+        self.assertTrue(created)
+        self.assertNotEqual(job.pk, again.pk)
+
+    @patch("dhdconf.jobs.connections")
+    @patch("dhdconf.views._refresh_papers", return_value=(False, "ERROR_EXPORTING_PAPERS"))
+    def test_jobs_log_with_the_job_request_id_without_the_request(self, refresh, _):
+        task = functools.partial(_refresh_papers_job, self.user.pk, self.request.path)
+        job, _ = jobs.enqueue(self.request, task)
+        jobs._run(job.pk, task)
+        context, user, _ = refresh.call_args.args
+        self.assertEqual(context, ImportLogContext(job.request_id, user, self.request.path))
+        self.assertEqual(RefreshJob.objects.get(pk=job.pk).status, RefreshJob.Status.FAILED)
+
+    def test_finished_jobs_are_pruned(self):
+        job, _ = jobs.enqueue(self.request, MagicMock())
+        RefreshJob.objects.filter(pk=job.pk).update(
+            status=RefreshJob.Status.DONE,
+            updated=django.utils.timezone.now() - timedelta(days=30),
+        )
+        call_command("dhdconf_prune_logs", stdout=StringIO())
+        self.assertFalse(RefreshJob.objects.exists())
+
+
+class DatabaseNonceTest(TestCase):
+
+    @patch("dhdconf.conftool.nonce.clock_nonce", return_value=6000)
+    def test_database_nonces_increase_with_a_stopped_clock(self, _):
+        first, second = database_nonce(), database_nonce()
+        self.assertGreaterEqual(first, 6000)
+        self.assertEqual(second, first + 1)
+
+    @skipUnless(connection.vendor == "postgresql", "allocates on its own connection")
+    def test_database_nonce_does_not_lock_the_row_for_the_transaction(self):
+        # the test runs inside a transaction, like a request with ATOMIC_REQUESTS
+        nonce = database_nonce()
+        other = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    "SELECT value FROM dhdconf_conftoolnonce WHERE id = 1 FOR UPDATE NOWAIT"
+                )
+                self.assertEqual(cursor.fetchone()[0], nonce)
+        finally:
+            other.close()
+
+
+class TemplateCacheTest(TestCase):
+
+    def tearDown(self):
+        invalidate_template_cache()
+
+    def test_template_is_served_from_cache_within_the_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cached_dhd_document_template()
+        template, content = cached_dhd_document_template()
+        with self.assertNumQueries(0):
+            cached, cached_content = cached_dhd_document_template()
+        self.assertEqual(cached.pk, template.pk)
+        self.assertEqual(cached_content, content)
+        cached_content["content"].clear()
+        self.assertEqual(cached_dhd_document_template()[1], content)
+
+    def test_uncommitted_template_is_not_cached(self):
+        cached_dhd_document_template()
+        cached_dhd_document_template()
+        self.assertIsNone(template_module._cache)
+
+    def test_saving_the_template_invalidates_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cached_dhd_document_template()
+        template, _ = cached_dhd_document_template()
+        template.title = "changed"
+        template.save()
+        self.assertEqual(cached_dhd_document_template()[0].title, "changed")
+
+    def test_template_read_before_an_invalidation_is_not_stored(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cached_dhd_document_template()
+        invalidate_template_cache()
+        ensure = template_module.ensure_dhd_document_template
+
+        def ensure_and_invalidate():
+            template = ensure()
+            invalidate_template_cache()
+            return template
+
+        with patch.object(template_module, "ensure_dhd_document_template", ensure_and_invalidate):
+            cached_dhd_document_template()
+        self.assertIsNone(template_module._cache)
+
+
+class ImportLogBufferTest(RequestTestCase):
+    path = "/api/dhdconf/refresh_conftool_user/"
+
+    def test_entries_are_written_together_when_the_block_ends(self):
+        with buffered_import_log():
+            for i in range(3):
+                import_log_error(ImportLog.ErrorType.IMPORT_PAPER, ValueError(i), self.request)
+            self.assertEqual(ImportLog.objects.count(), 0)
+            with CaptureQueriesContext(connection) as queries:
+                current_buffer().flush()
+        # besides storing the shared trace
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if query["sql"].startswith('INSERT INTO "dhdconf_importlog" ')
+        ]), 1)
+        self.assertEqual(
+            list(ImportLog.objects.values_list("request_id", flat=True).distinct()),
+            [self.request.import_log_id]
+        )
+
+    def test_entries_are_written_when_the_block_fails(self):
+        with self.assertRaises(RuntimeError):
+            with buffered_import_log():
+                import_log_error(ImportLog.ErrorType.EXPORT_USER, ValueError(), self.request)
+                raise RuntimeError()
+        self.assertEqual(ImportLog.objects.count(), 1)
+        self.assertIsNone(current_buffer())
+
+    def test_full_buffers_are_flushed(self):
+        buffer = ImportLogBuffer(size=2)
+        with buffered_import_log(buffer):
+            for i in range(5):
+                import_log(self.request, success=True)
+            self.assertEqual(ImportLog.objects.count(), 4)
+        buffer.flush()
+        self.assertEqual(ImportLog.objects.count(), 5)
+
+    def test_old_entries_are_flushed(self):
+        buffer = ImportLogBuffer(size=100, seconds=5)
+        with buffered_import_log(buffer), \
+                patch("dhdconf.conftool.logbuffer.time.monotonic", side_effect=[0, 1, 6]):
+            for i in range(3):
+                import_log(self.request, success=True)
+            self.assertEqual(ImportLog.objects.count(), 3)
+
+    def test_old_entries_are_flushed_on_progress_without_further_entries(self):
+        papers = [MagicMock(paper_id=i) for i in range(3)]
+        statuses = iter([None, PaperImportStatus.CREATED, PaperImportStatus.CREATED])
+
+        def import_logged(paper, force, submitters):
+            status = next(statuses)
+            if status is None:
+                import_log_error(ImportLog.ErrorType.IMPORT_PAPER, ValueError(), self.request)
+            return status
+
+        buffer = ImportLogBuffer(size=100, seconds=5)
+        with buffered_import_log(buffer), \
+                patch("dhdconf.conftool.pipeline._import_logged", import_logged), \
+                patch("dhdconf.conftool.logbuffer.time.monotonic", side_effect=[0, 1, 6]):
+            import_papers(iter(papers))
+            self.assertEqual(ImportLog.objects.count(), 1)
+
+
+def _raise(message):
+    raise ValueError(message)
+
+
+class ImportLogTraceTest(TestCase):
+
+    def _log_error(self, message):
+        try:
+            _raise(message)
+        except ValueError as e:
+            return import_log_error(ImportLog.ErrorType.IMPORT_PAPER, e)
+
+    def test_errors_raised_the_same_way_share_a_trace(self):
+        with buffered_import_log():
+            for i in range(3):
+                self._log_error(f"paper {i}")
+        self._log_error("another paper")
+        trace = ImportLogTrace.objects.get()
+        self.assertEqual(trace.occurrences, 4)
+        self.assertEqual(trace.error_class, "builtins.ValueError")
+        self.assertIn("paper 0", trace.stacktrace)
+        self.assertEqual(ImportLog.objects.filter(trace=trace).count(), 4)
+
+    def test_errors_raised_elsewhere_get_their_own_trace(self):
+        self._log_error("paper")
+        import_log_error(ImportLog.ErrorType.IMPORT_PAPER, ValueError("paper"))
+        self.assertEqual(ImportLogTrace.objects.count(), 2)
+
+    def test_pruning_old_entries(self):
+        old = django.utils.timezone.now() - timedelta(days=30)
+        self._log_error("old")
+        import_log(success=True)
+        ImportLog.objects.update(added=old)
+        ImportLogTrace.objects.update(last_seen=old)
+        recent = self._log_error("recent")
+        call_command(
+            "dhdconf_prune_logs", "--days", "60", "--success-days", "7", stdout=StringIO()
+        )
+        self.assertEqual(ImportLog.objects.count(), 2)
+        self.assertFalse(ImportLog.objects.filter(success=True).exists())
+        call_command("dhdconf_prune_logs", "--days", "7", stdout=StringIO())
+        self.assertEqual(list(ImportLog.objects.values_list("pk", flat=True)), [recent.pk])
+        self.assertEqual(ImportLogTrace.objects.count(), 1)
+
+
+class ImportLogAdminTest(RequestTestCase):
+    path = "/admin/dhdconf/importlog/"
+
+    def setUp(self):
+        super().setUp()
+        self.admin = ImportLogAdmin(ImportLog, site)
+        self.request.import_log_id = "ABCD2345"
+        self.error = import_log_error(
+            ImportLog.ErrorType.IMPORT_PAPER, ValueError("Conftool is down"), self.request,
+            paper=MagicMock(paper_id=42)
+        )
+        import_log(success=True)
+
+    def _search(self, term):
+        queryset, _ = self.admin.get_search_results(None, ImportLog.objects.all(), term)
+        return list(queryset)
+
+    def test_search_by_indexed_columns(self):
+        self.assertEqual(self._search("abcd2345"), [self.error])
+        self.assertEqual(self._search("42"), [self.error])
+        self.assertEqual(self._search("/admin/dhdconf"), [self.error])
+        self.assertEqual(self._search("is down"), [self.error])
+        self.assertEqual(self._search("elsewhere"), [])
+        # too short for the trigram index
+        self.assertEqual(self._search("is"), [])
+
+    def test_small_tables_are_counted_exactly(self):
+        paginator = EstimatedCountPaginator(ImportLog.objects.order_by("pk"), 10)
+        self.assertEqual(paginator.count, 2)
+
+
+class ImportHealthTest(RequestTestCase):
+
+    def test_log_entries_are_rolled_up_per_hour(self):
+        import_log(self.request, success=True)
+        for _ in range(2):
+            import_log_error(ImportLog.ErrorType.EXPORT_PAPERS, ValueError(), self.request)
+        import_log_error(ImportLog.ErrorType.EXPORT_PAPERS, ValueError())
+        old = ImportLog.objects.create(error_type=ImportLog.ErrorType.IMPORT_PAPER)
+        ImportLog.objects.filter(pk=old.pk).update(
+            added=django.utils.timezone.now() - timedelta(hours=3)
+        )
+        self.assertEqual(rollup_import_health(), 4)
+        exports = ImportHealth.objects.get(error_type=ImportLog.ErrorType.EXPORT_PAPERS, path="")
+        self.assertEqual((exports.failures, exports.users), (1, 0))
+        exports = ImportHealth.objects.get(
+            error_type=ImportLog.ErrorType.EXPORT_PAPERS, path=self.request.path
+        )
+        self.assertEqual((exports.successes, exports.failures, exports.users), (0, 2, 1))
+        summary = import_health(hours=1)["error_types"]
+        self.assertEqual(summary["EP"]["failures"], 3)
+        self.assertEqual(summary["OK"]["successes"], 1)
+        self.assertNotIn("IP", summary)
+
+    def test_rollups_are_recomputed_from_the_latest_hour(self):
+        import_log_error(ImportLog.ErrorType.EXPORT_USER, ValueError(), self.request)
+        rollup_import_health()
+        import_log_error(ImportLog.ErrorType.EXPORT_USER, ValueError(), self.request)
+        rollup_import_health()
+        self.assertEqual(ImportHealth.objects.get().failures, 2)
+
+    def _log_at(self, added):
+        log = import_log_error(ImportLog.ErrorType.EXPORT_USER, ValueError(), self.request)
+        ImportLog.objects.filter(pk=log.pk).update(added=added)
+
+    def test_late_entries_of_the_previous_hour_are_rolled_up(self):
+        import_log_error(ImportLog.ErrorType.EXPORT_USER, ValueError(), self.request)
+        rollup_import_health()
+        previous_hour = django.utils.timezone.now() - timedelta(hours=1)
+        self._log_at(previous_hour)
+        rollup_import_health()
+        self.assertEqual(ImportHealth.objects.get(hour__lt=previous_hour).failures, 1)
+
+    def test_pruned_hours_keep_their_counts(self):
+        pruned = django.utils.timezone.now() - timedelta(
+            days=settings.CONFTOOL_IMPORT_LOG_SUCCESS_RETENTION_DAYS, hours=2
+        )
+        self._log_at(pruned)
+        ImportHealth.objects.create(
+            hour=pruned.replace(minute=0, second=0, microsecond=0),
+            error_type=ImportLog.ErrorType.EXPORT_USER,
+            path=self.request.path,
+            failures=5,
+        )
+        call_command("dhdconf_rollup_health", full=True, stdout=StringIO())
+        self.assertEqual(ImportHealth.objects.get().failures, 5)
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        caches[settings.CONFTOOL_REFRESH_CACHE].clear()
+
+    def tearDown(self):
+        caches[settings.CONFTOOL_REFRESH_CACHE].clear()
+
+    def test_results_are_reused_for_a_while(self):
+        refresh = MagicMock(return_value=(True, "OK_ALL_PAPERS"))
+        self.assertEqual(single_flight("papers", 123, refresh), (True, "OK_ALL_PAPERS"))
+        self.assertEqual(single_flight("papers", 123, refresh), (True, "OK_ALL_PAPERS"))
+        refresh.assert_called_once()
+        single_flight("papers", 456, refresh)
+        single_flight("user", 123, refresh)
+        self.assertEqual(refresh.call_count, 3)
+
+    def test_failures_are_not_reused(self):
+        refresh = MagicMock(return_value=(False, "ERROR_EXPORTING_PAPERS"))
+        for _ in range(2):
+            self.assertEqual(
+                single_flight("papers", 123, refresh, succeeded=lambda r: r[0]),
+                (False, "ERROR_EXPORTING_PAPERS"),
+            )
+        self.assertEqual(refresh.call_count, 2)
+
+    def test_concurrent_refreshes_get_the_failure_they_waited_for(self):
+        started = threading.Event()
+        waiting = threading.Event()
+        finish = threading.Event()
+        refresh = MagicMock(return_value=(True, "OK_ALL_PAPERS"))
+
+        def failing_refresh():
+            started.set()
+            finish.wait(5)
+            return (False, "ERROR_EXPORTING_PAPERS")
+
+        flight = singleflight._flight
+
+        def entering_flight(*args):
+            if threading.current_thread().name == "second":
+                waiting.set()
+            return flight(*args)
+
+        def in_thread(results, refresh):
+            try:
+                results.append(single_flight("papers", 123, refresh, succeeded=lambda r: r[0]))
+            finally:
+                connection.close()
+
+        results = []
+        first = threading.Thread(target=in_thread, args=(results, failing_refresh), name="first")
+        second = threading.Thread(target=in_thread, args=(results, refresh), name="second")
+        with patch.object(singleflight, "_flight", entering_flight):
+            first.start()
+            started.wait(5)
+            second.start()
+            waiting.wait(5)
+            finish.set()
+            first.join()
+            second.join()
+        self.assertEqual(results, [(False, "ERROR_EXPORTING_PAPERS")] * 2)
+        refresh.assert_not_called()
+        # a later refresh runs again
+        self.assertEqual(
+            single_flight("papers", 123, refresh, succeeded=lambda r: r[0]), (True, "OK_ALL_PAPERS")
+        )
+
+    def test_concurrent_refreshes_wait_for_the_running_one(self):
+        started = threading.Event()
+        waiting = threading.Event()
+        finish = threading.Event()
+        fetches = []
+
+        def refresh():
+            fetches.append(threading.current_thread().name)
+            started.set()
+            finish.wait(5)
+            return "fetched"
+
+        flight = singleflight._flight
+
+        def entering_flight(*args):
+            # the second refresh has missed the cache, the first has not finished
+            if threading.current_thread().name == "second":
+                waiting.set()
+            return flight(*args)
+
+        def in_thread(results):
+            try:
+                results.append(single_flight("papers", 123, refresh))
+            finally:
+                connection.close()
+
+        results = []
+        first = threading.Thread(target=in_thread, args=(results,), name="first")
+        second = threading.Thread(target=in_thread, args=(results,), name="second")
+        with patch.object(singleflight, "_flight", entering_flight):
+            first.start()
+            started.wait(5)
+            second.start()
+            waiting.wait(5)
+            finish.set()
+            first.join()
+            second.join()
+        self.assertEqual(fetches, ["first"])
+        self.assertEqual(results, ["fetched", "fetched"])
+
+
+class RefreshUserTest(RequestTestCase):
+    path = "/api/dhdconf/refresh_conftool_user/"
+
+    def setUp(self):
+        super().setUp()
+        self.client_mock = MagicMock()
+        self.client_mock.user_info.return_value = _mock_user_info(None, None)
+        self.client_mock.export_user.return_value = _mock_user_export(None, None)
+
+    def _refresh(self):
+        with patch("dhdconf.views._client", return_value=self.client_mock):
+            return _refresh_user(self.request, self.user)
+
+    def test_export_and_user_info_run_at_once(self):
+        info_started = threading.Event()
+        overlapped = []
+
+        def user_info(username):
+            info_started.set()
+            return _mock_user_info(None, None)
+
+        def export_user(conftool_id):
+            # blocks until the user info has been requested as well
+            overlapped.append(info_started.wait(5))
+            return _mock_user_export(None, None)
+
+        self.client_mock.user_info.side_effect = user_info
+        self.client_mock.export_user.side_effect = export_user
+        ok, message, _ = self._refresh()
+        self.assertEqual((ok, message), (True, "OK_USERDATA"))
+        self.assertEqual(overlapped, [True])
+        self.client_mock.user_info.assert_called_once_with("username")
+        self.assertTrue(ConftoolEmail.objects.filter(email="user@example.com").exists())
+
+    def test_user_info_is_requested_again_for_renamed_users(self):
+        self.client_mock.export_user.return_value = replace(
+            _mock_user_export(None, None), username="renamed"
+        )
+        ok, message, _ = self._refresh()
+        self.assertEqual((ok, message), (True, "OK_USERDATA"))
+        self.assertEqual(
+            [c.args for c in self.client_mock.user_info.call_args_list], [("username",), ("renamed",)]
+        )
+
+    def test_unknown_stored_usernames_are_requested_by_the_exported_one(self):
+        def user_info(username):
+            if username == "username":
+                raise ConftoolUnknownUserException("user name unknown")
+            return replace(_mock_user_info(None, None), username=username)
+
+        self.client_mock.user_info.side_effect = user_info
+        self.client_mock.export_user.return_value = replace(
+            _mock_user_export(None, None), username="renamed"
+        )
+        ok, message, _ = self._refresh()
+        self.assertEqual((ok, message), (True, "OK_USERDATA"))
+        self.assertEqual(ConftoolUser.objects.get(pk=self.user.pk).username, "renamed")
+
+    def test_failures_are_attributed_to_their_request(self):
+        self.client_mock.export_user.side_effect = ValueError("export failed")
+        ok, message, _ = self._refresh()
+        self.assertFalse(ok)
+        self.assertEqual(
+            list(ImportLog.objects.values_list("error_type", flat=True)),
+            [ImportLog.ErrorType.EXPORT_USER]
+        )
+
+
+class BenchmarkTest(TestCase):
+
+    def test_benchmarks_leave_no_rows_behind(self):
+        results = benchmark_importing.run(papers=2, authors=[2], repeat=4)
+        self.assertTrue(all(r["seconds"] >= 0 for r in results))
+        queries = {r["key"]: r["queries_per_call"] for r in results}
+        self.assertLess(
+            queries["import_paper[papers=2,authors=2,path=unchanged]"],
+            queries["import_paper[papers=2,authors=2,path=created]"],
+        )
+        self.assertFalse(ConftoolUser.objects.exists())
+        self.assertFalse(ConftoolDocument.objects.exists())
+
+    def test_benchmarks_use_conftool_ids_above_existing_ones(self):
+        user = _user_factory()
+        document = ConftoolDocument.objects.create(
+            conftool_id=1,
+            synchronized=django.utils.timezone.now(),
+            template=cached_dhd_document_template()[0],
+            owner=user,
+            content={},
+            title="real paper",
+        )
+        # the first synthetic paper would otherwise update the existing one
+        created, unchanged, _ = benchmark_importing.bench_import_paper(papers=2, authors=1)
+        self.assertGreater(created["queries_per_call"], unchanged["queries_per_call"])
+        self.assertEqual(ConftoolDocument.objects.get().title, document.title)
+        self.assertEqual(ConftoolUser.objects.get().pk, user.pk)
+
+
+@override_settings(CONFTOOL_QUERY_BUDGETS="raise")
+@patch.object(ConftoolClient, 'login', _mock_login)
+@patch.object(ConftoolClient, 'user_info', _mock_user_info)
+class QueryBudgetTest(TestCase):
+
+    def _paper(self, authors: int, paper_id: int = 234) -> ExportPaperResponse:
+        return ExportPaperResponse(
+            paper_id=paper_id,
+            submitting_author_id=123,
+            title="paper title",
+            topics=["t1"],
+            keywords=["k1"],
+            abstract="abstract",
+            contribution_type="Presentation",
+            authors=[
+                PaperAuthor(name=f"Jones{i}, Alex", organization="ORG", email=f"author{i}@example.com", orcid="")
+                for i in range(authors)
+            ]
+        )
+
+    def test_query_shapes_ignore_values_and_list_lengths(self):
+        self.assertEqual(
+            query_shape('SELECT "id" FROM "t" WHERE "email" IN (%s, %s) AND "n" = 5'),
+            query_shape('SELECT "id" FROM "t" WHERE "email" IN (%s) AND "n" = 7'),
+        )
+        self.assertEqual(
+            query_shape('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            ("t", 'INSERT INTO "t" ("a", "b") VALUES (...)')
+        )
+
+    def test_recorder_groups_queries_by_table(self):
+        _user_factory()
+        with QueryRecorder() as recorder:
+            for i in range(3):
+                ConftoolUser.objects.filter(conftool_id=i).first()
+        self.assertEqual(len(recorder), 3)
+        self.assertEqual(len(recorder.shapes), 1)
+        self.assertEqual(recorder.by_table()["dhdconf_conftooluser"], 3)
+
+    def _queries(self, call) -> int:
+        with QueryRecorder() as recorder:
+            call()
+        return len(recorder)
+
+    def _paper_queries(self, authors: int, paper_id: int) -> list:
+        # created, unchanged and updated
+        return [
+            self._queries(lambda: import_paper(self._paper(authors, paper_id))),
+            self._queries(lambda: import_paper(self._paper(authors, paper_id))),
+            self._queries(lambda: import_paper(self._paper(authors, paper_id), force=True)),
+        ]
+
+    def test_importing_papers_takes_the_same_queries_for_any_number_of_authors(self):
+        _user_factory()
+        # the first document creation reads the template
+        cached_dhd_document_template()
+        self.assertEqual(self._paper_queries(1, 234), self._paper_queries(20, 235))
+
+    def _email_queries(self, count: int, first_id: int) -> int:
+        users = [
+            ConftoolUser.objects.create(
+                username=f"user{i}", conftool_id=i, synchronized=django.utils.timezone.now()
+            )
+            for i in range(first_id, first_id + count)
+        ]
+        return self._queries(lambda: import_all_emails([
+            ExportUserResponse(
+                person_id=user.conftool_id,
+                username=user.username,
+                email=f"{user.username}@example.com",
+                email_validated=True,
+            )
+            for user in users
+        ]))
+
+    def test_importing_emails_takes_the_same_queries_for_any_number_of_users(self):
+        self.assertEqual(self._email_queries(1, 200), self._email_queries(11, 300))
+
+    def test_logging_in_a_new_user_stays_within_budget(self):
+        self.assertIsNotNone(ConftoolBackend().authenticate(None, 'username', 'password'))
+        self.assertIsNotNone(ConftoolBackend().authenticate(None, 'username', 'password'))
+
+    def test_exceeding_a_budget_fails_in_tests(self):
+        _user_factory()
+        with patch.dict(BUDGETS, {"import_paper": 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                import_paper(self._paper(1))
+
+    @override_settings(CONFTOOL_QUERY_BUDGETS="log")
+    def test_exceeding_a_budget_is_logged_in_production(self):
+        _user_factory()
+        with patch.dict(BUDGETS, {"import_paper": 1}):
+            doc = import_paper(self._paper(1))
+        self.assertEqual(doc.import_status, PaperImportStatus.CREATED)
+        log = ImportLog.objects.get(error_type=ImportLog.ErrorType.QUERY_BUDGET)
+        self.assertTrue(log.success)
+        self.assertIn("import_paper issued", log.message)
@@ -8,11 +8,26 @@ urlpatterns = [
         views.refresh_conftool_papers,
         name="refresh_conftool_papers"
     ),
+    path(
+        "refresh_conftool_papers/<str:request_id>/",
+        views.refresh_conftool_papers_status,
+        name="refresh_conftool_papers_status"
+    ),
     path(
         "refresh_conftool_user/",
         views.refresh_conftool_user,
         name="refresh_conftool_user"
     ),
+    path(
+        "conftool_metrics/",
+        views.conftool_metrics,
+        name="conftool_metrics"
+    ),
+    path(
+        "import_health/",
+        views.import_health,
+        name="import_health"
+    ),
     path(
         "tei_export_settings",
         views.tei_export_settings,
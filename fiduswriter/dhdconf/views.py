@@ -1,3 +1,7 @@
+import functools
+import os
+from typing import List, Tuple
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
@@ -5,20 +9,22 @@ from django.views.decorators.http import require_POST, require_GET
 from django.utils.translation import gettext_lazy as _
 
 from base.decorators import ajax_required
-from dhdconf.conftool.api import ConftoolClient
+from dhdconf import health, jobs
+from dhdconf.conftool.api import ConftoolUnknownUserException, UserInfoResponse
+from dhdconf.conftool.metrics import client_metrics
 from dhdconf.conftool.importing import import_paper, import_emails, import_user_info
-from dhdconf.conftool.util import import_log_error, import_log
-from dhdconf.models import ConftoolUser, ImportLog
+from dhdconf.conftool.logbuffer import buffered_import_log
+from dhdconf.conftool.util import import_log_error, import_log, conftool_client, \
+    submit_conftool_call, ImportLogContext
+from dhdconf.models import ConftoolUser, ImportLog, RefreshJob
+from dhdconf.singleflight import single_flight
 
 
 ErrorType = ImportLog.ErrorType
 
 
 def _client():
-    return ConftoolClient(
-        service_url=settings.CONFTOOL_URL,
-        secret=settings.CONFTOOL_APIPASS,
-    )
+    return conftool_client()
 
 def _conftool_user(request):
     # A ConftoolUser should have been set on authentication, try to fetch one if not
@@ -40,89 +46,176 @@ class UserMessage:
     ERROR_USERDATA = _("Could not retrieve or import all user data")
 
 
-@login_required
-@ajax_required
-@require_POST
-def refresh_conftool_papers(request):
+def _refresh_papers(request, user, job=None) -> Tuple[bool, str]:
     ok = True
     failures = 0
     papers = []
-    if user := _conftool_user(request):
+    try:
+        papers = _client().export_papers([user.conftool_id])
+    except Exception as e:
+        ok = False
+        import_log_error(ErrorType.EXPORT_PAPERS, e, request)
+    if job:
+        jobs.report_progress(job, total=len(papers))
+    for done, paper in enumerate(papers, start=1):
         try:
-            papers = _client().export_papers([user.conftool_id])
+            import_paper(paper)
         except Exception as e:
+            failures += 1
             ok = False
-            import_log_error(ErrorType.EXPORT_PAPERS, e, request)
-        for paper in papers:
-            try:
-                import_paper(paper)
-            except Exception as e:
-                failures += 1
-                ok = False
-                import_log_error(ErrorType.IMPORT_PAPER, e, request, paper=paper)
-        if ok:
-            import_log(request, success=True)
-            if len(papers) > 0:
-                message = UserMessage.OK_ALL_PAPERS
-            else:
-                message = UserMessage.OK_NO_PAPERS
+            import_log_error(ErrorType.IMPORT_PAPER, e, request, paper=paper)
+        if job:
+            jobs.report_progress(job, done=done, failures=failures)
+    if ok:
+        import_log(request, success=True)
+        if len(papers) > 0:
+            message = "OK_ALL_PAPERS"
         else:
-            if failures == 0:
-                message = UserMessage.ERROR_EXPORTING_PAPERS
-            else:
-                message = UserMessage.ERROR_SOME_PAPERS
+            message = "OK_NO_PAPERS"
+    else:
+        if failures == 0:
+            message = "ERROR_EXPORTING_PAPERS"
+        else:
+            message = "ERROR_SOME_PAPERS"
+    return ok, message
+
+
+def _refresh_papers_job(user_id: int, path: str, job: RefreshJob) -> Tuple[bool, str]:
+    # Runs after the response was sent, so it gets ids instead of the request
+    user = ConftoolUser.objects.get(pk=user_id)
+    return _refresh_papers(ImportLogContext(job.request_id, user, path), user, job)
+
+
+def _succeeded(result: tuple) -> bool:
+    # refresh results start with whether the refresh succeeded
+    return result[0]
+
+
+@login_required
+@ajax_required
+@require_POST
+@buffered_import_log()
+def refresh_conftool_papers(request):
+    if user := _conftool_user(request):
+        if settings.CONFTOOL_ASYNC_REFRESH:
+            job, _ = jobs.enqueue(
+                request, functools.partial(_refresh_papers_job, user.pk, request.path)
+            )
+            return JsonResponse(data=_job_data(job), status=202)
+        # concurrent refreshes of the same user share one result
+        ok, message, request_id = single_flight(
+            "papers",
+            user.conftool_id,
+            lambda: (*_refresh_papers(request, user), request.import_log_id),
+            succeeded=_succeeded,
+        )
         return JsonResponse(
-            data=dict(requestId=request.import_log_id, message=message),
+            data=dict(requestId=request_id, message=getattr(UserMessage, message)),
             status=200 if ok else 500
         )
     else:
         return JsonResponse({}, status=404)
 
 
+def _job_data(job: RefreshJob) -> dict:
+    data = dict(
+        requestId=job.request_id,
+        finished=not job.in_flight(),
+        total=job.papers_total,
+        done=job.papers_done,
+        failures=job.failures,
+    )
+    if job.message:
+        data["message"] = getattr(UserMessage, job.message)
+    return data
+
+
 @login_required
 @ajax_required
-@require_POST
-def refresh_conftool_user(request):
+@require_GET
+def refresh_conftool_papers_status(request, request_id):
+    job = RefreshJob.objects.filter(request_id=request_id, user_id=request.user.pk).first()
+    if not job:
+        return JsonResponse({}, status=404)
+    if job.in_flight():
+        status = 202
+    else:
+        status = 200 if job.status == RefreshJob.Status.DONE else 500
+    return JsonResponse(data=_job_data(job), status=status)
+
+
+def _fetch_user_info(client, user, user_data, info) -> UserInfoResponse:
+    # The user info was requested by the stored username together with the export.
+    # If the user was renamed in conftool, it is requested again by the exported one.
+    renamed = user_data is not None and user_data.username != user.username
+    try:
+        user_info = info.result()
+    except ConftoolUnknownUserException:
+        if not renamed:
+            raise
+        user_info = None
+    if renamed:
+        user_info = client.user_info(user_data.username)
+    return user_info
+
+
+def _refresh_user(request, user) -> Tuple[bool, str, List[str]]:
     ok = True
     user_data = None
     user_info = None
-    if user := _conftool_user(request):
+    client = _client()
+    # both conftool calls run at once, the user info in the background
+    info = submit_conftool_call(client.user_info, user.username)
+    try:
+        user_data = client.export_user(user.conftool_id)
+    except Exception as e:
+        ok = False
+        import_log_error(ErrorType.EXPORT_USER, e, request)
+    if user_data:
         try:
-            user_data = _client().export_user(user.conftool_id)
+            import_emails(user_data)
         except Exception as e:
             ok = False
-            import_log_error(ErrorType.EXPORT_USER, e, request)
-        if user_data:
-            try:
-                user_info = _client().user_info(user_data.username)
-            except Exception as e:
-                ok = False
-                import_log_error(ErrorType.FETCH_USERINFO, e, request)
-            try:
-                import_emails(user_data)
-            except Exception as e:
-                ok = False
-                import_log_error(ErrorType.IMPORT_EMAILS, e, request)
-        if user_info:
-            try:
-                import_user_info(user, user_info)
-            except Exception as e:
-                ok = False
-                import_log_error(ErrorType.IMPORT_USERINFO, e, request)
-        if ok:
-            import_log(request, success=True)
-            message = UserMessage.OK_USERDATA
-            unvalidated_emails = [i for i in [
-                user_data.email if not user_data.email_validated else "",
-                user_data.email2 if not user_data.email2_validated else "",
-            ] if i]
-        else:
-            message = UserMessage.ERROR_USERDATA
-            unvalidated_emails = []
+            import_log_error(ErrorType.IMPORT_EMAILS, e, request)
+        try:
+            user_info = _fetch_user_info(client, user, user_data, info)
+        except Exception as e:
+            ok = False
+            import_log_error(ErrorType.FETCH_USERINFO, e, request)
+    if user_info:
+        try:
+            import_user_info(user, user_info)
+        except Exception as e:
+            ok = False
+            import_log_error(ErrorType.IMPORT_USERINFO, e, request)
+    if ok:
+        import_log(request, success=True)
+        unvalidated_emails = [i for i in [
+            user_data.email if not user_data.email_validated else "",
+            user_data.email2 if not user_data.email2_validated else "",
+        ] if i]
+        return ok, "OK_USERDATA", unvalidated_emails
+    else:
+        return ok, "ERROR_USERDATA", []
+
+
+@login_required
+@ajax_required
+@require_POST
+@buffered_import_log()
+def refresh_conftool_user(request):
+    if user := _conftool_user(request):
+        # concurrent refreshes of the same user share one result
+        ok, message, unvalidated_emails, request_id = single_flight(
+            "user",
+            user.conftool_id,
+            lambda: (*_refresh_user(request, user), request.import_log_id),
+            succeeded=_succeeded,
+        )
         return JsonResponse(
             data=dict(
-                requestId=request.import_log_id,
-                message=message,
+                requestId=request_id,
+                message=getattr(UserMessage, message),
                 unvalidatedEmails=unvalidated_emails,
             ),
             status=200 if ok else 500
@@ -140,3 +233,24 @@ def tei_export_settings(request):
             publicationStmt=settings.TEI_EXPORT_PUBLICATION_STATEMENT
         )
     )
+
+
+@login_required
+@require_GET
+def conftool_metrics(request):
+    # Metrics are collected per process, so this only reports the answering worker
+    if not request.user.is_staff:
+        return JsonResponse({}, status=403)
+    return JsonResponse(data=dict(pid=os.getpid(), commands=client_metrics.snapshot()))
+
+
+@login_required
+@require_GET
+def import_health(request):
+    if not request.user.is_staff:
+        return JsonResponse({}, status=403)
+    try:
+        hours = int(request.GET.get("hours", 1))
+    except ValueError:
+        return JsonResponse({}, status=400)
+    return JsonResponse(data=health.import_health(hours))